@@ -0,0 +1,337 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Microbenchmarks of the catalogue of the ``libcloud-vagrant`` driver.
+
+Synthetic catalogues, shaped like ``SAMPLE_CATALOGUE`` in
+``libcloudvagrant/tests/test_catalogue.py``, are generated at increasing
+sizes, and the pure Python operations which run on every driver call are
+timed: loading a catalogue, copying it, computing address details,
+rendering the ``Vagrantfile``, dumping ``catalogue.json``, and allocating,
+deallocating and serializing network addresses.
+
+The best time and the peak memory allocated by each operation are reported.
+Results may be saved with ``--json`` and later used as a ``--baseline``; the
+benchmark then exits with a non-zero status if any operation is slower (or
+uses more memory) than the baseline by more than ``--threshold``.
+
+Usage::
+
+    $ python benchmarks/catalogue.py --json baseline.json
+    $ python benchmarks/catalogue.py --baseline baseline.json --threshold 0.2
+
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from driver import setup_environment
+
+
+def node_name(i):
+    return "node-%d" % (i,)
+
+
+def address(base, i):
+    return "%s.%d.%d" % (base, 1 + i // 250, 1 + i % 250)
+
+
+def synthetic_catalogue(size):
+    """Returns a catalogue with ``size`` nodes, each of them with a public
+    address, a private address and two volumes.
+
+    """
+    nodes = {}
+    volumes = {}
+    for i in range(size):
+        name = node_name(i)
+        nodes[name] = {
+            "id": "00000000-0000-0000-0000-%012d" % (i,),
+            "name": name,
+            "public_ips": [{"address": address("10.0", i),
+                            "network_name": "pub"}],
+            "private_ips": [{"address": address("172.16", i),
+                             "network_name": "priv"}],
+            "size": {
+                "name": "default",
+                "ram": 0,
+                "cpus": 1,
+            },
+            "image": {
+                "name": "ubuntu/trusty64",
+            },
+            "allocate_sata_ports": 30,
+        }
+        for v in ("data", "logs"):
+            vname = "%s-%s" % (v, name)
+            volumes[vname] = {
+                "name": vname,
+                "size": 50,
+                "attached_to": name,
+                "path": "/data/%s.vdi" % (vname,),
+            }
+    return {
+        "nodes": nodes,
+        "networks": {
+            "pub": {
+                "name": "pub",
+                "cidr": "10.0.0.0/8",
+                "public": True,
+                "allocated": [address("10.0", i) for i in range(size)],
+                "host_interface": "vboxnet2",
+            },
+            "priv": {
+                "name": "priv",
+                "cidr": "172.16.0.0/16",
+                "public": False,
+                "allocated": [address("172.16", i) for i in range(size)],
+                "host_interface": None,
+            },
+        },
+        "volumes": volumes,
+    }
+
+
+def peak_memory(fn):
+    """Returns the peak memory, in bytes, allocated while running ``fn``.
+
+    Without ``tracemalloc`` (Python 2), ``fn`` is run in a child process, and
+    the growth of its maximum resident set size is returned instead.
+
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            fn()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        status = 1
+        try:
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            fn()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(w, str(1024 * (after - before)).encode("ascii"))
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(w)
+    with os.fdopen(r) as f:
+        output = f.read()
+    os.waitpid(pid, 0)
+    return int(output) if output else None
+
+
+def measure(fn, repeat):
+    """Returns the best wall time of ``repeat`` runs of ``fn``, and its peak
+    memory.
+
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times), peak_memory(fn)
+
+
+def operations(catalogue, objects, tmpdir):
+    """Returns a list of ``(name, callable)`` pairs, one per operation.
+
+    ``catalogue`` must be an open :class:`.VagrantCatalogue`, holding
+    ``objects``.
+
+    """
+    from libcloudvagrant.common import templates
+    from libcloudvagrant.compute.types import VagrantNetwork
+
+    driver = catalogue.driver
+    params = objects["networks"]["pub"]
+
+    def deepcopy():
+        copy.deepcopy(objects)
+
+    def address_details():
+        for n in objects["nodes"].values():
+            for ip in n["public_ips"] + n["private_ips"]:
+                catalogue._address_details(ip)
+
+    nodes = []
+    for n in objects["nodes"].values():
+        node = dict(n)
+        node["public_ips"] = [catalogue._address_details(ip)
+                              for ip in n["public_ips"]]
+        node["private_ips"] = [catalogue._address_details(ip)
+                               for ip in n["private_ips"]]
+        nodes.append(node)
+
+    def render():
+        templates.render("Vagrantfile",
+                         {"gui_enabled": False, "nodes": nodes},
+                         os.path.join(tmpdir, "Vagrantfile"))
+
+    def dump():
+        with open(os.path.join(tmpdir, "catalogue.json"), "w") as f:
+            json.dump(objects, f, indent=2)
+
+    def from_dict():
+        VagrantNetwork.from_dict(driver=driver, **params)
+
+    network = VagrantNetwork.from_dict(driver=driver, **params)
+
+    def allocate():
+        network.deallocate_address(network.allocate_address().address)
+
+    def to_dict():
+        network.to_dict()
+
+    return [
+        ("deepcopy", deepcopy),
+        ("address_details", address_details),
+        ("render", render),
+        ("dump", dump),
+        ("network_from_dict", from_dict),
+        ("allocate", allocate),
+        ("network_to_dict", to_dict),
+    ]
+
+
+def benchmark(driver, tmpdir, size, repeat):
+    from libcloudvagrant.common.catalogue import VagrantCatalogue
+
+    dname = os.path.join(tmpdir, "catalogue-%d" % (size,))
+    os.mkdir(dname)
+    objects = synthetic_catalogue(size)
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(objects, f)
+
+    results = []
+
+    def report(name, fn):
+        wall_time, memory = measure(fn, repeat)
+        results.append({
+            "size": size,
+            "operation": name,
+            "time": wall_time,
+            "memory": memory,
+        })
+        print("%6d %-18s %10.3f ms %10s KiB" %
+              (size, name, 1000 * wall_time,
+               "n/a" if memory is None else memory // 1024))
+        sys.stdout.flush()
+
+    def load():
+        with VagrantCatalogue(dname, driver):
+            pass
+
+    # Child processes (see :func:`peak_memory`) can't take over the catalogue
+    # lock, so loading is measured outside of the catalogue context.
+    report("load", load)
+    with VagrantCatalogue(dname, driver) as c:
+        for name, fn in operations(c, objects, tmpdir):
+            report(name, fn)
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Returns a list of messages, one for each result which exceeds its
+    baseline by more than ``threshold`` (a fraction).
+
+    """
+    baseline = dict(((r["size"], r["operation"]), r) for r in baseline)
+    ret = []
+    for r in results:
+        b = baseline.get((r["size"], r["operation"]))
+        if b is None:
+            continue
+        for k in ("time", "memory"):
+            if r[k] is None or not b[k]:
+                continue
+            if r[k] > b[k] * (1 + threshold):
+                ret.append("%s (%d nodes): %s %.4g > %.4g (+%d%%)" %
+                           (r["operation"], r["size"], k, r[k], b[k],
+                            100 * (r[k] / float(b[k]) - 1)))
+    return ret
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--sizes", default="10,100,1000",
+                   help="comma-separated catalogue sizes "
+                        "(default: %(default)s)")
+    p.add_argument("--repeat", type=int, default=5,
+                   help="runs of each operation (default: %(default)s)")
+    p.add_argument("--json", metavar="FILE",
+                   help="write the results to FILE, in JSON format")
+    p.add_argument("--baseline", metavar="FILE",
+                   help="compare the results with those in FILE")
+    p.add_argument("--threshold", type=float, default=0.25,
+                   help="maximum allowed regression with respect to the "
+                        "baseline, as a fraction (default: %(default)s)")
+    args = p.parse_args()
+
+    tmpdir = setup_environment({})
+    try:
+        from libcloud.compute.providers import get_driver
+
+        from libcloudvagrant import VAGRANT
+
+        driver = get_driver(VAGRANT)()
+        results = []
+        for size in [int(s) for s in args.sizes.split(",")]:
+            results.extend(benchmark(driver, tmpdir, size, args.repeat))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        failures = regressions(results, baseline, args.threshold)
+        for msg in failures:
+            print("REGRESSION: %s" % (msg,))
+        if failures:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
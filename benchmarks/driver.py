@@ -0,0 +1,186 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Offline benchmark of the overhead of the ``libcloud-vagrant`` driver.
+
+The driver is run against the fake ``vagrant`` and ``VBoxManage`` commands
+in ``benchmarks/fake``, so no virtual machines are created. For each
+catalogue size, nodes are created, listed, given a volume each, and
+destroyed. The time spent in the driver itself is the wall time of each
+phase minus the time spent in the fake commands.
+
+Usage::
+
+    $ python benchmarks/driver.py --sizes 10,100,1000 \\
+        --latencies '{"vagrant up": 0.5, "default": 0}'
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def setup_environment(latencies):
+    """Puts the fake commands on ``PATH``, and gives them (and the driver) a
+    temporary home. Returns the temporary directory.
+
+    """
+    tmpdir = tempfile.mkdtemp(prefix="libcloudvagrant-bench-")
+    os.environ["PATH"] = os.pathsep.join([os.path.join(HERE, "fake"),
+                                          os.environ.get("PATH", "")])
+    os.environ["FAKE_VBOX_STATE"] = os.path.join(tmpdir, "vbox")
+    os.environ["FAKE_LATENCIES"] = json.dumps(latencies)
+    # No machines are created, so the capacity of the host must not limit
+    # the number of nodes (0 means no limit; see
+    # ``libcloudvagrant.common.admission``)
+    os.environ["LIBCLOUD_VAGRANT_HOST_RAM"] = "0"
+    os.environ["LIBCLOUD_VAGRANT_HOST_CPUS"] = "0"
+    sys.path.insert(0, os.path.dirname(HERE))
+    return tmpdir
+
+
+def command_time(stats):
+    commands = stats["commands"].values()
+    return (sum(c["total_time"] for c in commands),
+            sum(c["count"] for c in commands))
+
+
+class Phase(object):
+
+    """Context manager measuring the wall time of a benchmark phase, and the
+    time spent in external commands during it.
+
+    """
+
+    def __init__(self, driver, name, size, operations, results):
+        self.driver = driver
+        self.name = name
+        self.size = size
+        self.operations = operations
+        self.results = results
+
+    def __enter__(self):
+        self.driver.ex_stats(reset=True)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall_time = time.time() - self.start
+        cmd_time, cmd_count = command_time(self.driver.ex_stats(reset=True))
+        overhead = wall_time - cmd_time
+        self.results.append({
+            "size": self.size,
+            "phase": self.name,
+            "operations": self.operations,
+            "wall_time": wall_time,
+            "command_time": cmd_time,
+            "commands": cmd_count,
+            "driver_time": overhead,
+            "driver_time_per_op": overhead / max(self.operations, 1),
+        })
+        print("%6d %-8s %6d ops %8.3f s wall %8.3f s commands (%5d) "
+              "%8.2f ms driver/op" % (self.size, self.name, self.operations,
+                                      wall_time, cmd_time, cmd_count,
+                                      1000 * overhead /
+                                      max(self.operations, 1)))
+
+
+def benchmark(driver, size, results):
+    """Runs all benchmark phases for a catalogue of ``size`` nodes.
+
+    """
+    pub = driver.ex_create_network(name="bench-pub-%d" % (size,),
+                                   cidr="10.%d.0.0/16" % (size % 250,),
+                                   public=True)
+    priv = driver.ex_create_network(name="bench-priv-%d" % (size,),
+                                    cidr="172.%d.0.0/16" % (16 + size % 16,))
+    image = driver.get_image("hashicorp/precise64")
+    node_size = driver.list_sizes()[0]
+
+    with Phase(driver, "create", size, size, results):
+        nodes = [driver.create_node(name="bench-%d-%d" % (size, i),
+                                    image=image,
+                                    size=node_size,
+                                    ex_networks=[pub, priv])
+                 for i in range(size)]
+
+    with Phase(driver, "list", size, 3, results):
+        driver.list_nodes()
+        driver.list_volumes()
+        driver.ex_list_networks()
+
+    with Phase(driver, "attach", size, size, results):
+        for node in nodes:
+            volume = driver.create_volume(name="%s-data" % (node.name,),
+                                          size=1)
+            driver.attach_volume(node, volume)
+
+    with Phase(driver, "destroy", size, size, results):
+        for node in nodes:
+            driver.destroy_node(node)
+        for volume in driver.list_volumes():
+            driver.destroy_volume(volume)
+
+    driver.ex_destroy_network(pub)
+    driver.ex_destroy_network(priv)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--sizes", default="10,100,1000",
+                   help="comma-separated catalogue sizes "
+                        "(default: %(default)s)")
+    p.add_argument("--latencies", default="{}",
+                   help="JSON object with the latency (in seconds) of each "
+                        "fake command (default: no latency)")
+    p.add_argument("--json", metavar="FILE",
+                   help="write the results to FILE, in JSON format")
+    args = p.parse_args()
+
+    tmpdir = setup_environment(json.loads(args.latencies))
+    try:
+        from libcloud.compute.providers import get_driver
+
+        from libcloudvagrant import VAGRANT
+
+        driver = get_driver(VAGRANT)()
+        driver._home = tmpdir
+
+        results = []
+        for size in [int(s) for s in args.sizes.split(",")]:
+            benchmark(driver, size, results)
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Shared state and helpers for the fake ``vagrant`` and ``VBoxManage``
+commands.
+
+The state of the fake VirtualBox installation (virtual machines and
+registered media) is kept as JSON in the file ``state.json`` under the
+directory named by environment variable ``FAKE_VBOX_STATE``.
+
+Environment variable ``FAKE_LATENCIES`` holds a JSON object mapping command
+names (like ``vagrant up`` or ``VBoxManage showvminfo``, as recorded by
+``libcloudvagrant.common.stats``) to the number of seconds they should take.
+The key ``default`` applies to all other commands.
+
+"""
+
+import fcntl
+import json
+import os
+import sys
+import time
+
+from contextlib import contextmanager
+
+
+__all__ = [
+    "fail",
+    "simulate_latency",
+    "state",
+]
+
+
+def state_dir():
+    dname = os.environ.get("FAKE_VBOX_STATE")
+    if not dname:
+        fail("FAKE_VBOX_STATE not set")
+    if not os.access(dname, os.F_OK):
+        os.makedirs(dname)
+    return dname
+
+
+@contextmanager
+def state():
+    """Context manager yielding the state of the fake VirtualBox
+    installation, which is saved when leaving.
+
+    """
+    fname = os.path.join(state_dir(), "state.json")
+    with open(os.path.join(state_dir(), "state.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.access(fname, os.R_OK):
+            with open(fname) as f:
+                s = json.load(f)
+        else:
+            s = {}
+        for k in ("vms", "media", "hostonlyifs"):
+            s.setdefault(k, {})
+        yield s
+        with open(fname + ".tmp", "w") as f:
+            json.dump(s, f)
+        os.rename(fname + ".tmp", fname)
+
+
+def simulate_latency(program, args):
+    """Sleeps as much as configured for the given command.
+
+    """
+    latencies = json.loads(os.environ.get("FAKE_LATENCIES", "{}"))
+    words = [program]
+    for word in args[:2]:
+        if word.startswith("-"):
+            break
+        words.append(word)
+    for n in (len(words), 2):
+        name = " ".join(words[:n])
+        if name in latencies:
+            time.sleep(latencies[name])
+            return
+    time.sleep(latencies.get("default", 0))
+
+
+def fail(msg, status=1):
+    sys.stderr.write("%s\n" % (msg,))
+    sys.exit(status)
@@ -23,9 +23,9 @@ VirtualBox nodes, networks and volumes.
 
 """
 
+import logging
 import os
 import re
-import subprocess
 import sys
 
 from libcloud.compute import providers as compute_providers
@@ -46,6 +46,7 @@ try:
 except ImportError:
     NETIFACES_FOUND = False
 
+from libcloudvagrant.common import process
 from libcloudvagrant.common.types import VAGRANT
 from libcloudvagrant.compute import driver as compute_driver
 
@@ -92,14 +93,15 @@ def test():  # pragma: no cover
 
 
 def execute(cmdline):
-    p = subprocess.Popen(cmdline,
-                         shell=True,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.STDOUT)
-    stdout, _ = p.communicate()
-    if p.returncode:
-        raise RuntimeError("Cannot execute '%s': %s", cmdline, stdout)
-    return stdout.strip()
+    program, _, args = cmdline.partition(" ")
+    p = process.Command(cmdline, logging.getLogger("libcloudvagrant"),
+                        merge_stderr=True,
+                        name=process.command_name(program, [args]),
+                        capture=True)
+    if p.wait():
+        raise RuntimeError("Cannot execute '%s': %s",
+                           cmdline, "\n".join(p.tail))
+    return p.stdout.strip()
 
 
 def check_versions():
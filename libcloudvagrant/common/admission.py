@@ -0,0 +1,213 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Admission control of nodes, so that nodes do not take more memory or CPUs
+than the host has.
+
+The memory and CPUs committed to a node are those of its size or, for sizes
+which leave them unset (such as ``default``), those of the Vagrant box of its
+image. All catalogued nodes are counted, whether they are running or not.
+
+The capacity of the host is given by these environment variables (where 0
+means no limit):
+
+``LIBCLOUD_VAGRANT_HOST_RAM``
+    Memory of the host, in MB. Defaults to its physical memory.
+
+``LIBCLOUD_VAGRANT_HOST_CPUS``
+    CPUs of the host. Defaults to no limit, since VirtualBox time-shares host
+    CPUs among nodes, while nodes using more memory than the host has make it
+    swap.
+
+Node creations which don't fit wait for up to
+``LIBCLOUD_VAGRANT_ADMISSION_TIMEOUT`` seconds (0 by default) for other nodes
+to be destroyed, and fail afterwards.
+
+Besides, no more than ``LIBCLOUD_VAGRANT_MAX_BOOTS`` nodes (the number of
+CPUs of the host by default) are booted by a process at the same time.
+
+"""
+
+import glob
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from distutils.version import LooseVersion
+
+
+__all__ = [
+    "booting",
+    "box_resources",
+    "host_ram",
+    "release",
+    "requirements",
+    "shortfall",
+    "usage",
+    "wait",
+]
+
+
+def host_ram():
+    """Returns the physical memory of the host in MB, or 0 if unknown.
+
+    """
+    try:
+        return (os.sysconf("SC_PAGE_SIZE") *
+                os.sysconf("SC_PHYS_PAGES")) // (1024 * 1024)
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+# Capacity of the host.
+HOST_RAM = int(os.environ.get("LIBCLOUD_VAGRANT_HOST_RAM") or host_ram())
+HOST_CPUS = int(os.environ.get("LIBCLOUD_VAGRANT_HOST_CPUS", "0"))
+
+# Seconds for which node creations wait for resources.
+TIMEOUT = float(os.environ.get("LIBCLOUD_VAGRANT_ADMISSION_TIMEOUT", "0"))
+
+# Maximum number of nodes booted at the same time.
+MAX_BOOTS = (int(os.environ.get("LIBCLOUD_VAGRANT_MAX_BOOTS", "0")) or
+             multiprocessing.cpu_count())
+
+# Memory (in MB) and CPUs assumed for boxes whose settings are unknown.
+DEFAULT_RAM = 512
+DEFAULT_CPUS = 1
+
+# Seconds between checks for resources released by other processes.
+POLL_INTERVAL = 1
+
+# Seconds for which boxes which aren't found are assumed to be missing.
+MISSING_BOX_TTL = 60
+
+_RAM_RE = re.compile(r'<Memory\s+RAMSize="(\d+)"')
+_CPUS_RE = re.compile(r'<CPU\s+count="(\d+)"')
+
+_boxes = {}
+_boots = threading.BoundedSemaphore(MAX_BOOTS)
+_released = threading.Condition()
+
+
+def box_resources(name):
+    """Returns the memory (in MB) and CPUs of the latest version of the
+    VirtualBox flavour of Vagrant box ``name``, as found in its ``box.ovf``
+    file, or :data:`DEFAULT_RAM` and :data:`DEFAULT_CPUS` if unknown.
+
+    Boxes which aren't found are looked for again after
+    :data:`MISSING_BOX_TTL` seconds, since Vagrant downloads them on first
+    use.
+
+    """
+    ram, cpus, expiry = _boxes.get(name, (None, None, 0))
+    if expiry is not None and expiry <= time.time():
+        home = (os.environ.get("VAGRANT_HOME") or
+                os.path.expanduser("~/.vagrant.d"))
+        pattern = os.path.join(home, "boxes",
+                               name.replace("/", "-VAGRANTSLASH-"),
+                               "*", "virtualbox", "box.ovf")
+        ovfs = sorted(glob.glob(pattern),
+                      key=lambda f: LooseVersion(f.split(os.sep)[-3]))
+        ovf = ""
+        if ovfs:
+            with open(ovfs[-1]) as f:
+                ovf = f.read()
+        ram, cpus = _RAM_RE.search(ovf), _CPUS_RE.search(ovf)
+        ram = ram and int(ram.group(1)) or DEFAULT_RAM
+        cpus = cpus and int(cpus.group(1)) or DEFAULT_CPUS
+        expiry = not ovfs and time.time() + MISSING_BOX_TTL or None
+        _boxes[name] = (ram, cpus, expiry)
+    return ram, cpus
+
+
+def requirements(size, image):
+    """Returns the memory (in MB) and CPUs committed to a node of the given
+    :class:`.VagrantNodeSize` and :class:`.VagrantImage`.
+
+    """
+    ram, cpus = size.ram, size.extra.get("cpus")
+    if not ram or not cpus:
+        box_ram, box_cpus = box_resources(image.name)
+        ram, cpus = ram or box_ram, cpus or box_cpus
+    return ram, cpus
+
+
+def usage(nodes):
+    """Returns the capacity of the host and the resources committed to
+    ``nodes``, as a dict with keys ``ram`` and ``cpus`` whose values are
+    dicts with keys ``capacity`` and ``committed``.
+
+    """
+    committed = [requirements(n.size, n.image) for n in nodes]
+    return {
+        "ram": {
+            "capacity": HOST_RAM,
+            "committed": sum(ram for (ram, _) in committed),
+        },
+        "cpus": {
+            "capacity": HOST_CPUS,
+            "committed": sum(cpus for (_, cpus) in committed),
+        },
+    }
+
+
+def shortfall(nodes, size, image):
+    """Returns why a node of the given size and image does not fit in the
+    host besides ``nodes``, or ``None`` if it does.
+
+    """
+    ram, cpus = requirements(size, image)
+    current = usage(nodes)
+    for key, needed, what in (("ram", ram, "MB of memory"),
+                              ("cpus", cpus, "CPUs")):
+        capacity = current[key]["capacity"]
+        available = capacity - current[key]["committed"]
+        if capacity and needed > available:
+            return ("%d %s needed, %d of %d available" %
+                    (needed, what, max(available, 0), capacity))
+
+
+def wait(timeout):
+    """Waits for up to ``timeout`` seconds (but no more than
+    :data:`POLL_INTERVAL`) for resources to be released.
+
+    """
+    with _released:
+        _released.wait(max(min(timeout, POLL_INTERVAL), 0))
+
+
+def release():
+    """Wakes up those waiting for resources to be released.
+
+    """
+    with _released:
+        _released.notify_all()
+
+
+@contextmanager
+def booting():
+    """Context manager entered for booting a node, which waits while
+    :data:`MAX_BOOTS` nodes are being booted.
+
+    """
+    with _boots:
+        yield
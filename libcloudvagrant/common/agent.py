@@ -0,0 +1,321 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""A long-running agent serving driver calls over a Unix domain socket.
+
+The agent (started with ``libcloud-vagrant agent``) runs the driver methods
+decorated with :func:`forwarded` on behalf of other processes. It pays the
+start-up costs of the driver (version checks, template loading, connecting to
+VirtualBox) once, and keeps the catalogue and the states of nodes (see
+:mod:`libcloudvagrant.common.states`) in memory.
+
+When the agent is running, drivers in other processes forward those methods
+to it transparently, unless some of their arguments (such as callables)
+cannot be sent over the socket, in which case they run locally. The socket
+is ``~/.libcloudvagrant/agent.sock``, unless environment variable
+``LIBCLOUD_VAGRANT_AGENT`` names another one.
+
+Requests and responses are JSON objects, one per line. Driver objects
+(nodes, networks, volumes, ...) are sent as their dict representations.
+Responses carry the state of the arguments after the call too, so that the
+changes the agent makes to them (such as attaching volumes to nodes) are
+seen by callers.
+Errors raised by the agent are raised again by the caller with their
+original types, if they are built-in exceptions or Libcloud errors (such as
+``DeploymentError``, whose ``node`` is sent along), and as ``LibcloudError``
+otherwise.
+
+"""
+
+import errno
+import exceptions
+import functools
+import json
+import logging
+import os
+import socket
+import SocketServer
+
+from libcloud.common import types as common_types
+from libcloud.common.types import LibcloudError
+from libcloud.compute import types as compute_types
+
+from libcloudvagrant.compute import types
+
+
+__all__ = [
+    "Agent",
+    "forwarded",
+    "socket_path",
+]
+
+
+LOG = logging.getLogger("libcloudvagrant")
+
+# Names of the methods which may be forwarded to the agent.
+_FORWARDED = set()
+
+_TYPES = dict((cls.__name__, cls) for cls in (
+    types.VagrantAddress,
+    types.VagrantImage,
+    types.VagrantNetwork,
+    types.VagrantNode,
+    types.VagrantNodeSize,
+    types.VagrantVolume,
+))
+
+# Libcloud errors which the agent may send back, by name.
+_ERRORS = dict((cls.__name__, cls) for cls in (
+    list(vars(common_types).values()) + list(vars(compute_types).values()))
+    if isinstance(cls, type) and issubclass(cls, LibcloudError))
+
+
+def socket_path(driver):
+    """Returns the path to the socket of the agent for ``driver``.
+
+    """
+    return (os.environ.get("LIBCLOUD_VAGRANT_AGENT") or
+            os.path.join(driver._dot_libcloudvagrant, "agent.sock"))
+
+
+def marshal(obj):
+    """Returns a JSON-serializable representation of ``obj``.
+
+    Raises ``TypeError`` if ``obj`` can't be represented.
+
+    """
+    if obj is None or isinstance(obj, (bool, int, long, float, basestring)):
+        return obj
+    elif isinstance(obj, (list, tuple)):
+        return [marshal(o) for o in obj]
+    elif isinstance(obj, dict):
+        return dict((k, marshal(v)) for (k, v) in obj.items())
+    elif type(obj).__name__ in _TYPES:
+        return {"__type__": type(obj).__name__, "__value__": obj.to_dict()}
+    raise TypeError("Cannot forward %r to the agent" % (obj,))
+
+
+def unmarshal(obj, driver):
+    """Rebuilds an object from its representation by :func:`marshal`.
+
+    """
+    if isinstance(obj, list):
+        return [unmarshal(o, driver) for o in obj]
+    elif isinstance(obj, dict):
+        if "__type__" in obj:
+            params = dict((str(k), v) for (k, v) in obj["__value__"].items())
+            if obj["__type__"] != "VagrantAddress":
+                params["driver"] = driver
+            return _TYPES[obj["__type__"]].from_dict(**params)
+        return dict((k, unmarshal(v, driver)) for (k, v) in obj.items())
+    return obj
+
+
+def update(obj, copy):
+    """Updates the driver objects in ``obj`` with the state of their
+    counterparts in ``copy``, as rebuilt by :func:`unmarshal`.
+
+    """
+    if isinstance(obj, (list, tuple)) and isinstance(copy, list):
+        for (o, c) in zip(obj, copy):
+            update(o, c)
+    elif isinstance(obj, dict) and isinstance(copy, dict):
+        for (k, v) in obj.items():
+            if k in copy:
+                update(v, copy[k])
+    elif type(obj).__name__ in _TYPES and type(copy) is type(obj):
+        obj.__dict__.update(copy.__dict__)
+
+
+def forwarded(method):
+    """Decorator for driver methods which are forwarded to the agent, when
+    it's running.
+
+    """
+    _FORWARDED.add(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not getattr(self, "_in_agent", False):
+            path = socket_path(self)
+            if os.path.exists(path):
+                try:
+                    request = marshal({
+                        "method": method.__name__,
+                        "args": args,
+                        "kwargs": kwargs,
+                    })
+                except TypeError as ex:
+                    LOG.debug("%s(): Running locally: %s",
+                              method.__name__, ex)
+                else:
+                    sock = _connect(path)
+                    if sock is not None:
+                        response = _call(self, sock, request)
+                        update(args, response.get("args"))
+                        update(kwargs, response.get("kwargs"))
+                        return response["result"]
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as ex:
+        LOG.debug("Agent not running at %s: %s", path, ex)
+        sock.close()
+        return None
+    return sock
+
+
+def _call(driver, sock, request):
+    try:
+        f = sock.makefile("r+")
+        f.write(json.dumps(request) + "\n")
+        f.flush()
+        line = f.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise LibcloudError("Agent closed the connection during %s()" %
+                            (request["method"],), driver=driver)
+    response = json.loads(line)
+    if "error" in response:
+        raise _unmarshal_error(response["error"], driver)
+    return unmarshal(response, driver)
+
+
+def _marshal_error(ex):
+    """Returns a JSON-serializable representation of exception ``ex``.
+
+    """
+    def safe(obj):
+        try:
+            return marshal(obj)
+        except TypeError:
+            return str(obj)
+
+    return {
+        "type": type(ex).__name__,
+        "message": str(ex) or type(ex).__name__,
+        "args": [safe(arg) for arg in ex.args],
+        "attrs": dict((k, safe(v)) for (k, v) in vars(ex).items()
+                      if k != "driver"),
+    }
+
+
+def _unmarshal_error(error, driver):
+    """Rebuilds an exception from its representation by
+    :func:`_marshal_error`.
+
+    """
+    if not isinstance(error, dict):
+        return LibcloudError(error, driver=driver)
+    name = error["type"]
+    args = unmarshal(error.get("args", []), driver)
+    attrs = unmarshal(error.get("attrs", {}), driver)
+    if name in _ERRORS:
+        # Their constructors differ, so bypass them and restore the state.
+        ex = Exception.__new__(_ERRORS[name])
+        Exception.__init__(ex, *args)
+        ex.__dict__.update((str(k), v) for (k, v) in attrs.items())
+        ex.driver = driver
+        return ex
+    cls = getattr(exceptions, name, None)
+    if isinstance(cls, type) and issubclass(cls, StandardError):
+        try:
+            return cls(*args)
+        except Exception:
+            pass
+    return LibcloudError(error["message"], driver=driver)
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(request)
+            except Exception as ex:
+                LOG.debug("Error serving %s", line.strip(), exc_info=True)
+                response = {"error": _marshal_error(ex)}
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+class Agent(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    """Serves the methods of ``driver`` decorated with :func:`forwarded` on a
+    Unix domain socket, each request in its own thread.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, driver, path=None):
+        self.driver = driver
+        self.driver._in_agent = True
+        self.path = path or socket_path(driver)
+        if os.path.exists(self.path):
+            sock = _connect(self.path)
+            if sock is not None:
+                sock.close()
+                raise LibcloudError("Agent already running at %s" %
+                                    (self.path,), driver=driver)
+            os.unlink(self.path)
+        SocketServer.UnixStreamServer.__init__(self, self.path, _Handler)
+        os.chmod(self.path, 0600)
+
+    def dispatch(self, request):
+        """Runs the driver method named in ``request``, and returns the
+        response, with its marshalled result and arguments.
+
+        """
+        name = request["method"]
+        if name not in _FORWARDED:
+            raise LibcloudError("Unknown method %s" % (name,))
+        args = unmarshal(request.get("args", []), self.driver)
+        kwargs = dict((str(k), v) for (k, v) in
+                      unmarshal(request.get("kwargs", {}),
+                                self.driver).items())
+        LOG.debug("Serving %s()", name)
+        result = getattr(self.driver, name)(*args, **kwargs)
+        return marshal({"result": result, "args": args, "kwargs": kwargs})
+
+    def serve(self):
+        """Serves requests until interrupted, and removes the socket.
+
+        """
+        LOG.info("Agent listening on %s", self.path)
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            try:
+                os.unlink(self.path)
+            except OSError as ex:
+                if ex.errno != errno.ENOENT:
+                    raise
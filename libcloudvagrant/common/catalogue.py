@@ -21,10 +21,13 @@
 """A catalogue of Vagrant nodes, networks and volumes."""
 
 import copy
+import hashlib
 import json
 import logging
 import os
 import pprint
+import tempfile
+import threading
 import traceback
 
 import ipaddr
@@ -32,7 +35,7 @@ import lockfile
 
 from libcloud.common.types import LibcloudError
 
-from libcloudvagrant.common import templates
+from libcloudvagrant.common import spans, templates, virtualbox
 from libcloudvagrant.compute.types import (
     VagrantAddress,
     VagrantNetwork,
@@ -50,6 +53,13 @@ class VagrantCatalogue(object):
 
     log = logging.getLogger("libcloudvagrant")
 
+    # Contents of the catalogues last read or written by this process, by
+    # directory, together with the status of the ``catalogue.json`` files
+    # they match, so that unchanged catalogues aren't parsed again. Cached
+    # contents are never modified.
+    _cache = {}
+    _cache_lock = threading.Lock()
+
     def __init__(self, dname, driver):
         self.dname = dname
         if not os.access(self.dname, os.F_OK):
@@ -62,43 +72,28 @@ class VagrantCatalogue(object):
         self._unlock_on_exit = not self._lock.i_am_locking()
 
     def __enter__(self):
-        self._lock.acquire()
-        if os.access(self._catalogue_json, os.R_OK):
-            try:
-                with open(self._catalogue_json, "rt") as f:
-                    self._objects = json.load(f)
-                    self.log.debug("Loaded objects: %s",
-                                   pprint.pformat(self._objects))
-            except Exception as ex:
-                try:
-                    self._lock.release()
-                except:
-                    pass
-                raise Exception("Failed reading catalogue %s: %s" % \
-                                (self._catalogue_json, str(ex)))
-        else:
-            self._objects = {}
-            self._save_needed = True
-        for k in ("networks", "nodes", "volumes"):
-            self._objects.setdefault(k, {})
-        self._previous_objects = copy.deepcopy(self._objects)
-
+        with spans.span("catalogue.enter"):
+            with spans.span("catalogue.lock"):
+                self._lock.acquire()
+            with spans.span("catalogue.load"):
+                self._load()
         return self
 
     def __exit__(self, *exc_info):
-        if any(exc_info):
-            self.log.debug("Reverting because of: %s",
-                           "".join(traceback.format_exception(*exc_info)))
-            self._objects = self._previous_objects
+        with spans.span("catalogue.exit"):
+            if any(exc_info):
+                self.log.debug("Reverting because of: %s",
+                               "".join(traceback.format_exception(*exc_info)))
+                self._objects = self._previous_objects
 
-        try:
-            if self._save_needed:
-                self.save()
-        finally:
-            if self._unlock_on_exit:
-                self._lock.release()
+            try:
+                if self._save_needed:
+                    self.save()
+            finally:
+                if self._unlock_on_exit:
+                    self._lock.release()
 
-        self._objects = self._previous_objects = None
+            self._objects = self._previous_objects = None
 
     def add_network(self, network):
         self.log.debug("add_network(%s): Entering", network)
@@ -112,7 +107,13 @@ class VagrantCatalogue(object):
                 if params[k] != n[k]:
                     raise LibcloudError("Network '%s' already defined" %
                                         (name,), driver=self.driver)
-            self.log.debug("add_network(%s): Nothing to do", network)
+            for k in ("nic_type", "promiscuous"):
+                if params.get(k) != n.get(k):
+                    self.log.debug("add_network(%s): Changing %s", network, k)
+                    n[k] = params.get(k)
+                    self._save_needed = True
+            if not self._save_needed:
+                self.log.debug("add_network(%s): Nothing to do", network)
             return
 
         network_obj = ipaddr.IPNetwork(params["cidr"])
@@ -135,6 +136,14 @@ class VagrantCatalogue(object):
         self._volumes[volume.name] = volume.to_dict()
         self._save_needed = True
 
+    def copy_objects(self):
+        """Returns a copy of the networks, nodes, node pools and volumes in
+        this catalogue, for :meth:`restore_objects`.
+
+        """
+        return copy.deepcopy(dict((k, self._objects[k]) for k in
+                                  ("networks", "nodes", "pools", "volumes")))
+
     def find_network(self, network_name):
         try:
             p = self._networks[network_name]
@@ -143,20 +152,67 @@ class VagrantCatalogue(object):
                                 driver=self.driver)
         return VagrantNetwork.from_dict(driver=self.driver, **p)
 
+    def find_node(self, node_name):
+        try:
+            p = self._nodes[node_name]
+        except KeyError:
+            raise LibcloudError("Unknown node '%s'" % (node_name,),
+                                driver=self.driver)
+        return VagrantNode.from_dict(driver=self.driver, **p)
+
+    def find_volume(self, volume_name):
+        try:
+            p = self._volumes[volume_name]
+        except KeyError:
+            raise LibcloudError("Unknown volume '%s'" % (volume_name,),
+                                driver=self.driver)
+        return VagrantVolume.from_dict(driver=self.driver, **p)
+
+    def get_images(self):
+        """Returns the images created by the driver, a dict of image details
+        by image name, as set by :meth:`update_image`.
+
+        """
+        return copy.deepcopy(self._images)
+
     def get_networks(self):
         ret = [VagrantNetwork.from_dict(driver=self.driver, **p)
                for p in self._networks.values()]
         self.log.debug("get_networks(): Returning %s", ret)
         return ret
 
-    def get_nodes(self):
+    def get_node(self, node_name):
+        p = self._nodes.get(node_name)
+        if p is not None:
+            return VagrantNode.from_dict(driver=self.driver, **p)
+
+    def get_nodes(self, pooled=False):
+        """Returns the nodes in this catalogue, including those in node pools
+        only if ``pooled`` is set.
+
+        """
+        members = set()
+        if not pooled:
+            for pool in self._pools.values():
+                members.update(pool["nodes"])
         return [VagrantNode.from_dict(driver=self.driver, **p)
-                for p in self._nodes.values()]
+                for p in self._nodes.values() if p["name"] not in members]
+
+    def get_pools(self):
+        """Returns the node pools, a dict of pools by key, as set by
+        :meth:`update_pool`.
+
+        """
+        return copy.deepcopy(self._pools)
 
     def get_volumes(self):
         return [VagrantVolume.from_dict(driver=self.driver, **p)
                 for p in self._volumes.values()]
 
+    def remove_image(self, name):
+        if self._images.pop(name, None) is not None:
+            self._save_needed = True
+
     def remove_network(self, network):
         self.log.debug("remove_network(%s): Entering", network)
         try:
@@ -179,6 +235,37 @@ class VagrantCatalogue(object):
             pass
         else:
             self._save_needed = True
+        for pool in self._pools.values():
+            if node.name in pool["nodes"]:
+                pool["nodes"].remove(node.name)
+
+    def remove_pool(self, key):
+        if self._pools.pop(key, None) is not None:
+            self._save_needed = True
+
+    def restore_objects(self, objects):
+        """Replaces the objects in this catalogue with those returned by
+        :meth:`copy_objects`.
+
+        """
+        self._objects.update(copy.deepcopy(objects))
+        self._save_needed = True
+
+    def rename_node(self, node, name):
+        """Renames a node, together with its Vagrant machine.
+
+        """
+        self.log.debug("rename_node(): Renaming %s to '%s'", node, name)
+        if name in self._nodes:
+            raise LibcloudError("Node '%s' already exists" % (name,),
+                                driver=self.driver)
+        dname = os.path.join(self.dname, ".vagrant/machines")
+        if os.access(os.path.join(dname, node.name), os.F_OK):
+            os.rename(os.path.join(dname, node.name),
+                      os.path.join(dname, name))
+        del self._nodes[node.name]
+        node.name = name
+        self.add_node(node)
 
     def remove_volume(self, volume):
         try:
@@ -188,12 +275,28 @@ class VagrantCatalogue(object):
         else:
             self._save_needed = True
 
+    def update_image(self, name, image):
+        if not self._images.get(name) == image:
+            self._images[name] = copy.deepcopy(image)
+            self._save_needed = True
+
     def update_network(self, network):
         params = network.to_dict()
         if not self._networks.get(network.name) == params:
             self._networks[network.name] = params
             self._save_needed = True
 
+    def update_node(self, node):
+        params = node.to_dict()
+        if not self._nodes[node.name] == params:
+            self._nodes[node.name] = params
+            self._save_needed = True
+
+    def update_pool(self, key, pool):
+        if not self._pools.get(key) == pool:
+            self._pools[key] = copy.deepcopy(pool)
+            self._save_needed = True
+
     def update_volume(self, volume):
         params = volume.to_dict()
         if not self._volumes[volume.name] == params:
@@ -221,29 +324,104 @@ class VagrantCatalogue(object):
             return
 
         self._save_needed = False
+        with spans.span("catalogue.save"):
+            self._save()
+
+    def _save(self):
         fname = os.path.join(self.dname, "Vagrantfile")
         try:
-            params = {
-                "gui_enabled": False,
-                "nodes": []
-            }
-            for n in self._nodes.values():
-                node = dict(n)
-                node["public_ips"] = [self._address_details(ip)
-                                      for ip in n["public_ips"]]
-                node["private_ips"] = [self._address_details(ip)
-                                       for ip in n["private_ips"]]
-                params["nodes"].append(node)
-            templates.render("Vagrantfile", params, fname)
+            with spans.span("catalogue.render"):
+                params = {
+                    "gui_enabled": False,
+                    "disk_bandwidth_group": virtualbox.DISK_BANDWIDTH_GROUP,
+                    "network_bandwidth_group":
+                        virtualbox.NETWORK_BANDWIDTH_GROUP,
+                    "nodes": []
+                }
+                for n in self._nodes.values():
+                    node = dict(n)
+                    node["public_ips"] = [self._address_details(ip)
+                                          for ip in n["public_ips"]]
+                    node["private_ips"] = [self._address_details(ip)
+                                           for ip in n["private_ips"]]
+                    node["nics"] = self._nics(node)
+                    params["nodes"].append(node)
+                templates.render("Vagrantfile", params, fname)
         except:
             self.log.warn("Error creating %s", fname, exc_info=True)
         fname = self._catalogue_json
         try:
-            with open(fname, "w") as f:
-                self.log.debug("Saving catalogue %s: %s", fname, self._objects)
-                json.dump(self._objects, f, indent=2)
+            with spans.span("catalogue.dump"):
+                self.log.debug("Saving catalogue %s: %s",
+                               fname, self._objects)
+                data = json.dumps(self._objects, indent=2)
+                # Replaced with a new file, so that readers never see it
+                # half-written
+                fd, tmp = tempfile.mkstemp(prefix="catalogue.json.",
+                                           dir=self.dname)
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        f.write(data)
+                    os.rename(tmp, fname)
+                except:
+                    os.unlink(tmp)
+                    raise
         except:
             self.log.warn("Error creating %s", fname, exc_info=True)
+            self._cache_objects(None, None)
+        else:
+            self._cache_objects(self._objects, _digest(data))
+
+    def _load(self):
+        digest = None
+        if os.access(self._catalogue_json, os.R_OK):
+            try:
+                with open(self._catalogue_json, "rt") as f:
+                    data = f.read()
+                digest = _digest(data)
+                with self._cache_lock:
+                    cached, objects = self._cache.get(self.dname,
+                                                      (None, None))
+                if objects is not None and cached == digest:
+                    self._previous_objects = objects
+                    self._objects = copy.deepcopy(objects)
+                    return
+                self._objects = json.loads(data)
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.log.debug("Loaded objects: %s",
+                                   pprint.pformat(self._objects))
+            except Exception as ex:
+                try:
+                    self._lock.release()
+                except:
+                    pass
+                raise Exception("Failed reading catalogue %s: %s" % \
+                                (self._catalogue_json, str(ex)))
+        else:
+            self._objects = {}
+            self._save_needed = True
+        for k in ("images", "networks", "nodes", "pools", "volumes"):
+            self._objects.setdefault(k, {})
+        self._previous_objects = copy.deepcopy(self._objects)
+        if not self._save_needed:
+            self._cache_objects(self._previous_objects, digest)
+
+    def _cache_objects(self, objects, digest):
+        """Caches ``objects`` as the contents of ``catalogue.json``, which
+        must not be modified afterwards, and whose contents have the given
+        digest.
+
+        Cached objects are only used while the contents of
+        ``catalogue.json`` keep that digest: its status (inode, size and
+        modification time) may stay the same after other processes change
+        it.
+
+        """
+        with self._cache_lock:
+            if objects is None or digest is None:
+                self._cache.pop(self.dname, None)
+            else:
+                self._cache[self.dname] = (digest, objects)
 
     def _address_details(self, ip):
         ip = VagrantAddress.from_dict(**ip).address
@@ -252,10 +430,31 @@ class VagrantCatalogue(object):
             if ip in n:
                 return {
                     "network": name, "ip": str(ip), "netmask": str(n.netmask),
+                    "nic_type": params.get("nic_type"),
+                    "promiscuous": params.get("promiscuous"),
                 }
         raise LibcloudError("No network defined for %s" % (ip,),
                             driver=self.driver)
 
+    def _nics(self, node):
+        """Returns the settings of the network adapters of ``node``, whose
+        addresses are given by :meth:`_address_details`: the NAT one
+        created by Vagrant first, and then one for each address.
+
+        """
+        nic_type = node["size"].get("nic_type")
+        ret = [{"nic_type": nic_type, "promiscuous": None}]
+        for addr in node["public_ips"] + node["private_ips"]:
+            ret.append({
+                "nic_type": addr["nic_type"] or nic_type,
+                "promiscuous": addr["promiscuous"],
+            })
+        return ret
+
+    @property
+    def _images(self):
+        return self._objects["images"]
+
     @property
     def _networks(self):
         return self._objects["networks"]
@@ -264,6 +463,10 @@ class VagrantCatalogue(object):
     def _nodes(self):
         return self._objects["nodes"]
 
+    @property
+    def _pools(self):
+        return self._objects["pools"]
+
     @property
     def _volumes(self):
         return self._objects["volumes"]
@@ -271,3 +474,7 @@ class VagrantCatalogue(object):
     @property
     def _catalogue_json(self):
         return os.path.join(self.dname, "catalogue.json")
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
@@ -21,8 +21,10 @@
 """A command-line tool for libcloud-vagrant."""
 
 import argparse
+import inspect
 import logging
 import os
+import signal
 import subprocess
 import sys
 import tempfile
@@ -31,6 +33,8 @@ import textwrap
 from libcloud.compute.providers import get_driver
 
 from libcloudvagrant import VAGRANT
+from libcloudvagrant.common import agent as agent_module
+from libcloudvagrant.common import spans, topology
 
 
 __all__ = [
@@ -41,11 +45,43 @@ __all__ = [
 LOG = logging.getLogger("libcloudvagrant")
 
 
+def agent(driver, path=None):
+    """Serves driver calls on a Unix socket, until interrupted.
+
+    """
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+    agent_module.Agent(driver, path).serve()
+
+
+def apply_topology(driver, fname, max_parallel="4"):
+    """Makes your Vagrant environment match the topology in <file>.
+
+    """
+    report = driver.ex_apply_topology(topology.load(fname),
+                                      max_parallel=int(max_parallel))
+    for action in ("created", "replaced", "deployed", "destroyed", "failed"):
+        if report[action]:
+            LOG.info("%s: %s", action.capitalize(),
+                     ", ".join(report[action]))
+    if report["failed"]:
+        return 1
+
+
 def destroy(driver):
-    """Destroys all nodes, networks and volumes in your Vagrant environment.
+    """Destroys all pools, nodes, networks and volumes in your environment.
 
     """
     ok = True
+    for pool in driver.ex_list_pools():
+        try:
+            ok = driver.ex_destroy_pool(pool["key"]) and ok
+        except:
+            LOG.warn("Cannot destroy pool '%s'", pool["key"], exc_info=True)
+            ok = False
+
     for n in driver.list_nodes():
         try:
             driver.destroy_node(n)
@@ -103,12 +139,88 @@ def list_objects(driver):
     else:
         print underlined("Volumes")
         for v in volumes:
-            owner = v.extra.get("attached_to")
+            owner = ", ".join(sorted(v.attached_nodes))
             owner = owner and "(attached to %s)" % (owner,) or ""
             print "%-20s  %4d GB  %s" % (v.name, v.size, owner)
         print
 
 
+def pool(driver, command="list", *args):
+    """Lists, creates, refills or destroys pools of booted nodes.
+
+    """
+    if command == "list":
+        pools = driver.ex_list_pools()
+        if not pools:
+            print "No pools"
+            return
+        print underlined("%-40s %5s %5s  %s" %
+                         ("Pool", "Count", "Ready", "State"))
+        for p in pools:
+            state = p["saved"] and "saved" or "running"
+            print "%-40s %5d %5d  %s" % (p["key"], p["count"], p["ready"],
+                                        state)
+    elif command == "create" and len(args) in (3, 4):
+        image = driver.get_image(args[0])
+        sizes = [s for s in driver.list_sizes() if s.name == args[1]]
+        if not sizes:
+            LOG.error("Unknown size '%s'", args[1])
+            return 1
+        saved = args[3:] == ("saved",)
+        driver.ex_create_pool(image, sizes[0], int(args[2]), saved=saved)
+    elif command == "refill" and not args:
+        driver.ex_refill_pools()
+    elif command == "destroy" and len(args) == 1:
+        return not driver.ex_destroy_pool(args[0])
+    else:
+        LOG.error("Usage: pool list | create <image> <size> <count> [saved] "
+                  "| refill | destroy <pool>")
+        return 1
+
+
+def profile(driver, fname=None):
+    """Summarizes the spans in <file>, or in $LIBCLOUD_VAGRANT_PROFILE.
+
+    """
+    fname = fname or os.environ.get("LIBCLOUD_VAGRANT_PROFILE")
+    if not fname:
+        LOG.error("No profile file given, and $LIBCLOUD_VAGRANT_PROFILE "
+                  "not set")
+        return 1
+
+    totals = {}
+    for event in spans.load(fname):
+        if "dur" in event:
+            # Chrome trace event
+            path = event["args"].get("path", event["name"])
+            duration = event["dur"] / 1e6
+        else:
+            path = event["path"]
+            duration = event["duration"]
+        count, total, longest = totals.get(path, (0, 0, 0))
+        totals[path] = (count + 1, total + duration, max(longest, duration))
+
+    if not totals:
+        print "No spans"
+        return
+
+    print underlined("%-50s %6s %10s %10s %10s" %
+                     ("Span", "Count", "Total (s)", "Mean (s)", "Max (s)"))
+
+    def show(parent, depth):
+        children = [(path, v) for (path, v) in totals.items()
+                    if path.count("/") == depth and
+                    (parent is None or path.startswith(parent + "/"))]
+        children.sort(key=lambda item: item[1][1], reverse=True)
+        for path, (count, total, longest) in children:
+            label = "  " * depth + path.rsplit("/", 1)[-1]
+            print "%-50s %6d %10.3f %10.3f %10.3f" % (label, count, total,
+                                                     total / count, longest)
+            show(path, depth + 1)
+
+    show(None, 0)
+
+
 def screen(driver):
     """Opens a screen(1) session to all nodes in your Vagrant environment.
 
@@ -141,8 +253,12 @@ def underlined(msg, ch="-"):
 
 
 COMMANDS = {
+    "agent": agent,
+    "apply": apply_topology,
     "destroy": destroy,
     "list": list_objects,
+    "pool": pool,
+    "profile": profile,
     "screen": screen,
 }
 
@@ -158,12 +274,21 @@ def main():
                                 formatter_class=formatter_class)
     p.add_argument("command", metavar="<cmd>", type=str, choices=COMMANDS,
                    help="command to execute")
+    p.add_argument("args", metavar="<arg>", type=str, nargs="*",
+                   help="command arguments")
     args = p.parse_args()
 
+    func = COMMANDS[args.command]
+    spec = inspect.getargspec(func)
+    n_args = len(spec.args) - 1
+    if (len(args.args) < n_args - len(spec.defaults or ()) or
+            (len(args.args) > n_args and spec.varargs is None)):
+        p.error("wrong number of arguments for %s" % (args.command,))
+
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s %(name)s %(message)s")
     driver = get_driver(VAGRANT)()
-    return COMMANDS[args.command](driver)
+    return func(driver, *args.args)
 
 
 def format_help():
@@ -171,12 +296,25 @@ def format_help():
 
     Available commands:
 
+        agent [<socket>]
+            %(agent)s
+
+        apply <file> [<max_parallel>]
+            %(apply)s
+
         destroy
             %(destroy)s
 
         list
             %(list)s
 
+        pool [list | create <image> <size> <count> [saved] | refill |
+              destroy <pool>]
+            %(pool)s
+
+        profile [<file>]
+            %(profile)s
+
         screen
             %(screen)s
 
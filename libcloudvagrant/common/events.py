@@ -0,0 +1,102 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Parser for the machine-readable output of Vagrant.
+
+With ``--machine-readable``, Vagrant writes one event per line, of the form
+``timestamp,target,type,data...``. Commas within the data fields are
+written as ``%!(VAGRANT_COMMA)``, and newlines as ``\\n``.
+
+"""
+
+import collections
+import re
+
+
+__all__ = [
+    "VagrantEvent",
+    "parse",
+    "phase",
+]
+
+
+class VagrantEvent(collections.namedtuple("VagrantEvent",
+                                          "timestamp target type data")):
+
+    """An event in the machine-readable output of Vagrant.
+
+    ``timestamp`` is the Unix time of the event, ``target`` the name of the
+    machine it refers to (or ``None``), ``type`` the event type (like ``ui``
+    or ``box-name``), and ``data`` a tuple with the remaining fields.
+
+    """
+
+    __slots__ = ()
+
+
+def parse(lines):
+    """Yields a :class:`VagrantEvent` for each line of machine-readable
+    output in ``lines``.
+
+    Lines which are not in machine-readable format are skipped.
+
+    """
+    for line in lines:
+        bits = line.rstrip("\r\n").split(",")
+        if len(bits) < 3 or not bits[0].isdigit():
+            continue
+        yield VagrantEvent(timestamp=int(bits[0]),
+                           target=bits[1] or None,
+                           type=bits[2],
+                           data=tuple(unescape(b) for b in bits[3:]))
+
+
+def unescape(field):
+    return (field.replace("%!(VAGRANT_COMMA)", ",")
+            .replace("\\n", "\n")
+            .replace("\\r", "\r"))
+
+
+# Phases of ``vagrant up`` and ``vagrant reload``, and the messages
+# announcing them.
+_PHASES = [
+    ("halt", re.compile(r"Attempting graceful shutdown|Forcing shutdown")),
+    ("import", re.compile(r"Importing base box|Cloning VM")),
+    ("boot", re.compile(r"Booting VM")),
+    ("ssh-wait", re.compile(r"Waiting for machine to boot")),
+    ("ssh-ready", re.compile(r"Machine booted and ready")),
+]
+
+
+def phase(event):
+    """Returns the name of the phase starting with the given event, or
+    ``None`` if it does not start any phase.
+
+    Phase names are ``halt``, ``import``, ``boot``, ``ssh-wait`` and
+    ``ssh-ready``.
+
+    """
+    if event.type != "ui":
+        return None
+    message = event.data[-1] if event.data else ""
+    for name, regex in _PHASES:
+        if regex.search(message):
+            return name
+    return None
@@ -0,0 +1,193 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Execution of external commands, with their output read line by line."""
+
+import collections
+import logging
+import subprocess
+import threading
+import time
+
+from libcloudvagrant.common import replay, spans, stats
+
+
+__all__ = [
+    "Command",
+    "command_name",
+    "vagrant_log_level",
+]
+
+
+# Number of output lines kept for error reports.
+TAIL_SIZE = 200
+
+
+class Command(object):
+
+    """A running command.
+
+    Output lines are read as they are produced, and forwarded to the given
+    logger only if its level is ``DEBUG``. The last ``TAIL_SIZE`` lines of
+    the standard output and standard error of the command are kept in
+    attribute ``tail``, for error reports. The standard output is only kept
+    in full (in attribute ``stdout``) if ``capture`` is set, for commands
+    whose output is parsed.
+
+    The standard error of the command is read in a background thread,
+    unless ``merge_stderr`` is set, in which case it is read together with
+    the standard output.
+
+    When the command finishes, its execution is recorded (see
+    :mod:`libcloudvagrant.common.stats` and
+    :mod:`libcloudvagrant.common.spans`) under ``name``, which defaults to the
+    full command line.
+
+    Commands may be recorded to, or replayed from, a trace file (see
+    :mod:`libcloudvagrant.common.replay`).
+
+    """
+
+    def __init__(self, cmdline, log, env=None, cwd=None, merge_stderr=False,
+                 tail_size=TAIL_SIZE, name=None, capture=False):
+        self.cmdline = cmdline
+        self.name = name or cmdline
+        self.log = log
+        self.tail = collections.deque(maxlen=tail_size)
+        self._debug = log.isEnabledFor(logging.DEBUG)
+        self._stdout = [] if capture else None
+        # Bytes read from each stream, each one counted by its own thread
+        self._output_bytes = {"out": 0, "err": 0}
+        self._start = time.time()
+        self._recorded = False
+        self._recorder = replay.recorder(cmdline, env, cwd)
+        if replay.replaying():
+            self._p = replay.popen(cmdline, cwd, merge_stderr)
+        else:
+            self._p = subprocess.Popen(cmdline, shell=True,
+                                       stdout=subprocess.PIPE,
+                                       stderr=(merge_stderr and
+                                               subprocess.STDOUT or
+                                               subprocess.PIPE),
+                                       env=env,
+                                       cwd=cwd)
+        if merge_stderr:
+            self._stderr_reader = None
+        else:
+            self._stderr_reader = threading.Thread(target=self._read_stderr)
+            self._stderr_reader.daemon = True
+            self._stderr_reader.start()
+
+    def __iter__(self):
+        """Yields the lines of the standard output of the command (without
+        their trailing newlines) as they are produced.
+
+        """
+        for line in iter(self._p.stdout.readline, ""):
+            if self._stdout is not None:
+                self._stdout.append(line)
+            line = line.rstrip("\n")
+            self._record(line, "out")
+            yield line
+
+    def wait(self):
+        """Waits until the command finishes, and returns its exit status.
+
+        """
+        for _ in self:
+            pass
+        if self._stderr_reader is not None:
+            self._stderr_reader.join()
+        rc = self._p.wait()
+        if not self._recorded:
+            self._recorded = True
+            wall_time = time.time() - self._start
+            stats.record_command(self.name, self.cmdline, self._start,
+                                 wall_time, rc, self.output_bytes)
+            spans.add(self.name, self._start, wall_time,
+                      cmdline=self.cmdline, status=rc)
+            if self._recorder is not None:
+                self._recorder.finish(rc)
+        return rc
+
+    @property
+    def returncode(self):
+        return self._p.returncode
+
+    @property
+    def output_bytes(self):
+        """Size (in bytes) of the output of the command read so far.
+
+        """
+        return sum(self._output_bytes.values())
+
+    @property
+    def stdout(self):
+        """The standard output of the command read so far, or ``None`` if
+        it isn't captured.
+
+        """
+        if self._stdout is not None:
+            return "".join(self._stdout)
+
+    def _read_stderr(self):
+        for line in iter(self._p.stderr.readline, ""):
+            self._record(line.rstrip("\n"), "err")
+
+    def _record(self, line, stream):
+        self._output_bytes[stream] += len(line) + 1
+        self.tail.append(line)
+        if self._recorder is not None:
+            self._recorder.add(stream, line)
+        if self._debug:
+            self.log.debug("%s", line)
+
+
+def command_name(program, args):
+    """Returns the name under which a command is recorded: the program name
+    followed by the leading words of its first argument, up to the first
+    option (as in ``vagrant box add`` or ``VBoxManage showvminfo``).
+
+    """
+    words = [program]
+    for word in str(args[0]).split() if args else []:
+        if word.startswith("-"):
+            break
+        words.append(word)
+    return " ".join(words)
+
+
+_VAGRANT_LOG_LEVELS = [
+    (logging.DEBUG, "debug"),
+    (logging.INFO, "info"),
+    (logging.WARNING, "warn"),
+]
+
+
+def vagrant_log_level(log):
+    """Returns the value of ``VAGRANT_LOG`` matching the effective level of
+    the given logger.
+
+    """
+    level = log.getEffectiveLevel()
+    for threshold, name in _VAGRANT_LOG_LEVELS:
+        if level <= threshold:
+            return name
+    return "error"
@@ -0,0 +1,276 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Recording and replay of the external commands run by the driver.
+
+If environment variable ``LIBCLOUD_VAGRANT_RECORD`` is set (or after calling
+:func:`record`), every ``vagrant`` and ``VBoxManage`` command is appended to
+the trace file it names, one JSON object per line, with its command line,
+working directory, environment variables set by the driver, output lines
+(with their timing), exit status and wall time. Files which a command
+creates, changes or removes under ``.vagrant`` in its working directory
+(such as the UUIDs of VirtualBox machines) are recorded too.
+
+If environment variable ``LIBCLOUD_VAGRANT_REPLAY`` is set (or after
+calling :func:`replay`), commands aren't executed: their recorded output,
+side effects and exit status are served from the trace file instead, so
+that no Vagrant nor VirtualBox installation is required. Recorded timing is
+divided by ``LIBCLOUD_VAGRANT_REPLAY_SPEED`` (1 by default); a speed of 0
+replays without delays.
+
+A command which was recorded several times is replayed in the recorded
+order, and the last recording is reused when they are exhausted (as when
+polling for the state of a machine).
+
+"""
+
+import json
+import os
+import threading
+import time
+
+
+__all__ = [
+    "popen",
+    "record",
+    "recorder",
+    "recording",
+    "replay",
+    "replaying",
+    "reset",
+]
+
+
+# Status of commands not found in the replayed trace.
+NOT_FOUND = 127
+
+# Only files up to this size are recorded.
+MAX_FILE_SIZE = 64 * 1024
+
+_lock = threading.Lock()
+_record_fname = None
+_entries = None
+_speed = 1.0
+
+
+def record(fname):
+    """Records the commands executed from now on in ``fname``.
+
+    """
+    global _record_fname
+    _record_fname = fname
+
+
+def replay(fname, speed=1.0):
+    """Replays the commands recorded in ``fname`` from now on, at the given
+    ``speed`` (0 meaning without delays).
+
+    """
+    global _entries, _speed
+    entries = {}
+    with open(fname, "r") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries.setdefault(entry["cmdline"], []).append(entry)
+    with _lock:
+        _entries = entries
+        _speed = speed
+
+
+def reset():
+    """Stops recording and replaying commands.
+
+    """
+    global _record_fname, _entries, _speed
+    with _lock:
+        _record_fname = _entries = None
+        _speed = 1.0
+
+
+def recording():
+    return _record_fname is not None
+
+
+def replaying():
+    return _entries is not None
+
+
+def recorder(cmdline, env, cwd):
+    """Returns a :class:`Recorder` for a command which is about to start, or
+    ``None`` if commands aren't being recorded.
+
+    """
+    if _record_fname is not None:
+        return Recorder(_record_fname, cmdline, env, cwd)
+
+
+def popen(cmdline, cwd, merge_stderr):
+    """Returns a :class:`ReplayedProcess` serving the next recording of
+    ``cmdline``.
+
+    """
+    with _lock:
+        recordings = _entries.get(cmdline)
+        if not recordings:
+            entry = {
+                "output": [[0, "err", "%s: not found in replayed trace" %
+                            (cmdline,)]],
+                "status": NOT_FOUND,
+                "wall_time": 0,
+            }
+        elif len(recordings) > 1:
+            entry = recordings.pop(0)
+        else:
+            entry = recordings[0]
+        speed = _speed
+    return ReplayedProcess(entry, cwd, merge_stderr, speed)
+
+
+def _vagrant_files(cwd):
+    """Returns the modification times and sizes of the files under
+    ``.vagrant`` in ``cwd``, by path relative to ``cwd``.
+
+    """
+    ret = {}
+    if cwd is None:
+        return ret
+    for dname, _, fnames in os.walk(os.path.join(cwd, ".vagrant")):
+        for fname in fnames:
+            path = os.path.join(dname, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            ret[os.path.relpath(path, cwd)] = (st.st_mtime, st.st_size)
+    return ret
+
+
+class Recorder(object):
+
+    """The recording of a command in progress."""
+
+    def __init__(self, fname, cmdline, env, cwd):
+        self.fname = fname
+        self.cwd = cwd
+        self._start = time.time()
+        self._files = _vagrant_files(cwd)
+        self.entry = {
+            "cmdline": cmdline,
+            "cwd": cwd,
+            "env": dict((k, v) for k, v in (env or {}).items()
+                        if os.environ.get(k) != v),
+            "output": [],
+        }
+
+    def add(self, stream, line):
+        """Records an output ``line`` of the given ``stream`` (``"out"`` or
+        ``"err"``).
+
+        """
+        self.entry["output"].append([time.time() - self._start, stream, line])
+
+    def finish(self, status):
+        """Records the exit status and side effects of the command, and
+        appends it to the trace file.
+
+        """
+        self.entry["status"] = status
+        self.entry["wall_time"] = time.time() - self._start
+        before = self._files
+        after = _vagrant_files(self.cwd)
+        files = {}
+        for path, (mtime, size) in after.items():
+            if before.get(path) != (mtime, size) and size <= MAX_FILE_SIZE:
+                with open(os.path.join(self.cwd, path), "r") as f:
+                    files[path] = f.read()
+        self.entry["files"] = files
+        self.entry["removed"] = sorted(set(before) - set(after))
+        line = json.dumps(self.entry)
+        with _lock:
+            with open(self.fname, "a") as f:
+                f.write(line + "\n")
+
+
+class _ReplayedStream(object):
+
+    def __init__(self, process, lines):
+        self._process = process
+        self._lines = list(lines)
+
+    def readline(self):
+        if not self._lines:
+            return ""
+        offset, line = self._lines.pop(0)
+        self._process._sleep_until(offset)
+        return line + "\n"
+
+
+class ReplayedProcess(object):
+
+    """Stands for a :class:`subprocess.Popen` object, serving the output,
+    side effects and exit status of a recorded command.
+
+    """
+
+    def __init__(self, entry, cwd, merge_stderr, speed):
+        self.entry = entry
+        self.cwd = cwd
+        self.speed = speed
+        self.returncode = None
+        self._start = time.time()
+        out = [(t, line) for t, stream, line in entry["output"]
+               if merge_stderr or stream == "out"]
+        err = [(t, line) for t, stream, line in entry["output"]
+               if not merge_stderr and stream == "err"]
+        self.stdout = _ReplayedStream(self, out)
+        self.stderr = _ReplayedStream(self, err)
+
+    def wait(self):
+        if self.returncode is None:
+            self._sleep_until(self.entry["wall_time"])
+            if self.cwd is not None:
+                for path, contents in self.entry.get("files", {}).items():
+                    fname = os.path.join(self.cwd, path)
+                    if not os.access(os.path.dirname(fname), os.F_OK):
+                        os.makedirs(os.path.dirname(fname))
+                    with open(fname, "w") as f:
+                        f.write(contents)
+                for path in self.entry.get("removed", []):
+                    try:
+                        os.unlink(os.path.join(self.cwd, path))
+                    except OSError:
+                        pass
+            self.returncode = self.entry["status"]
+        return self.returncode
+
+    def _sleep_until(self, offset):
+        if self.speed > 0:
+            delay = self._start + offset / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+
+if os.environ.get("LIBCLOUD_VAGRANT_RECORD"):
+    record(os.environ["LIBCLOUD_VAGRANT_RECORD"])
+
+if os.environ.get("LIBCLOUD_VAGRANT_REPLAY"):
+    replay(os.environ["LIBCLOUD_VAGRANT_REPLAY"],
+           float(os.environ.get("LIBCLOUD_VAGRANT_REPLAY_SPEED", "1")))
@@ -0,0 +1,248 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Timing spans for the phases of driver operations.
+
+Spans are only recorded if environment variable ``LIBCLOUD_VAGRANT_PROFILE``
+is set, or after calling :func:`enable`. Spans nest: a span started while
+another one is open in the same thread is recorded as its child. Work handed
+to other threads is recorded under the span which handed it over by passing
+the result of :func:`current` to :func:`within` in those threads.
+
+When ``LIBCLOUD_VAGRANT_PROFILE`` is set, the spans recorded by a process are
+added to the file it names when the process exits, in the Chrome trace event
+format (which ``chrome://tracing`` and ``libcloud-vagrant profile`` read).
+
+"""
+
+import atexit
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+import lockfile
+
+
+__all__ = [
+    "add",
+    "current",
+    "enable",
+    "export",
+    "load",
+    "reset",
+    "span",
+    "spans",
+    "traced",
+    "within",
+]
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_spans = []
+_enabled = bool(os.environ.get("LIBCLOUD_VAGRANT_PROFILE"))
+
+
+def enable(enabled=True):
+    """Enables (or disables) the recording of spans.
+
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current():
+    """Returns the path of the spans open in this thread, for
+    :func:`within`.
+
+    """
+    return list(_stack())
+
+
+@contextmanager
+def within(path):
+    """Context manager which records the spans started within it as
+    children of the spans in ``path`` (as returned by :func:`current`,
+    usually in the thread which handed work over to this one).
+
+    """
+    previous = getattr(_local, "stack", None)
+    _local.stack = list(path)
+    try:
+        yield
+    finally:
+        _local.stack = previous
+
+
+def add(name, start, duration, **args):
+    """Records a span which has already finished, as a child of the span open
+    in this thread (if any).
+
+    """
+    if _enabled:
+        _record(_stack() + [name], start, duration, args)
+
+
+@contextmanager
+def span(name, **args):
+    """Context manager which records a span named ``name`` around its body.
+
+    Extra keyword arguments are recorded with the span.
+
+    """
+    if not _enabled:
+        yield
+        return
+    stack = _stack()
+    stack.append(name)
+    path = list(stack)
+    start = time.time()
+    try:
+        yield
+    finally:
+        stack.pop()
+        _record(path, start, time.time() - start, args)
+
+
+def _record(path, start, duration, args):
+    with _lock:
+        _spans.append({
+            "name": path[-1],
+            "path": "/".join(path),
+            "start": start,
+            "duration": duration,
+            "pid": os.getpid(),
+            "tid": threading.current_thread().ident,
+            "args": args,
+        })
+
+
+def traced(func):
+    """Decorator which records a span named after the decorated function
+    around each of its calls.
+
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def spans():
+    """Returns a list of the spans recorded so far, as dictionaries.
+
+    """
+    with _lock:
+        return list(_spans)
+
+
+def reset():
+    """Discards the spans recorded so far.
+
+    """
+    with _lock:
+        del _spans[:]
+
+
+def export(fname, chrome=True):
+    """Adds the spans recorded so far to file ``fname``, and forgets them.
+
+    The file is written in the Chrome trace format if ``chrome`` is true,
+    or as a plain JSON list of spans otherwise. Processes exporting to the
+    same file do so in turn, and readers never see it half-written.
+
+    """
+    with _lock:
+        recorded = list(_spans)
+        del _spans[:]
+    if chrome:
+        events = [to_chrome(s) for s in recorded]
+    else:
+        events = recorded
+    with lockfile.FileLock(fname):
+        existing = []
+        if os.access(fname, os.R_OK):
+            existing = load(fname, chrome=chrome)
+        if chrome:
+            data = {"traceEvents": existing + events}
+        else:
+            data = existing + events
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(fname) + ".",
+                                   dir=os.path.dirname(os.path.abspath(fname)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.rename(tmp, fname)
+        except:
+            os.unlink(tmp)
+            raise
+
+
+def load(fname, chrome=True):
+    """Returns the list of spans (or of Chrome trace events, if ``chrome`` is
+    true) stored in file ``fname``.
+
+    """
+    with open(fname, "r") as f:
+        data = json.load(f)
+    if chrome and isinstance(data, dict):
+        return data.get("traceEvents", [])
+    return data
+
+
+def to_chrome(s):
+    """Returns the Chrome trace event ("complete" event, with timestamps in
+    microseconds) for the given span.
+
+    """
+    args = dict(s["args"])
+    args["path"] = s["path"]
+    return {
+        "name": s["name"],
+        "ph": "X",
+        "ts": int(s["start"] * 1e6),
+        "dur": int(s["duration"] * 1e6),
+        "pid": s["pid"],
+        "tid": s["tid"],
+        "args": args,
+    }
+
+
+def _export_at_exit():
+    fname = os.environ.get("LIBCLOUD_VAGRANT_PROFILE")
+    if fname and _spans:
+        export(fname)
+
+
+atexit.register(_export_at_exit)
@@ -0,0 +1,137 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""A cache of the states of VirtualBox machines.
+
+A cached state is reused for ``LIBCLOUD_VAGRANT_STATE_TTL`` seconds (2 by
+default) after being read. If the VirtualBox backend reports changes of
+machine states as they happen (see
+:meth:`.VirtualBoxBackend.watch_node_states`), cached states are updated by
+those reports instead, and reused for up to ``EVENT_TTL`` seconds, until the
+backend stops reporting them.
+
+Driver operations which change the state of a node (such as
+``destroy_node()`` or ``reboot_node()``) discard its cached state, so that
+states are only stale for (at most) those times when they are changed by
+other processes, or outside of the driver.
+
+"""
+
+import os
+import threading
+import time
+
+from libcloud.compute.types import NodeState
+
+
+__all__ = [
+    "cached",
+    "get",
+    "invalidate",
+    "watch",
+]
+
+
+# Seconds for which a state read from VirtualBox is reused.
+TTL = float(os.environ.get("LIBCLOUD_VAGRANT_STATE_TTL", "2"))
+
+# Seconds for which a state is reused when state changes are reported.
+EVENT_TTL = 60
+
+_lock = threading.Lock()
+_states = {}
+_watched = None
+_event_driven = False
+
+
+def cached(node_uuid):
+    """Returns the cached state of a node, or ``None`` if it's unknown or
+    stale.
+
+    """
+    with _lock:
+        state, timestamp = _states.get(node_uuid, (None, 0))
+        ttl = _event_driven and EVENT_TTL or TTL
+    if time.time() - timestamp < ttl:
+        return state
+
+
+def get(node_uuid, fetch):
+    """Returns the cached state of a node, calling ``fetch()`` to read it if
+    it's unknown or stale.
+
+    """
+    state = cached(node_uuid)
+    if state is None:
+        state = fetch()
+        if state is not None and state != NodeState.UNKNOWN:
+            _set(node_uuid, state)
+    return state
+
+
+def invalidate(node_uuid=None):
+    """Discards the cached state of a node (or of all nodes, if
+    ``node_uuid`` is ``None``).
+
+    """
+    with _lock:
+        if node_uuid is None:
+            _states.clear()
+        else:
+            _states.pop(node_uuid, None)
+
+
+def watch(backend):
+    """Keeps cached states up to date with the state changes reported by
+    ``backend``, if it reports them.
+
+    """
+    global _watched, _event_driven
+    with _lock:
+        if backend is _watched:
+            return
+        _watched = backend
+        _states.clear()
+        _event_driven = False
+
+    def on_change(node_uuid, state):
+        if backend is _watched:
+            _set(node_uuid, state)
+
+    # States are read again once their time-to-live expires, if the
+    # backend stops reporting changes (even before this function returns)
+    stopped = []
+
+    def on_stop():
+        global _event_driven
+        with _lock:
+            stopped.append(True)
+            if backend is _watched:
+                _event_driven = False
+
+    event_driven = bool(backend.watch_node_states(on_change, on_stop))
+    with _lock:
+        if backend is _watched:
+            _event_driven = event_driven and not stopped
+
+
+def _set(node_uuid, state):
+    with _lock:
+        _states[node_uuid] = (state, time.time())
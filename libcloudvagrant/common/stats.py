@@ -0,0 +1,222 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Instrumentation of the external commands run by the driver.
+
+Each ``vagrant`` and ``VBoxManage`` command is recorded together with the
+driver operation (like ``create_node``) which caused it to run: its
+subcommand (like ``vagrant up``), wall time, exit status and output size.
+
+Statistics are kept for the whole process. If environment variable
+``LIBCLOUD_VAGRANT_TRACE`` is set, each command is also appended as a JSON
+object to the file it names, one line per command.
+
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+__all__ = [
+    "instrumented",
+    "operation",
+    "record_command",
+    "reset",
+    "snapshot",
+]
+
+
+# Upper bounds (in seconds) of the buckets of wall time histograms.
+BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, float("inf")]
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_commands = {}
+_operations = {}
+
+
+class _Histogram(object):
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.output_bytes = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, wall_time, status=0, output_bytes=0):
+        self.count += 1
+        if status:
+            self.failures += 1
+        self.total_time += wall_time
+        self.max_time = max(self.max_time, wall_time)
+        self.output_bytes += output_bytes
+        for i, bound in enumerate(BUCKETS):
+            if wall_time <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "total_time": self.total_time,
+            "max_time": self.max_time,
+            "output_bytes": self.output_bytes,
+            "histogram": [(bound, n) for (bound, n) in zip(BUCKETS,
+                                                           self.buckets)],
+        }
+
+
+def current_operation():
+    """Returns the name of the outermost driver operation running in this
+    thread, or ``None``.
+
+    """
+    stack = getattr(_local, "stack", None)
+    if stack:
+        return stack[0]
+
+
+@contextmanager
+def operation(name, record_call=True):
+    """Context manager which attributes the commands run within it to the
+    driver operation ``name``.
+
+    Nested operations are attributed to the outermost one. Unless
+    ``record_call`` is false, the wall time of the outermost operation is
+    recorded too.
+
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        stack.pop()
+        if record_call and not stack:
+            with _lock:
+                entry = _operations.setdefault(name, {
+                    "calls": _Histogram(),
+                    "commands": {},
+                })
+                entry["calls"].add(time.time() - start)
+
+
+def instrumented(func):
+    """Decorator for driver methods, which runs them as an
+    :func:`operation` named after them.
+
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with operation(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def record_command(command, cmdline, start, wall_time, status, output_bytes):
+    """Records the execution of an external command.
+
+    :param command: Command name, including its subcommand (like
+                    ``vagrant up``).
+    :param cmdline: Full command line.
+    :param start: Unix time at which the command started.
+    :param wall_time: Wall time taken by the command (in seconds).
+    :param status: Exit status of the command.
+    :param output_bytes: Size of the output of the command (in bytes).
+
+    """
+    op = current_operation()
+    with _lock:
+        _commands.setdefault(command, _Histogram()).add(wall_time, status,
+                                                        output_bytes)
+        if op is not None:
+            entry = _operations.setdefault(op, {
+                "calls": _Histogram(),
+                "commands": {},
+            })
+            h = entry["commands"].setdefault(command, _Histogram())
+            h.add(wall_time, status, output_bytes)
+
+        trace = os.environ.get("LIBCLOUD_VAGRANT_TRACE")
+        if trace:
+            with open(trace, "a") as f:
+                f.write(json.dumps({
+                    "start": start,
+                    "operation": op,
+                    "command": command,
+                    "cmdline": cmdline,
+                    "wall_time": wall_time,
+                    "status": status,
+                    "output_bytes": output_bytes,
+                }) + "\n")
+
+
+def snapshot():
+    """Returns the statistics recorded so far.
+
+    The result is a dictionary with two keys:
+
+    ``commands``
+        Statistics for each command name (like ``vagrant up``).
+
+    ``operations``
+        Statistics for each driver operation (like ``create_node``): under
+        ``calls`` those of the operation itself, and under ``commands`` those
+        of the commands it ran.
+
+    Each set of statistics is a dictionary with keys ``count``, ``failures``,
+    ``total_time``, ``max_time``, ``output_bytes`` and ``histogram``. The
+    histogram is a list of ``(upper_bound, count)`` tuples, with wall times
+    in seconds.
+
+    """
+    with _lock:
+        return {
+            "commands": dict((k, v.to_dict()) for (k, v) in _commands.items()),
+            "operations": dict(
+                (op, {
+                    "calls": entry["calls"].to_dict(),
+                    "commands": dict((k, v.to_dict())
+                                     for (k, v) in entry["commands"].items()),
+                })
+                for (op, entry) in _operations.items()),
+        }
+
+
+def reset():
+    """Discards the statistics recorded so far.
+
+    """
+    with _lock:
+        _commands.clear()
+        _operations.clear()
@@ -18,6 +18,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import os
+
 import jinja2
 
 
@@ -32,5 +34,9 @@ env = jinja2.Environment(loader=loader, autoescape=False)
 
 def render(template_name, context, fname):
     t = env.get_template(template_name)
-    with open(fname, "wt") as f:
+    # Vagrant may be reading ``fname`` while we write it, so we replace it
+    # atomically.
+    tmp_fname = "%s.tmp" % (fname,)
+    with open(tmp_fname, "wt") as f:
         f.write(t.render(context).encode("utf8"))
+    os.rename(tmp_fname, fname)
@@ -0,0 +1,268 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Declarative descriptions of Vagrant environments, applied by
+``VagrantDriver.ex_apply_topology()``.
+
+A topology is a dict (read from a JSON or, if PyYAML is installed, a YAML
+file by :func:`load`) with these optional keys:
+
+``networks``
+    Networks by name, as dicts with keys ``cidr``, and optionally
+    ``public``, ``nic_type`` and ``promiscuous`` (see
+    ``VagrantDriver.ex_create_network()``).
+
+``volumes``
+    Volumes by name, as dicts with keys ``size`` (in GB), and optionally
+    ``variant`` (see ``VagrantDriver.create_volume()``) and ``type`` (see
+    ``VagrantDriver.ex_set_volume_type()``).
+
+``nodes``
+    Groups of nodes by name, as dicts with keys ``image``, and optionally:
+
+    ``size``
+        Name of the size of the nodes (``default`` by default).
+
+    ``count``
+        Number of nodes, named ``<group>-1``, ``<group>-2`` and so on. If
+        not given, the group has one node, named as the group.
+
+    ``networks``, ``volumes``
+        Names of the networks the nodes are connected to, and of the
+        volumes attached to them.
+
+    ``deploy``
+        Deployment steps run on the nodes once created, as dicts with keys
+        ``script`` (the contents of a script) or ``script_file`` (the path
+        to a script), and optionally ``args``, or with keys ``file`` and
+        ``target`` (the paths of a file to copy, and of its copy).
+
+    ``depends_on``
+        Names of the groups whose nodes are created and deployed before
+        these.
+
+For example::
+
+    {
+        "networks": {"priv": {"cidr": "172.17.0.0/16"}},
+        "nodes": {
+            "db": {"image": "hashicorp/precise64", "networks": ["priv"]},
+            "web": {
+                "image": "hashicorp/precise64",
+                "count": 2,
+                "networks": ["priv"],
+                "depends_on": ["db"]
+            }
+        }
+    }
+
+"""
+
+import json
+import os
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from libcloud.common.types import LibcloudError
+from libcloud.compute.deployment import (
+    FileDeployment,
+    MultiStepDeployment,
+    ScriptDeployment,
+    ScriptFileDeployment,
+)
+
+from libcloudvagrant.compute.types import VagrantVolume
+
+
+__all__ = [
+    "deployment",
+    "load",
+    "node_names",
+    "normalize",
+    "waves",
+]
+
+
+_KEYS = {
+    "networks": ("cidr", "public", "nic_type", "promiscuous"),
+    "volumes": ("size", "variant", "type"),
+    "nodes": ("image", "size", "count", "networks", "volumes", "deploy",
+              "depends_on"),
+}
+
+_REQUIRED = {
+    "networks": ("cidr",),
+    "volumes": ("size",),
+    "nodes": ("image",),
+}
+
+
+def load(fname):
+    """Returns the topology in file ``fname``, which is read as YAML if its
+    name ends in ``.yaml`` or ``.yml``, and as JSON otherwise.
+
+    Relative paths in deployment steps are taken as relative to the
+    directory of ``fname``.
+
+    """
+    with open(fname) as f:
+        if os.path.splitext(fname)[1] in (".yaml", ".yml"):
+            if yaml is None:
+                raise LibcloudError("PyYAML is needed for reading %s" %
+                                    (fname,))
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    spec = normalize(spec)
+    base = os.path.dirname(os.path.abspath(fname))
+    for group in spec["nodes"].values():
+        for step in group["deploy"]:
+            for k in ("script_file", "file"):
+                if k in step:
+                    step[k] = os.path.join(base, step[k])
+    return spec
+
+
+def normalize(spec):
+    """Returns a copy of ``spec`` with all optional keys set, raising an
+    error if it isn't a valid topology.
+
+    """
+    if not isinstance(spec, dict):
+        raise LibcloudError("Topologies must be dicts")
+    unknown = set(spec) - set(_KEYS)
+    if unknown:
+        raise LibcloudError("Unknown topology keys: %s" %
+                            (", ".join(sorted(unknown)),))
+
+    ret = {}
+    for kind, keys in _KEYS.items():
+        ret[kind] = {}
+        for name, params in (spec.get(kind) or {}).items():
+            params = dict(params or {})
+            unknown = set(params) - set(keys)
+            if unknown:
+                raise LibcloudError("Unknown keys in %s '%s': %s" %
+                                    (kind[:-1], name,
+                                     ", ".join(sorted(unknown))))
+            for k in _REQUIRED[kind]:
+                if k not in params:
+                    raise LibcloudError("No %s given for %s '%s'" %
+                                        (k, kind[:-1], name))
+            ret[kind][name] = params
+
+    for params in ret["networks"].values():
+        params.setdefault("public", False)
+        params.setdefault("nic_type", None)
+        params.setdefault("promiscuous", None)
+    for params in ret["volumes"].values():
+        params.setdefault("variant", "Standard")
+        params.setdefault("type", None)
+    for name, group in ret["nodes"].items():
+        group.setdefault("size", "default")
+        group.setdefault("count", None)
+        group["deploy"] = [dict(step) for step in group.get("deploy") or []]
+        for k in ("networks", "volumes", "depends_on"):
+            group[k] = list(group.get(k) or [])
+        for kind in ("networks", "volumes"):
+            for dep in group[kind]:
+                if dep not in ret[kind]:
+                    raise LibcloudError("Unknown %s '%s' in node group "
+                                        "'%s'" % (kind[:-1], dep, name))
+        for step in group["deploy"]:
+            kinds = [k for k in ("script", "script_file", "file")
+                     if k in step]
+            if len(kinds) != 1 or ("file" in step) != ("target" in step):
+                raise LibcloudError("Invalid deployment step in node group "
+                                    "'%s': %s" % (name, step))
+
+    users = {}
+    for name, group in ret["nodes"].items():
+        for volume in group["volumes"]:
+            users.setdefault(volume, []).extend(node_names(name, group))
+    for volume, nodes in users.items():
+        mtype = ret["volumes"][volume]["type"] or "normal"
+        if len(nodes) > 1 and not VagrantVolume.MTYPES.get(mtype):
+            raise LibcloudError("Volume '%s' of type %s cannot be attached "
+                                "to several nodes: %s" %
+                                (volume, mtype, ", ".join(sorted(nodes))))
+    waves(ret["nodes"])
+    return ret
+
+
+def node_names(name, group):
+    """Returns the names of the nodes of a group.
+
+    """
+    if group["count"] is None:
+        return [name]
+    return ["%s-%d" % (name, i) for i in range(1, int(group["count"]) + 1)]
+
+
+def waves(groups):
+    """Returns the names of the node groups in ``groups`` in the order they
+    have to be applied, as a list of lists of groups which don't depend on
+    each other.
+
+    Raises an error if groups depend on unknown groups, or on each other.
+
+    """
+    pending = {}
+    for name, group in groups.items():
+        for dep in group["depends_on"]:
+            if dep not in groups:
+                raise LibcloudError("Unknown node group '%s' in '%s'" %
+                                    (dep, name))
+        pending[name] = set(group["depends_on"])
+
+    ret = []
+    while pending:
+        wave = sorted(name for (name, deps) in pending.items() if not deps)
+        if not wave:
+            raise LibcloudError("Circular dependencies between node groups "
+                                "%s" % (", ".join(sorted(pending)),))
+        for name in wave:
+            del pending[name]
+        for deps in pending.values():
+            deps.difference_update(wave)
+        ret.append(wave)
+    return ret
+
+
+def deployment(group):
+    """Returns the deployment of the nodes of a group, or ``None`` if it has
+    no deployment steps.
+
+    """
+    steps = []
+    for step in group["deploy"]:
+        if "script" in step:
+            steps.append(ScriptDeployment(step["script"],
+                                          args=step.get("args")))
+        elif "script_file" in step:
+            steps.append(ScriptFileDeployment(step["script_file"],
+                                              args=step.get("args")))
+        else:
+            steps.append(FileDeployment(step["file"], step["target"]))
+    if steps:
+        return MultiStepDeployment(steps)
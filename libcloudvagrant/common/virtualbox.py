@@ -18,90 +18,450 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-"""Virtualbox-related code."""
+"""Virtualbox-related code.
+
+VirtualBox is driven through a backend, chosen with environment variable
+``LIBCLOUD_VAGRANT_BACKEND``:
+
+``cli``
+    Runs ``VBoxManage`` for each operation (see :class:`CLIBackend`).
+
+``vboxapi``
+    Uses the VirtualBox Python API, keeping a connection to VirtualBox open
+    (see :class:`VBoxAPIBackend`).
+
+``memory``
+    Keeps machines and volumes in memory, for tests (see
+    :class:`MemoryBackend`).
+
+By default, the VirtualBox Python API is used if it can be imported, and
+``VBoxManage`` otherwise (or when commands are being recorded or replayed,
+see :mod:`libcloudvagrant.common.replay`).
+
+"""
 
 import logging
 import os
 import re
-import subprocess
+import threading
+import time
+
+from contextlib import contextmanager
 
 from libcloud.common.types import LibcloudError
 from libcloud.compute.types import NodeState
 
+from libcloudvagrant.common import process, replay, spans, states, stats
+
 
 __all__ = [
+    "CLIBackend",
+    "MemoryBackend",
+    "VBoxAPIBackend",
+    "VirtualBoxBackend",
     "attach_volume",
+    "attach_volumes",
+    "create_differencing_volume",
     "create_volume",
+    "delete_snapshot",
     "destroy_host_interface",
     "destroy_volume",
     "detach_volume",
+    "detach_volumes",
+    "get_backend",
     "get_host_interfaces",
     "get_node_state",
+    "restore_snapshot",
+    "set_backend",
+    "set_host_io_cache",
+    "set_node_limits",
+    "set_volume_type",
+    "start_node",
+    "stop_node",
+    "take_snapshot",
 ]
 
 
 LOG = logging.getLogger("liibcloudvagrant")
 
+# Number of ports of the SATA controllers added by ``vagrant-libcloud-helper``.
+SATA_PORTS = 30
 
-def attach_volume(node_uuid, volume_path, device):
-    controller, device, port = find_sata_slot(node_uuid, device)
-    vboxmanage("storageattach", node_uuid,
-               "--storagectl", '"%s"' % (controller,),
-               "--port", port,
-               "--device", device,
-               "--type hdd",
-               "--medium", volume_path)
+# Ways of stopping nodes (see :func:`stop_node`).
+STOP_MODES = ("acpi", "poweroff", "savestate")
 
+# Bandwidth groups of nodes whose sizes limit their disk or network bandwidth,
+# created by the ``Vagrantfile`` template along with their machines.
+DISK_BANDWIDTH_GROUP = "libcloud-disk"
+NETWORK_BANDWIDTH_GROUP = "libcloud-network"
 
-def create_volume(path, size):
-    return vboxmanage("createhd",
-                      "--size", size,
-                      "--format VDI",
-                      "--filename", path)
+# Storage variants of volumes (see :func:`create_volume`), and the disk image
+# format used for each.
+VOLUME_VARIANTS = {
+    "Fixed": "VDI",
+    "Split2G": "VMDK",
+    "Standard": "VDI",
+}
 
+# Types of network adapters, and promiscuous modes of network adapters (see
+# ``VagrantDriver.ex_create_network()``).
+NIC_TYPES = ("Am79C970A", "Am79C973", "82540EM", "82543GC", "82545EM",
+             "virtio")
+PROMISCUOUS_MODES = ("deny", "allow-vms", "allow-all")
 
-def destroy_host_interface(ifname):
-    return vboxmanage("hostonlyif remove", ifname)
 
+def attach_volume(node_uuid, volume_path, device, nonrotational=False,
+                  discard=False, bandwidth_group=None):
+    return get_backend().attach_volume(node_uuid, volume_path, device,
+                                       nonrotational, discard,
+                                       bandwidth_group)
 
-_VOLUME_RE_TEMPL = r'"(.+?)-(\d+)-(\d)"="(%s)"'
+
+def attach_volumes(node_uuid, attachments, bandwidth_group=None):
+    """Attaches several volumes to the first free SATA devices of a node.
+    ``attachments`` is a list of ``(volume_path, nonrotational, discard)``
+    tuples.
+
+    Returns a list with, for each attachment, ``None`` if the volume was
+    attached, or the exception raised otherwise.
+
+    """
+    return get_backend().attach_volumes(node_uuid, attachments,
+                                        bandwidth_group)
+
+
+def create_volume(path, size, variant="Standard"):
+    """Creates a volume of ``size`` megabytes. ``variant`` is one of:
+
+    ``Standard``
+        A dynamically allocated VDI image, which grows as it's written to.
+
+    ``Fixed``
+        A VDI image allocated upfront.
+
+    ``Split2G``
+        A dynamically allocated VMDK image, split in files of up to 2 GB.
+
+    """
+    if variant not in VOLUME_VARIANTS:
+        raise LibcloudError("Unknown volume variant '%s'" % (variant,))
+    return get_backend().create_volume(path, size, variant)
+
+
+def create_differencing_volume(path, base_path):
+    return get_backend().create_differencing_volume(path, base_path)
+
+
+def delete_snapshot(node_uuid, name):
+    return get_backend().delete_snapshot(node_uuid, name)
+
+
+def destroy_host_interface(ifname):
+    return get_backend().destroy_host_interface(ifname)
 
 
 def destroy_volume(volume_path):
-    cmdline = ["closemedium disk", volume_path]
-    if os.access(volume_path, os.F_OK):
-        cmdline.append("--delete")
-    vboxmanage(*cmdline)
+    return get_backend().destroy_volume(volume_path)
 
 
 def detach_volume(node_uuid, volume_path):
-    frag = vboxmanage("showvminfo", node_uuid, "--details --machinereadable")
-    m = re.search(_VOLUME_RE_TEMPL % (re.escape(volume_path),), frag)
-    if m:
-        controller, device, port = m.group(1), m.group(3), m.group(2)
-        vboxmanage("storageattach", node_uuid,
-                   "--storagectl", '"%s"' % (controller,),
-                   "--port", port,
-                   "--device", device,
-                   "--type hdd",
-                   "--medium none")
+    return get_backend().detach_volume(node_uuid, volume_path)
 
 
-_HOST_IFACES_RE = re.compile(r'^hostonlyadapter(\d+)="(.+?)"$')
+def detach_volumes(node_uuid, volume_paths):
+    """Detaches several volumes from a node, if attached.
+
+    Returns a list with, for each volume, ``None`` if the volume was
+    detached, or the exception raised otherwise.
+
+    """
+    return get_backend().detach_volumes(node_uuid, volume_paths)
 
 
 def get_host_interfaces(node_uuid):
-    ret = []
-    frag = vboxmanage("showvminfo", node_uuid, "--details --machinereadable")
-    for line in frag.splitlines():
-        m = _HOST_IFACES_RE.search(line)
-        if m:
-            ret.append((m.group(1), m.group(2)))
-    LOG.debug("get_host_interfaces(%s): %s", node_uuid, ret)
-    return [iface for (_, iface) in sorted(ret)]
+    return get_backend().get_host_interfaces(node_uuid)
 
 
-_NODE_STATE_RE = re.compile(r'VMState="(.+?)"')
+def get_node_state(node_uuid):
+    """Returns the state of a node, which may have been cached (see
+    :mod:`libcloudvagrant.common.states`).
+
+    """
+    backend = get_backend()
+    states.watch(backend)
+    return states.get(node_uuid, lambda: backend.get_node_state(node_uuid))
+
+
+def restore_snapshot(node_uuid, name):
+    states.invalidate(node_uuid)
+    return get_backend().restore_snapshot(node_uuid, name)
+
+
+def set_host_io_cache(node_uuid, enabled):
+    return get_backend().set_host_io_cache(node_uuid, enabled)
+
+
+def set_node_limits(node_uuid, cpu_execution_cap=None, disk_bandwidth=None,
+                    network_bandwidth=None):
+    """Changes the resource limits of a node, running or not.
+
+    ``cpu_execution_cap`` is the percentage of host CPU time each virtual
+    CPU may use, and bandwidths are in megabytes per second. Limits which
+    are ``None`` are left alone. Bandwidths may only be changed for nodes
+    which have the bandwidth groups :data:`DISK_BANDWIDTH_GROUP` and
+    :data:`NETWORK_BANDWIDTH_GROUP`.
+
+    """
+    if cpu_execution_cap is not None and not 1 <= cpu_execution_cap <= 100:
+        raise LibcloudError("Invalid CPU execution cap %s" %
+                            (cpu_execution_cap,))
+    for limit in (disk_bandwidth, network_bandwidth):
+        if limit is not None and limit < 1:
+            raise LibcloudError("Invalid bandwidth limit %s" % (limit,))
+    return get_backend().set_node_limits(node_uuid, cpu_execution_cap,
+                                         disk_bandwidth, network_bandwidth)
+
+
+def set_volume_type(volume_path, mtype):
+    return get_backend().set_volume_type(volume_path, mtype)
+
+
+def start_node(node_uuid):
+    """Starts a stopped or saved node, without a GUI.
+
+    """
+    states.invalidate(node_uuid)
+    return get_backend().start_node(node_uuid)
+
+
+def stop_node(node_uuid, mode, timeout=60):
+    """Stops a node. ``mode`` is one of:
+
+    ``savestate``
+        Saves the state of the node to disk, so that it's resumed where it
+        left when started again.
+
+    ``acpi``
+        Presses the ACPI power button of the node, and waits up to
+        ``timeout`` seconds until its operating system powers it off.
+
+    ``poweroff``
+        Pulls the plug.
+
+    """
+    if mode not in STOP_MODES:
+        raise LibcloudError("Unknown stop mode '%s'" % (mode,))
+    backend = get_backend()
+    states.invalidate(node_uuid)
+    backend.stop_node(node_uuid, mode)
+    if mode == "acpi":
+        deadline = time.time() + timeout
+        while backend.get_node_state(node_uuid) != NodeState.STOPPED:
+            if time.time() > deadline:
+                raise LibcloudError("Node %s not powered off after %s "
+                                    "seconds" % (node_uuid, timeout))
+            time.sleep(1)
+    states.invalidate(node_uuid)
+
+
+def take_snapshot(node_uuid, name):
+    return get_backend().take_snapshot(node_uuid, name)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the backend in use, creating it if needed.
+
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _default_backend()
+        return _backend
+
+
+def set_backend(backend):
+    """Sets the backend to use (an instance of :class:`VirtualBoxBackend`).
+
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _default_backend():
+    name = os.environ.get("LIBCLOUD_VAGRANT_BACKEND")
+    if name == "cli":
+        return CLIBackend()
+    elif name == "vboxapi":
+        return VBoxAPIBackend()
+    elif name == "memory":
+        return MemoryBackend()
+    elif name:
+        raise LibcloudError("Unknown VirtualBox backend '%s'" % (name,))
+
+    if not (replay.recording() or replay.replaying()):
+        try:
+            return VBoxAPIBackend()
+        except Exception as ex:
+            LOG.debug("Cannot use the VirtualBox Python API: %s", ex)
+    return CLIBackend()
+
+
+class VirtualBoxBackend(object):
+
+    """Interface of VirtualBox backends.
+
+    Nodes are identified by the UUIDs of their VirtualBox machines, and
+    volumes by the paths of their disk images.
+
+    """
+
+    def attach_volume(self, node_uuid, volume_path, device, nonrotational,
+                      discard, bandwidth_group):
+        """Attaches a volume to the given SATA ``device`` (such as
+        ``/dev/sdb``) of a node, or to the first free one if ``device`` is
+        ``None``. The guest sees the volume as a solid-state drive if
+        ``nonrotational`` is set, and may release its unused blocks with
+        TRIM commands if ``discard`` is set. Its bandwidth is limited by the
+        given bandwidth group of the node, unless it's ``None``.
+
+        """
+        raise NotImplementedError()
+
+    def attach_volumes(self, node_uuid, attachments, bandwidth_group):
+        """Attaches several volumes to the first free SATA devices of a node
+        (see :func:`attach_volumes`). Backends which can inspect a node once
+        for all volumes should override this.
+
+        """
+        def attach(attachment):
+            volume_path, nonrotational, discard = attachment
+            self.attach_volume(node_uuid, volume_path, None, nonrotational,
+                               discard, bandwidth_group)
+
+        return _each(attach, attachments)
+
+    def create_differencing_volume(self, path, base_path):
+        """Creates a VDI disk image which records only the differences with
+        the disk image ``base_path``.
+
+        """
+        raise NotImplementedError()
+
+    def create_volume(self, path, size, variant):
+        """Creates a disk image of ``size`` megabytes, of the given variant
+        (see :func:`create_volume`).
+
+        """
+        raise NotImplementedError()
+
+    def delete_snapshot(self, node_uuid, name):
+        """Deletes a snapshot of a node.
+
+        """
+        raise NotImplementedError()
+
+    def destroy_host_interface(self, ifname):
+        raise NotImplementedError()
+
+    def destroy_volume(self, volume_path):
+        """Forgets a disk image, deleting it if it exists.
+
+        """
+        raise NotImplementedError()
+
+    def detach_volume(self, node_uuid, volume_path):
+        """Detaches a volume from a node, if attached.
+
+        """
+        raise NotImplementedError()
+
+    def detach_volumes(self, node_uuid, volume_paths):
+        """Detaches several volumes from a node (see :func:`detach_volumes`).
+        Backends which can inspect a node once for all volumes should
+        override this.
+
+        """
+        return _each(lambda path: self.detach_volume(node_uuid, path),
+                     volume_paths)
+
+    def get_host_interfaces(self, node_uuid):
+        """Returns the names of the host-only interfaces of a node, in
+        adapter order.
+
+        """
+        raise NotImplementedError()
+
+    def get_node_state(self, node_uuid):
+        """Returns the :class:`NodeState` of a node.
+
+        """
+        raise NotImplementedError()
+
+    def restore_snapshot(self, node_uuid, name):
+        """Restores a snapshot of a node, powering it off first if needed.
+        Nodes which were running when the snapshot was taken are started
+        again.
+
+        """
+        raise NotImplementedError()
+
+    def set_host_io_cache(self, node_uuid, enabled):
+        """Enables or disables the host I/O cache of the SATA controllers of
+        a node. VirtualBox only allows it while the node is powered off.
+
+        """
+        raise NotImplementedError()
+
+    def set_node_limits(self, node_uuid, cpu_execution_cap, disk_bandwidth,
+                        network_bandwidth):
+        """Changes the resource limits of a node (see
+        :func:`set_node_limits`).
+
+        """
+        raise NotImplementedError()
+
+    def set_volume_type(self, volume_path, mtype):
+        """Sets the type of a detached disk image to ``normal``,
+        ``immutable`` or ``multiattach``. Disk images of the last two types
+        may be attached to several nodes at once, through a differencing
+        image for each node.
+
+        """
+        raise NotImplementedError()
+
+    def start_node(self, node_uuid):
+        """Starts a node, without a GUI.
+
+        """
+        raise NotImplementedError()
+
+    def stop_node(self, node_uuid, mode):
+        """Stops a node in the given mode (see :func:`stop_node`), without
+        waiting for its operating system to shut down.
+
+        """
+        raise NotImplementedError()
+
+    def take_snapshot(self, node_uuid, name):
+        """Takes a snapshot of a node, without pausing it if it's running.
+
+        """
+        raise NotImplementedError()
+
+    def watch_node_states(self, callback, on_stop=None):
+        """Arranges for ``callback(node_uuid, state)`` to be called whenever
+        the state of a node changes, if this backend can report state
+        changes, and for ``on_stop()`` to be called if it stops reporting
+        them. Returns whether it can.
+
+        """
+        return False
+
 
 _NODE_STATES = {
     # From ``src/VBox/Frontends/VBoxManage/VBoxManageInfo.cpp`` under
@@ -117,7 +477,7 @@ _NODE_STATES = {
     "restoring": NodeState.PENDING,
     "restoringsnapshot": NodeState.PENDING,
     "running": NodeState.RUNNING,
-    "saved": NodeState.RUNNING,
+    "saved": NodeState.SUSPENDED,
     "saving": NodeState.PENDING,
     "settingup": NodeState.PENDING,
     "starting": NodeState.PENDING,
@@ -129,64 +489,54 @@ _NODE_STATES = {
 }
 
 
-def get_node_state(node_uuid):
-    frag = vboxmanage("showvminfo", node_uuid, "--details --machinereadable")
-    m = _NODE_STATE_RE.search(frag, re.MULTILINE)
-    if m:
-        ret = m.group(1)
-        LOG.debug("get_node_state(%s): VirtualBox reported %s", node_uuid, ret)
-        ret = _NODE_STATES.get(ret, NodeState.UNKNOWN)
-        LOG.debug("get_node_state(%s): Returning %s", node_uuid, ret)
-        return ret
+def node_state(vm_state):
+    """Returns the :class:`NodeState` matching a VirtualBox machine state, as
+    reported by ``VBoxManage showvminfo``.
 
+    """
+    return _NODE_STATES.get(vm_state, NodeState.UNKNOWN)
 
-_CONTROLLER_RE = re.compile(r'^storagecontroller([a-z]+)(\d+)="(.+)"$')
 
+def _each(func, items):
+    ret = []
+    for item in items:
+        try:
+            func(item)
+            ret.append(None)
+        except Exception as ex:
+            ret.append(ex)
+    return ret
 
-def find_sata_controllers(frag):
-    ret = {}
-    entries = {}
-    for line in frag.split("\n"):
-        m = _CONTROLLER_RE.search(line)
-        if not m:
-            continue
-        k, n, v = m.group(1), m.group(2), m.group(3)
-        c = entries.setdefault(n, {})
-        c[k] = v
 
-    for c in entries.values():
-        ret.setdefault(c["type"], []).append(c["name"])
-    return ret.get("IntelAhci", [])
+_DEVICE_RE = re.compile(r"/dev/sd([a-z])")
 
+# Bitmap with a bit set for each port of a SATA controller.
+_ALL_PORTS = (1 << SATA_PORTS) - 1
 
-_DEVICE_RE = re.compile(r"/dev/sd([a-z])")
 
-_DEVICE_RE_TEMPL = r'^"%s-%d-%d"="(.+?)"$'
+def choose_sata_slot(controllers, busy, device):
+    """Returns a ``(controller, device, port)`` tuple for attaching a volume
+    to the given ``device`` (or to the first free one if ``device`` is
+    ``None``), and marks its port as busy.
 
+    ``controllers`` are the names of the SATA controllers of a node, and
+    ``busy`` is a dict with a bitmap of the ports in use for each of them
+    (see :func:`busy_sata_ports`).
 
-def find_sata_slot(node_uuid, device):
-    frag = vboxmanage("showvminfo", node_uuid, "--details --machinereadable")
-    available = []
-    for c in find_sata_controllers(frag):
+    """
+    dev = 0
+    for c in controllers:
         LOG.debug("Examining controller %s", c)
-        dev = 0
-        for p in xrange(30):
-            m = re.search(_DEVICE_RE_TEMPL % (c, p, dev),
-                          frag, re.MULTILINE)
-            if m and m.group(1) != "none":
-                LOG.debug("Slot '%s-%s-%s' busy (%s)",
-                          c, p, dev, m.group(1))
-            else:
-                LOG.debug("Slot '%s-%s-%s' available", c, p, dev)
-                available.append(p)
-
-        LOG.debug("Available ports: %s", available)
+        available = ~busy.get(c, 0) & _ALL_PORTS
+        LOG.debug("Available ports: %s", bin(available))
         if not available:
             raise LibcloudError("No storage controller slots available")
 
         if device is None:
-            port = available[0]
+            # Lowest bit set
+            port = (available & -available).bit_length() - 1
             LOG.debug("Returning '%s-%s-%s'", c, dev, port)
+            busy[c] = busy.get(c, 0) | (1 << port)
             return c, dev, port
 
         m = re.search(_DEVICE_RE, device)
@@ -194,11 +544,251 @@ def find_sata_slot(node_uuid, device):
             raise LibcloudError("Invalid SATA device '%s'" % (device,))
         port = ord(m.group(1)) - ord('a')
         LOG.debug("Requested port for %s: %s", device, port)
-        if port not in available:
+        if not available & (1 << port):
             raise LibcloudError("Device %s already in use" % (device,))
+        busy[c] = busy.get(c, 0) | (1 << port)
 
         LOG.debug("Returning '%s-%s-%s'", c, dev, port)
         return c, dev, port
+    raise LibcloudError("No SATA storage controllers found")
+
+
+_VOLUME_RE_TEMPL = r'"(.+?)-(\d+)-(\d)"="(%s)"'
+
+_IMAGE_UUID_RE_TEMPL = r'"(.+?)-ImageUUID-(\d+)-(\d)"="(%s)"'
+
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-"
+                      r"[0-9a-f]{12}")
+
+_HOST_IFACES_RE = re.compile(r'^hostonlyadapter(\d+)="(.+?)"$')
+
+_NODE_STATE_RE = re.compile(r'VMState="(.+?)"')
+
+# ``VBoxManage controlvm`` commands for each stop mode.
+_CONTROLVM_STOP = {
+    "acpi": "acpipowerbutton",
+    "poweroff": "poweroff",
+    "savestate": "savestate",
+}
+
+# Machine states which have to be powered off before restoring a snapshot.
+_POWERED_ON = frozenset(["gurumeditation", "paused", "running"])
+
+_CONTROLLER_RE = re.compile(r'^storagecontroller([a-z]+)(\d+)="(.+)"$')
+
+_SLOT_RE = re.compile(r'^"(.+?)-(\d+)-0"="(.+?)"$', re.MULTILINE)
+
+
+class CLIBackend(VirtualBoxBackend):
+
+    """Runs ``VBoxManage`` for each operation, parsing its machine-readable
+    output.
+
+    """
+
+    def attach_volume(self, node_uuid, volume_path, device, nonrotational,
+                      discard, bandwidth_group):
+        controller, device, port = self.find_sata_slot(node_uuid, device)
+        self.storageattach(node_uuid, controller, port, device, volume_path,
+                           nonrotational, discard, bandwidth_group)
+
+    def attach_volumes(self, node_uuid, attachments, bandwidth_group):
+        frag = self.showvminfo(node_uuid)
+        controllers = find_sata_controllers(frag)
+        busy = busy_sata_ports(frag, controllers)
+
+        def attach(attachment):
+            volume_path, nonrotational, discard = attachment
+            controller, device, port = choose_sata_slot(controllers, busy,
+                                                        None)
+            self.storageattach(node_uuid, controller, port, device,
+                               volume_path, nonrotational, discard,
+                               bandwidth_group)
+
+        return _each(attach, attachments)
+
+    def create_differencing_volume(self, path, base_path):
+        return vboxmanage("createhd",
+                          "--diffparent", base_path,
+                          "--format VDI",
+                          "--filename", path)
+
+    def create_volume(self, path, size, variant):
+        return vboxmanage("createhd",
+                          "--size", size,
+                          "--format", VOLUME_VARIANTS[variant],
+                          "--variant", variant,
+                          "--filename", path)
+
+    def delete_snapshot(self, node_uuid, name):
+        vboxmanage("snapshot", node_uuid, "delete", '"%s"' % (name,))
+
+    def destroy_host_interface(self, ifname):
+        return vboxmanage("hostonlyif remove", ifname)
+
+    def destroy_volume(self, volume_path):
+        cmdline = ["closemedium disk", volume_path]
+        if os.access(volume_path, os.F_OK):
+            cmdline.append("--delete")
+        vboxmanage(*cmdline)
+
+    def detach_volume(self, node_uuid, volume_path):
+        self.detach_slot(node_uuid, self.showvminfo(node_uuid), volume_path)
+
+    def detach_volumes(self, node_uuid, volume_paths):
+        frag = self.showvminfo(node_uuid)
+        return _each(lambda path: self.detach_slot(node_uuid, frag, path),
+                     volume_paths)
+
+    def detach_slot(self, node_uuid, frag, volume_path):
+        """Detaches a volume from the slot it's attached to, according to
+        the output ``frag`` of ``VBoxManage showvminfo``.
+
+        """
+        m = re.search(_VOLUME_RE_TEMPL % (re.escape(volume_path),), frag)
+        if not m:
+            # Immutable and multi-attach volumes are attached through a
+            # differencing image, which is a child of the volume.
+            info = vboxmanage("showmediuminfo disk", volume_path)
+            for child in _UUID_RE.findall(info):
+                m = re.search(_IMAGE_UUID_RE_TEMPL % (re.escape(child),),
+                              frag)
+                if m:
+                    break
+        if m:
+            controller, device, port = m.group(1), m.group(3), m.group(2)
+            vboxmanage("storageattach", node_uuid,
+                       "--storagectl", '"%s"' % (controller,),
+                       "--port", port,
+                       "--device", device,
+                       "--type hdd",
+                       "--medium none")
+
+    def get_host_interfaces(self, node_uuid):
+        ret = []
+        frag = self.showvminfo(node_uuid)
+        for line in frag.splitlines():
+            m = _HOST_IFACES_RE.search(line)
+            if m:
+                ret.append((m.group(1), m.group(2)))
+        LOG.debug("get_host_interfaces(%s): %s", node_uuid, ret)
+        return [iface for (_, iface) in sorted(ret)]
+
+    def get_node_state(self, node_uuid):
+        frag = self.showvminfo(node_uuid)
+        m = _NODE_STATE_RE.search(frag, re.MULTILINE)
+        if m:
+            ret = m.group(1)
+            LOG.debug("get_node_state(%s): VirtualBox reported %s",
+                      node_uuid, ret)
+            ret = node_state(ret)
+            LOG.debug("get_node_state(%s): Returning %s", node_uuid, ret)
+            return ret
+
+    def restore_snapshot(self, node_uuid, name):
+        if self.vm_state(node_uuid) in _POWERED_ON:
+            vboxmanage("controlvm", node_uuid, "poweroff")
+        vboxmanage("snapshot", node_uuid, "restore", '"%s"' % (name,))
+        if self.vm_state(node_uuid) == "saved":
+            self.start_node(node_uuid)
+
+    def set_host_io_cache(self, node_uuid, enabled):
+        for c in find_sata_controllers(self.showvminfo(node_uuid)):
+            vboxmanage("storagectl", node_uuid,
+                       "--name", '"%s"' % (c,),
+                       "--hostiocache", enabled and "on" or "off")
+
+    def set_node_limits(self, node_uuid, cpu_execution_cap, disk_bandwidth,
+                        network_bandwidth):
+        if cpu_execution_cap is not None:
+            if self.vm_state(node_uuid) in _POWERED_ON:
+                vboxmanage("controlvm", node_uuid, "cpuexecutioncap",
+                           cpu_execution_cap)
+            else:
+                vboxmanage("modifyvm", node_uuid, "--cpuexecutioncap",
+                           cpu_execution_cap)
+        for group, limit in ((DISK_BANDWIDTH_GROUP, disk_bandwidth),
+                             (NETWORK_BANDWIDTH_GROUP, network_bandwidth)):
+            if limit is not None:
+                vboxmanage("bandwidthctl", node_uuid, "set", group,
+                           "--limit", "%dM" % (limit,))
+
+    def set_volume_type(self, volume_path, mtype):
+        vboxmanage("modifyhd", volume_path, "--type", mtype)
+
+    def start_node(self, node_uuid):
+        vboxmanage("startvm", node_uuid, "--type headless")
+
+    def stop_node(self, node_uuid, mode):
+        vboxmanage("controlvm", node_uuid, _CONTROLVM_STOP[mode])
+
+    def take_snapshot(self, node_uuid, name):
+        vboxmanage("snapshot", node_uuid, "take", '"%s"' % (name,),
+                   "--live")
+
+    def find_sata_slot(self, node_uuid, device):
+        frag = self.showvminfo(node_uuid)
+        controllers = find_sata_controllers(frag)
+        return choose_sata_slot(controllers,
+                                busy_sata_ports(frag, controllers), device)
+
+    def storageattach(self, node_uuid, controller, port, device, volume_path,
+                      nonrotational, discard, bandwidth_group):
+        cmdline = ["storageattach", node_uuid,
+                   "--storagectl", '"%s"' % (controller,),
+                   "--port", port,
+                   "--device", device,
+                   "--type hdd",
+                   "--medium", volume_path]
+        if nonrotational:
+            cmdline.append("--nonrotational on")
+        if discard:
+            cmdline.append("--discard on")
+        if bandwidth_group is not None:
+            cmdline.extend(["--bandwidthgroup", bandwidth_group])
+        vboxmanage(*cmdline)
+
+    def showvminfo(self, node_uuid):
+        return vboxmanage("showvminfo", node_uuid,
+                          "--details --machinereadable")
+
+    def vm_state(self, node_uuid):
+        """Returns the state of a machine, as reported by ``VBoxManage
+        showvminfo``.
+
+        """
+        m = _NODE_STATE_RE.search(self.showvminfo(node_uuid))
+        return m and m.group(1)
+
+
+def busy_sata_ports(frag, controllers):
+    """Returns a dict with a bitmap of the ports in use for each of the given
+    SATA controllers, according to the output ``frag`` of ``VBoxManage
+    showvminfo``.
+
+    """
+    ret = dict((c, 0) for c in controllers)
+    for c, port, medium in _SLOT_RE.findall(frag):
+        if c in ret and medium != "none":
+            LOG.debug("Slot '%s-%s-0' busy (%s)", c, port, medium)
+            ret[c] |= 1 << int(port)
+    return ret
+
+
+def find_sata_controllers(frag):
+    ret = {}
+    entries = {}
+    for line in frag.split("\n"):
+        m = _CONTROLLER_RE.search(line)
+        if not m:
+            continue
+        k, n, v = m.group(1), m.group(2), m.group(3)
+        c = entries.setdefault(n, {})
+        c[k] = v
+
+    for c in entries.values():
+        ret.setdefault(c["type"], []).append(c["name"])
+    return ret.get("IntelAhci", [])
 
 
 def vboxmanage(*args):
@@ -206,11 +796,647 @@ def vboxmanage(*args):
     cmdline.extend(args)
     cmdline = " ".join(str(arg) for arg in cmdline)
     LOG.debug("Executing %s", cmdline)
-    p = subprocess.Popen(cmdline, shell=True,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.STDOUT)
-    stdout, _ = p.communicate()
-    if p.returncode or "VBoxManage: error" in stdout:
-        raise LibcloudError(stdout)
-    LOG.debug(stdout)
+    p = process.Command(cmdline, LOG, merge_stderr=True,
+                        name=process.command_name("VBoxManage", args),
+                        capture=True)
+    rc = p.wait()
+    stdout = p.stdout
+    if rc or "VBoxManage: error" in stdout:
+        raise LibcloudError("\n".join(p.tail))
     return stdout
+
+
+# Names used by ``VBoxManage showvminfo`` for the ``MachineState`` values of
+# the VirtualBox API.
+_API_STATES = {
+    "Aborted": "aborted",
+    "DeletingSnapshot": "deletingsnapshot",
+    "DeletingSnapshotOnline": "deletingsnapshotlive",
+    "DeletingSnapshotPaused": "deletingsnapshotlivepaused",
+    "LiveSnapshotting": "livesnapshotting",
+    "Paused": "paused",
+    "PoweredOff": "poweroff",
+    "Restoring": "restoring",
+    "RestoringSnapshot": "restoringsnapshot",
+    "Running": "running",
+    "Saved": "saved",
+    "Saving": "saving",
+    "SettingUp": "settingup",
+    "Starting": "starting",
+    "Stopping": "stopping",
+    "Stuck": "gurumeditation",
+    "Teleported": "teleported",
+    "Teleporting": "teleporting",
+    "TeleportingIn": "teleportingin",
+    "TeleportingPausedVM": "teleportingpausedvm",
+}
+
+
+class VBoxAPIBackend(VirtualBoxBackend):
+
+    """Uses the VirtualBox Python API (``vboxapi``), which ships with
+    VirtualBox.
+
+    A single connection to VirtualBox, and a single session object, are kept
+    for the lifetime of the backend, and machine attributes are read
+    directly instead of parsing the output of ``VBoxManage``. Calls are
+    serialized, and recorded in :mod:`libcloudvagrant.common.stats` and
+    :mod:`libcloudvagrant.common.spans` as ``vboxapi <method>``.
+
+    """
+
+    def __init__(self):
+        from vboxapi import VirtualBoxManager
+
+        self._lock = threading.RLock()
+        self.manager = VirtualBoxManager(None, None)
+        self.vbox = self.manager.vbox
+        self.constants = self.manager.constants
+        self.session = self.manager.getSessionObject(self.vbox)
+        values = self.constants.all_values("MachineState")
+        self._vm_states = dict((v, _API_STATES.get(k))
+                               for k, v in values.items())
+
+    def attach_volume(self, node_uuid, volume_path, device, nonrotational,
+                      discard, bandwidth_group):
+        with self._call("attach_volume", node_uuid, volume_path):
+            machine = self.vbox.findMachine(node_uuid)
+            controllers, busy = self._sata_ports(machine)
+            controller, device, port = choose_sata_slot(controllers, busy,
+                                                        device)
+            medium = self._open_medium(volume_path)
+            with self._locked(machine) as m:
+                m.attachDevice(controller, port, device,
+                               self.constants.DeviceType_HardDisk, medium)
+                if nonrotational:
+                    m.nonRotationalDevice(controller, port, device, True)
+                if discard:
+                    m.setAutoDiscardForDevice(controller, port, device, True)
+                if bandwidth_group is not None:
+                    self._set_bandwidth_group(m, controller, port, device,
+                                              bandwidth_group)
+
+    def attach_volumes(self, node_uuid, attachments, bandwidth_group):
+        with self._call("attach_volumes", node_uuid, len(attachments)):
+            machine = self.vbox.findMachine(node_uuid)
+            controllers, busy = self._sata_ports(machine)
+            with self._locked(machine) as m:
+
+                def attach(attachment):
+                    volume_path, nonrotational, discard = attachment
+                    controller, device, port = choose_sata_slot(
+                        controllers, busy, None)
+                    try:
+                        m.attachDevice(controller, port, device,
+                                       self.constants.DeviceType_HardDisk,
+                                       self._open_medium(volume_path))
+                        if nonrotational:
+                            m.nonRotationalDevice(controller, port, device,
+                                                  True)
+                        if discard:
+                            m.setAutoDiscardForDevice(controller, port,
+                                                      device, True)
+                        if bandwidth_group is not None:
+                            self._set_bandwidth_group(m, controller, port,
+                                                      device, bandwidth_group)
+                    except LibcloudError:
+                        raise
+                    except Exception as ex:
+                        raise LibcloudError("Cannot attach %s: %s" %
+                                            (volume_path, ex))
+
+                return _each(attach, attachments)
+
+    def create_differencing_volume(self, path, base_path):
+        with self._call("create_differencing_volume", path, base_path):
+            base = self._open_medium(base_path)
+            medium = self.vbox.createHardDisk("VDI", path)
+            self._wait(base.createDiffStorage(
+                medium, [self.constants.MediumVariant_Standard]))
+
+    def create_volume(self, path, size, variant):
+        with self._call("create_volume", path, variant):
+            medium = self.vbox.createHardDisk(VOLUME_VARIANTS[variant], path)
+            self._wait(medium.createBaseStorage(
+                size * 1024 * 1024, [{
+                    "Fixed": self.constants.MediumVariant_Fixed,
+                    "Split2G": self.constants.MediumVariant_VmdkSplit2G,
+                    "Standard": self.constants.MediumVariant_Standard,
+                }[variant]]))
+
+    def delete_snapshot(self, node_uuid, name):
+        with self._call("delete_snapshot", node_uuid, name):
+            machine = self.vbox.findMachine(node_uuid)
+            snapshot = machine.findSnapshot(name)
+            with self._session(machine) as m:
+                self._wait(m.deleteSnapshot(snapshot.id))
+
+    def destroy_host_interface(self, ifname):
+        with self._call("destroy_host_interface", ifname):
+            host = self.vbox.host
+            iface = host.findHostNetworkInterfaceByName(ifname)
+            self._wait(host.removeHostOnlyNetworkInterface(iface.id))
+
+    def destroy_volume(self, volume_path):
+        with self._call("destroy_volume", volume_path):
+            medium = self._open_medium(volume_path)
+            if os.access(volume_path, os.F_OK):
+                self._wait(medium.deleteStorage())
+            else:
+                medium.close()
+
+    def detach_volume(self, node_uuid, volume_path):
+        with self._call("detach_volume", node_uuid, volume_path):
+            machine = self.vbox.findMachine(node_uuid)
+            for a in machine.mediumAttachments:
+                if a.medium is None:
+                    continue
+                # Immutable and multi-attach volumes are attached through a
+                # differencing image
+                if volume_path in (a.medium.location,
+                                   a.medium.base.location):
+                    with self._locked(machine) as m:
+                        m.detachDevice(a.controller, a.port, a.device)
+                    return
+
+    def detach_volumes(self, node_uuid, volume_paths):
+        with self._call("detach_volumes", node_uuid, len(volume_paths)):
+            machine = self.vbox.findMachine(node_uuid)
+            slots = {}
+            for a in machine.mediumAttachments:
+                if a.medium is not None:
+                    slot = (a.controller, a.port, a.device)
+                    slots[a.medium.location] = slot
+                    slots.setdefault(a.medium.base.location, slot)
+            with self._locked(machine) as m:
+
+                def detach(volume_path):
+                    if volume_path not in slots:
+                        return
+                    try:
+                        m.detachDevice(*slots[volume_path])
+                    except Exception as ex:
+                        raise LibcloudError("Cannot detach %s: %s" %
+                                            (volume_path, ex))
+
+                return _each(detach, volume_paths)
+
+    def get_host_interfaces(self, node_uuid):
+        with self._call("get_host_interfaces", node_uuid):
+            machine = self.vbox.findMachine(node_uuid)
+            n = self.vbox.systemProperties.getMaxNetworkAdapters(
+                machine.chipsetType)
+            ret = []
+            for slot in xrange(n):
+                adapter = machine.getNetworkAdapter(slot)
+                if (adapter.attachmentType ==
+                        self.constants.NetworkAttachmentType_HostOnly):
+                    ret.append(adapter.hostOnlyInterface)
+            LOG.debug("get_host_interfaces(%s): %s", node_uuid, ret)
+            return ret
+
+    def get_node_state(self, node_uuid):
+        with self._call("get_node_state", node_uuid):
+            machine = self.vbox.findMachine(node_uuid)
+            ret = self._vm_states.get(machine.state)
+            LOG.debug("get_node_state(%s): VirtualBox reported %s",
+                      node_uuid, ret)
+            return node_state(ret)
+
+    def restore_snapshot(self, node_uuid, name):
+        with self._call("restore_snapshot", node_uuid, name):
+            machine = self.vbox.findMachine(node_uuid)
+            if self._vm_states.get(machine.state) in _POWERED_ON:
+                with self._session(machine):
+                    self._wait(self.session.console.powerDown())
+            snapshot = machine.findSnapshot(name)
+            with self._session(machine, self.constants.LockType_Write) as m:
+                self._wait(m.restoreSnapshot(snapshot))
+            if self._vm_states.get(machine.state) == "saved":
+                self._launch(machine)
+
+    def set_host_io_cache(self, node_uuid, enabled):
+        with self._call("set_host_io_cache", node_uuid, enabled):
+            machine = self.vbox.findMachine(node_uuid)
+            with self._locked(machine) as m:
+                for c in m.storageControllers:
+                    if (c.controllerType ==
+                            self.constants.StorageControllerType_IntelAhci):
+                        c.useHostIOCache = enabled
+
+    def set_node_limits(self, node_uuid, cpu_execution_cap, disk_bandwidth,
+                        network_bandwidth):
+        with self._call("set_node_limits", node_uuid):
+            machine = self.vbox.findMachine(node_uuid)
+            with self._locked(machine) as m:
+                if cpu_execution_cap is not None:
+                    m.CPUExecutionCap = cpu_execution_cap
+                for group, limit in (
+                        (DISK_BANDWIDTH_GROUP, disk_bandwidth),
+                        (NETWORK_BANDWIDTH_GROUP, network_bandwidth)):
+                    if limit is not None:
+                        g = m.bandwidthControl.getBandwidthGroup(group)
+                        g.maxBytesPerSec = limit * 1024 * 1024
+
+    def set_volume_type(self, volume_path, mtype):
+        with self._call("set_volume_type", volume_path, mtype):
+            medium = self._open_medium(volume_path)
+            medium.type = {
+                "immutable": self.constants.MediumType_Immutable,
+                "multiattach": self.constants.MediumType_MultiAttach,
+                "normal": self.constants.MediumType_Normal,
+            }[mtype]
+
+    def start_node(self, node_uuid):
+        with self._call("start_node", node_uuid):
+            self._launch(self.vbox.findMachine(node_uuid))
+
+    def stop_node(self, node_uuid, mode):
+        with self._call("stop_node", node_uuid, mode):
+            machine = self.vbox.findMachine(node_uuid)
+            with self._session(machine) as m:
+                if mode == "savestate":
+                    self._wait(m.saveState())
+                elif mode == "acpi":
+                    self.session.console.powerButton()
+                else:
+                    self._wait(self.session.console.powerDown())
+
+    def take_snapshot(self, node_uuid, name):
+        with self._call("take_snapshot", node_uuid, name):
+            machine = self.vbox.findMachine(node_uuid)
+            with self._session(machine) as m:
+                progress, _ = m.takeSnapshot(name, "", False)
+                self._wait(progress)
+
+    def watch_node_states(self, callback, on_stop=None):
+        with self._call("watch_node_states"):
+            source = self.vbox.eventSource
+            listener = source.createListener()
+            source.registerListener(
+                listener,
+                [self.constants.VBoxEventType_OnMachineStateChanged],
+                False)
+        t = threading.Thread(target=self._dispatch_events,
+                             args=(source, listener, callback, on_stop))
+        t.daemon = True
+        t.start()
+        return True
+
+    def _dispatch_events(self, source, listener, callback, on_stop):
+        try:
+            while True:
+                event = source.getEvent(listener, 500)
+                if event is None:
+                    continue
+                try:
+                    event = self.manager.queryInterface(
+                        event, "IMachineStateChangedEvent")
+                    state = self._vm_states.get(event.state)
+                    LOG.debug("Machine %s changed state to %s",
+                              event.machineId, state)
+                    callback(event.machineId, node_state(state))
+                finally:
+                    source.eventProcessed(listener, event)
+        except Exception:
+            LOG.warn("Cannot read VirtualBox events", exc_info=True)
+        finally:
+            if on_stop is not None:
+                on_stop()
+
+    def _set_bandwidth_group(self, machine, controller, port, device, group):
+        machine.setBandwidthGroupForDevice(
+            controller, port, device,
+            machine.bandwidthControl.getBandwidthGroup(group))
+
+    def _sata_ports(self, machine):
+        """Returns the names of the SATA controllers of a machine, and the
+        bitmaps of their ports in use (see :func:`choose_sata_slot`).
+
+        """
+        controllers = [c.name for c in machine.storageControllers
+                       if c.controllerType ==
+                       self.constants.StorageControllerType_IntelAhci]
+        busy = dict((c, 0) for c in controllers)
+        for c in controllers:
+            for a in machine.getMediumAttachmentsOfController(c):
+                if a.medium is not None:
+                    busy[c] |= 1 << a.port
+        return controllers, busy
+
+    def _open_medium(self, path):
+        return self.vbox.openMedium(path,
+                                    self.constants.DeviceType_HardDisk,
+                                    self.constants.AccessMode_ReadWrite,
+                                    False)
+
+    def _wait(self, progress):
+        progress.waitForCompletion(-1)
+        if progress.resultCode:
+            raise LibcloudError(progress.errorInfo.text)
+
+    def _launch(self, machine):
+        progress = machine.launchVMProcess(self.session, "headless", "")
+        try:
+            self._wait(progress)
+        finally:
+            self.session.unlockMachine()
+
+    def _locked(self, machine):
+        return _LockedMachine(self, machine)
+
+    @contextmanager
+    def _session(self, machine, lock_type=None):
+        """Locks a machine with the session of this backend, yielding its
+        mutable copy, without saving its settings on exit.
+
+        """
+        if lock_type is None:
+            lock_type = self.constants.LockType_Shared
+        machine.lockMachine(self.session, lock_type)
+        try:
+            yield self.session.machine
+        finally:
+            self.session.unlockMachine()
+
+    def _call(self, method, *args):
+        return _APICall(self, method, args)
+
+
+class _LockedMachine(object):
+
+    """Context manager which locks a machine with the session of a
+    :class:`VBoxAPIBackend`, yielding its mutable copy, and saves its
+    settings on exit.
+
+    """
+
+    def __init__(self, backend, machine):
+        self.backend = backend
+        self.machine = machine
+
+    def __enter__(self):
+        self.machine.lockMachine(self.backend.session,
+                                 self.backend.constants.LockType_Shared)
+        return self.backend.session.machine
+
+    def __exit__(self, *exc_info):
+        try:
+            if not any(exc_info):
+                self.backend.session.machine.saveSettings()
+        finally:
+            self.backend.session.unlockMachine()
+
+
+class _APICall(object):
+
+    """Context manager which serializes a call to the VirtualBox API,
+    records it, and reports API errors as :class:`LibcloudError`.
+
+    """
+
+    def __init__(self, backend, method, args):
+        self.backend = backend
+        self.name = "vboxapi %s" % (method,)
+        self.cmdline = " ".join([self.name] + [str(arg) for arg in args])
+
+    def __enter__(self):
+        self.backend._lock.acquire()
+        self.start = time.time()
+        LOG.debug("Calling %s", self.cmdline)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            wall_time = time.time() - self.start
+            status = int(exc_type is not None)
+            stats.record_command(self.name, self.cmdline, self.start,
+                                 wall_time, status, 0)
+            spans.add(self.name, self.start, wall_time,
+                      cmdline=self.cmdline, status=status)
+        finally:
+            self.backend._lock.release()
+        if exc_type is not None and not issubclass(exc_type, LibcloudError):
+            raise LibcloudError("%s: %s" % (self.cmdline, exc_value))
+
+
+class MemoryBackend(VirtualBoxBackend):
+
+    """Keeps machines, volumes and host interfaces in memory, for tests.
+
+    Machines are added with :meth:`add_machine`, and their states changed
+    with :meth:`set_node_state`.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.machines = {}
+        self.volumes = {}
+        self.parents = {}
+        self.types = {}
+        self.variants = {}
+        self.host_interfaces = set()
+        self._callbacks = []
+        self._stop_callbacks = []
+
+    def add_machine(self, node_uuid, state="running", host_interfaces=(),
+                    bandwidth_groups=()):
+        """Adds a machine, in the given state (as reported by ``VBoxManage
+        showvminfo``) and with the given host-only interfaces and bandwidth
+        groups.
+
+        """
+        with self._lock:
+            self.machines[node_uuid] = {
+                "state": state,
+                "host_interfaces": list(host_interfaces),
+                "ports": {},
+                "port_options": {},
+                "hostiocache": False,
+                "cpu_execution_cap": 100,
+                "bandwidth_groups": dict((g, None) for g in bandwidth_groups),
+                "snapshots": {},
+            }
+            self.host_interfaces.update(host_interfaces)
+
+    def attach_volume(self, node_uuid, volume_path, device, nonrotational,
+                      discard, bandwidth_group):
+        with self._lock:
+            machine = self._machine(node_uuid)
+            if (bandwidth_group is not None and
+                    bandwidth_group not in machine["bandwidth_groups"]):
+                raise LibcloudError("Unknown bandwidth group %s" %
+                                    (bandwidth_group,))
+            if volume_path not in self.volumes:
+                raise LibcloudError("Unknown volume %s" % (volume_path,))
+            if volume_path in self.parents.values():
+                raise LibcloudError("Volume %s has children" %
+                                    (volume_path,))
+            if self.types.get(volume_path, "normal") == "normal":
+                for m in self.machines.values():
+                    if volume_path in m["ports"].values():
+                        raise LibcloudError("Volume %s is attached" %
+                                            (volume_path,))
+            busy = {"SATA Controller": sum(1 << p for p in machine["ports"])}
+            _, _, port = choose_sata_slot(["SATA Controller"], busy, device)
+            machine["ports"][port] = volume_path
+            machine["port_options"][port] = {
+                "nonrotational": nonrotational,
+                "discard": discard,
+                "bandwidth_group": bandwidth_group,
+            }
+
+    def create_differencing_volume(self, path, base_path):
+        with self._lock:
+            if path in self.volumes:
+                raise LibcloudError("Volume %s already exists" % (path,))
+            if base_path not in self.volumes:
+                raise LibcloudError("Unknown volume %s" % (base_path,))
+            self.volumes[path] = self.volumes[base_path]
+            self.parents[path] = base_path
+
+    def create_volume(self, path, size, variant):
+        with self._lock:
+            if path in self.volumes:
+                raise LibcloudError("Volume %s already exists" % (path,))
+            self.volumes[path] = size
+            self.variants[path] = variant
+
+    def delete_snapshot(self, node_uuid, name):
+        with self._lock:
+            snapshots = self._machine(node_uuid)["snapshots"]
+            if snapshots.pop(name, None) is None:
+                raise LibcloudError("Unknown snapshot %s" % (name,))
+
+    def destroy_host_interface(self, ifname):
+        with self._lock:
+            self.host_interfaces.discard(ifname)
+
+    def destroy_volume(self, volume_path):
+        with self._lock:
+            for machine in self.machines.values():
+                if volume_path in machine["ports"].values():
+                    raise LibcloudError("Volume %s is attached" %
+                                        (volume_path,))
+            if volume_path in self.parents.values():
+                raise LibcloudError("Volume %s has children" %
+                                    (volume_path,))
+            self.volumes.pop(volume_path, None)
+            self.parents.pop(volume_path, None)
+            self.types.pop(volume_path, None)
+            self.variants.pop(volume_path, None)
+
+    def detach_volume(self, node_uuid, volume_path):
+        with self._lock:
+            machine = self._machine(node_uuid)
+            ports = machine["ports"]
+            for port, path in ports.items():
+                if path == volume_path:
+                    del ports[port]
+                    machine["port_options"].pop(port, None)
+
+    def get_host_interfaces(self, node_uuid):
+        with self._lock:
+            return list(self._machine(node_uuid)["host_interfaces"])
+
+    def get_node_state(self, node_uuid):
+        with self._lock:
+            return node_state(self._machine(node_uuid)["state"])
+
+    def restore_snapshot(self, node_uuid, name):
+        with self._lock:
+            machine = self._machine(node_uuid)
+            try:
+                snapshot = machine["snapshots"][name]
+            except KeyError:
+                raise LibcloudError("Unknown snapshot %s" % (name,))
+            machine["ports"] = dict(snapshot["ports"])
+            machine["port_options"] = dict(snapshot["port_options"])
+        self.set_node_state(node_uuid, snapshot["state"])
+
+    def set_node_state(self, node_uuid, state):
+        """Changes the state of a machine (as reported by ``VBoxManage
+        showvminfo``), reporting the change.
+
+        """
+        with self._lock:
+            self._machine(node_uuid)["state"] = state
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(node_uuid, node_state(state))
+
+    def set_host_io_cache(self, node_uuid, enabled):
+        with self._lock:
+            machine = self._machine(node_uuid)
+            if machine["state"] in _POWERED_ON:
+                raise LibcloudError("Machine %s is not powered off" %
+                                    (node_uuid,))
+            machine["hostiocache"] = enabled
+
+    def set_node_limits(self, node_uuid, cpu_execution_cap, disk_bandwidth,
+                        network_bandwidth):
+        with self._lock:
+            machine = self._machine(node_uuid)
+            groups = machine["bandwidth_groups"]
+            limits = dict((g, limit) for (g, limit) in (
+                (DISK_BANDWIDTH_GROUP, disk_bandwidth),
+                (NETWORK_BANDWIDTH_GROUP, network_bandwidth),
+            ) if limit is not None)
+            for group in limits:
+                if group not in groups:
+                    raise LibcloudError("Unknown bandwidth group %s" %
+                                        (group,))
+            if cpu_execution_cap is not None:
+                machine["cpu_execution_cap"] = cpu_execution_cap
+            groups.update(limits)
+
+    def set_volume_type(self, volume_path, mtype):
+        with self._lock:
+            if volume_path not in self.volumes:
+                raise LibcloudError("Unknown volume %s" % (volume_path,))
+            for m in self.machines.values():
+                if volume_path in m["ports"].values():
+                    raise LibcloudError("Volume %s is attached" %
+                                        (volume_path,))
+            self.types[volume_path] = mtype
+
+    def start_node(self, node_uuid):
+        self.set_node_state(node_uuid, "running")
+
+    def stop_node(self, node_uuid, mode):
+        self.set_node_state(node_uuid,
+                            mode == "savestate" and "saved" or "poweroff")
+
+    def stop_watching(self):
+        """Stops reporting state changes, as other backends do when they
+        can no longer read them.
+
+        """
+        with self._lock:
+            callbacks = list(self._stop_callbacks)
+            del self._callbacks[:]
+            del self._stop_callbacks[:]
+        for callback in callbacks:
+            callback()
+
+    def take_snapshot(self, node_uuid, name):
+        with self._lock:
+            machine = self._machine(node_uuid)
+            machine["snapshots"][name] = {
+                "state": machine["state"],
+                "ports": dict(machine["ports"]),
+                "port_options": dict(machine["port_options"]),
+            }
+
+    def watch_node_states(self, callback, on_stop=None):
+        with self._lock:
+            self._callbacks.append(callback)
+            if on_stop is not None:
+                self._stop_callbacks.append(on_stop)
+        return True
+
+    def _machine(self, node_uuid):
+        try:
+            return self.machines[node_uuid]
+        except KeyError:
+            raise LibcloudError("Unknown machine %s" % (node_uuid,))
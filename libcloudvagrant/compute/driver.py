@@ -20,15 +20,22 @@
 
 """Apache Libcloud compute driver implementation for Vagrant."""
 
+import copy
+import hashlib
 import itertools
+import json
 import logging
 import os
 import pwd
 import re
 import subprocess
+import sys
+import tempfile
 import time
+import uuid
 
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 try:
     import paramiko
@@ -40,9 +47,22 @@ else:
 
 from libcloud.common.types import LibcloudError
 from libcloud.compute import base
+from libcloud.compute.deployment import FileDeployment, ScriptDeployment
 from libcloud.compute.types import DeploymentError, NodeState
 
-from libcloudvagrant.common import virtualbox
+import lockfile
+
+from libcloudvagrant.common import (
+    admission,
+    agent,
+    events,
+    process,
+    spans,
+    states,
+    stats,
+    topology,
+    virtualbox,
+)
 from libcloudvagrant.common.catalogue import VagrantCatalogue
 from libcloudvagrant.common.types import VAGRANT
 from libcloudvagrant.compute.types import (
@@ -75,6 +95,28 @@ try:
 except AttributeError:
     SSH_CONNECT_TIMEOUT = 5 * 60
 
+# Valid names of environment snapshots
+_TAG_RE = re.compile(r"^[\w.-]+$")
+
+# Virtual hardware of the named sizes, tuned for Linux guests on hosts with
+# hardware virtualization.
+_TUNED = {
+    "paravirt_provider": "kvm",
+    "nested_paging": True,
+    "vtx_vpid": True,
+    "ioapic": True,
+    "nic_type": "virtio",
+}
+
+# Named sizes returned by ``list_sizes()``, after the ``default`` one.
+SIZES = [
+    dict(_TUNED, name="small", ram=1024, cpus=1),
+    dict(_TUNED, name="medium", ram=2048, cpus=2),
+    dict(_TUNED, name="large", ram=4096, cpus=4, large_pages=True),
+    dict(_TUNED, name="xlarge", ram=8192, cpus=8, chipset="ich9",
+         large_pages=True),
+]
+
 
 class VagrantDriver(base.NodeDriver):
 
@@ -95,12 +137,23 @@ class VagrantDriver(base.NodeDriver):
     def __init__(self):
         super(VagrantDriver, self).__init__(key=None)
 
-    def attach_volume(self, node, volume, device=None):
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
+    def attach_volume(self, node, volume, device=None, ex_nonrotational=None,
+                      ex_discard=None, ex_hostiocache=None):
         """Attaches volume to node.
 
         At the moment only SATA devices of the form ``/dev/sd[a-z]`` are
         accepted as values to parameter ``device``.
 
+        Shared volumes (see :meth:`ex_set_volume_type`) may be attached to
+        several nodes at once.
+
+        The extension parameters default to the values given when the
+        volume was created or last attached, which are kept in the
+        catalogue.
+
         :param node: Node to attach volume to.
         :type node: :class:`VagrantNode`
 
@@ -110,18 +163,44 @@ class VagrantDriver(base.NodeDriver):
         :param device: Where the device is exposed, e.g. '/dev/sdb'
         :type device: ``str``
 
+        :param ex_nonrotational: Whether the node sees the volume as a
+                                 solid-state drive.
+        :type ex_nonrotational: ``bool``
+
+        :param ex_discard: Whether the node may release unused blocks of the
+                           volume with TRIM commands, shrinking its image.
+        :type ex_discard: ``bool``
+
+        :param ex_hostiocache: Whether to enable the host I/O cache of the
+                               SATA controllers of the node. VirtualBox only
+                               allows it for powered off nodes; it's left
+                               alone (with a warning) for the others.
+        :type ex_hostiocache: ``bool``
+
         :rytpe: ``bool``
 
         """
-        if volume.attached_to:
-            self.log.warn("Volume %s already attached to %s",
-                          volume.name, volume.attached_to)
-            return False
-
+        if ex_nonrotational is None:
+            ex_nonrotational = volume.nonrotational
+        if ex_discard is None:
+            ex_discard = volume.discard
+        if ex_hostiocache is None:
+            ex_hostiocache = volume.hostiocache
         try:
             with self._catalogue as c:
-                virtualbox.attach_volume(node.id, volume.path, device)
-                volume.attached_to = node.name
+                if not self._attachable(c, node, volume):
+                    return False
+                if ex_hostiocache is not None:
+                    self._set_host_io_cache(node, ex_hostiocache)
+                virtualbox.attach_volume(
+                    node.id, volume.path, device,
+                    nonrotational=ex_nonrotational,
+                    discard=ex_discard,
+                    bandwidth_group=self._disk_bandwidth_group(node))
+                volume.nonrotational = ex_nonrotational
+                volume.discard = ex_discard
+                volume.hostiocache = ex_hostiocache
+                self._mark_attached(volume, node)
                 c.update_volume(volume)
         except:
             self.log.warn("Error attaching %s to %s", volume, node,
@@ -131,8 +210,12 @@ class VagrantDriver(base.NodeDriver):
                       volume.name, node.name)
         return True
 
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
     def create_node(self, name, size, image, ex_networks=None,
-                    ex_allocate_sata_ports=30, **kwargs):
+                    ex_allocate_sata_ports=30, ex_progress=None,
+                    ex_linked_clone=None, ex_use_pool=True, **kwargs):
         """Create a new node instance. This instance will be started
         automatically.
 
@@ -157,25 +240,55 @@ class VagrantDriver(base.NodeDriver):
                                        30)
         :type ex_allocate_sata_ports: ``int``
 
+        :param ex_progress: Optional callable, called as ``ex_progress(phase,
+                            event)`` when the node enters each boot phase
+                            (``import``, ``boot``, ``ssh-wait`` and
+                            ``ssh-ready``). ``event`` is the
+                            :class:`VagrantEvent` announcing the phase.
+        :type ex_progress: ``callable``
+
+        :param ex_linked_clone: Whether to create this node as a linked clone
+                                of a master VM, shared by all nodes created
+                                from the same image, instead of importing
+                                a full copy of the image disk. Defaults to
+                                the ``linked_clone`` extra attribute of
+                                ``size``, or ``False``. Requires Vagrant
+                                1.8 or later, and is ignored otherwise.
+        :type ex_linked_clone: ``bool``
+
+        :param ex_use_pool: Whether to claim a node from the pool for
+                            ``image`` and ``size``, if there is one (see
+                            :meth:`ex_create_pool`). Defaults to ``True``.
+        :type ex_use_pool: ``bool``
+
         All other arguments are ignored.
 
+        Nodes are only created if the host has enough memory and CPUs for
+        them, besides those committed to the other nodes, and only a few of
+        them are booted at the same time (see
+        :mod:`libcloudvagrant.common.admission`).
+
         """
         if ex_networks is None:
             networks = []
         else:
             networks = ex_networks
 
+        if ex_linked_clone is None:
+            ex_linked_clone = bool(size.extra.get("linked_clone", False))
+
+        if ex_use_pool:
+            node = self._claim_pool_node(name, size, image, networks,
+                                         ex_progress)
+            if node is not None:
+                return node
+
         self.log.info("Creating node '%s' ..", name)
 
-        with self._catalogue as c:
-            public_ips = [n.allocate_address().to_dict()
-                          for n in networks if n.public]
-            private_ips = [n.allocate_address().to_dict()
-                           for n in networks if not n.public]
+        with self._admitted(name, size, image) as c:
+            public_ips, private_ips = self._allocate_addresses(c, networks)
             size = size.to_dict()
             image = image.to_dict()
-            for n in networks:
-                c.update_network(n)
             node = VagrantNode(id=None,
                                name=name,
                                public_ips=public_ips,
@@ -183,32 +296,35 @@ class VagrantDriver(base.NodeDriver):
                                driver=self,
                                size=size,
                                image=image,
-                               allocate_sata_ports=ex_allocate_sata_ports)
+                               allocate_sata_ports=ex_allocate_sata_ports,
+                               linked_clone=ex_linked_clone)
             self.log.debug("create_node(%s): Created object: %s", name, node)
             c.add_node(node)
-            c.save()  # Explicit save, so that the next command succeeds
-            self._vagrant("up --provider virtualbox", node.name)
-            self.log.info(".. Node '%s' created", name)
 
-            node.id = c.virtualbox_uuid(node)
-            c.add_node(node)
-            c.save()
-
-            public_networks = filter(lambda n: n.public, networks)
-            self.log.debug("create_node(%s): Public networks: %s",
-                           name, public_networks)
-            if public_networks:
-                ifaces = virtualbox.get_host_interfaces(node.id)
-                self.log.debug("create_node(%s): Ifaces: %s", name, ifaces)
-                for n, iface in zip(public_networks, ifaces):
-                    self.log.debug("create_node(%s): Iface for '%s': '%s'",
-                                   name, n.name, iface)
-                    n.host_interface = iface
-                    c.update_network(n)
-
-            return node
+        # The catalogue lock is not held while the node boots, so that other
+        # nodes may be created at the same time.
+        try:
+            with admission.booting():
+                self._vagrant("up --provider virtualbox", node.name,
+                              on_event=self._vagrant_progress(ex_progress))
+            self.log.info(".. Node '%s' created", name)
 
-    def create_volume(self, size, name, **kwargs):
+            with self._catalogue as c:
+                with spans.span("virtualbox_uuid"):
+                    node.id = c.virtualbox_uuid(node)
+                c.add_node(node)
+                self._update_host_interfaces(c, node, networks)
+                return node
+        except:
+            exc_info = sys.exc_info()
+            self._discard_node(node)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    @agent.forwarded
+    @stats.instrumented
+    def create_volume(self, size, name, ex_base_volume=None,
+                      ex_variant="Standard", ex_nonrotational=False,
+                      ex_discard=False, ex_hostiocache=None, **kwargs):
         """Create a new volume.
 
         :param size: Size of volume in gigabytes (required)
@@ -217,26 +333,82 @@ class VagrantDriver(base.NodeDriver):
         :param name: Name of the volume to be created
         :type name: ``str``
 
+        :param ex_base_volume: Optional volume to create the new volume as a
+                               differencing child of. The new volume starts
+                               with the contents of the base volume, has its
+                               size, and only stores its own changes. The
+                               base volume must be detached, and cannot be
+                               attached nor destroyed while it has children.
+        :type ex_base_volume: :class:`VagrantVolume`
+
+        :param ex_variant: Storage variant of the volume: ``Standard`` (a
+                           dynamically allocated image, the default),
+                           ``Fixed`` (an image allocated upfront, which
+                           avoids growing it under heavy writes) or
+                           ``Split2G`` (a dynamically allocated image, split
+                           in 2 GB files). Differencing volumes are always
+                           ``Standard``.
+        :type ex_variant: ``str``
+
+        :param ex_nonrotational: Default value of the parameter of the same
+                                 name of :meth:`attach_volume`.
+        :type ex_nonrotational: ``bool``
+
+        :param ex_discard: Default value of the parameter of the same name
+                           of :meth:`attach_volume`.
+        :type ex_discard: ``bool``
+
+        :param ex_hostiocache: Default value of the parameter of the same
+                               name of :meth:`attach_volume`.
+        :type ex_hostiocache: ``bool``
+
         All other arguments are ignored.
 
         :return: The newly created volume.
         :rtype: :class:`VagrantVolume`
 
         """
+        if ex_variant not in virtualbox.VOLUME_VARIANTS:
+            raise LibcloudError("Unknown volume variant '%s'" % (ex_variant,),
+                                driver=self)
+        if ex_base_volume is not None and ex_variant != "Standard":
+            raise LibcloudError("Differencing volumes cannot be of variant "
+                                "'%s'" % (ex_variant,), driver=self)
         with self._catalogue as c:
-            path = c.volume_path("%s.vdi" % (name,))
-            virtualbox.create_volume(path=path, size=size * 1024)
+            fmt = virtualbox.VOLUME_VARIANTS[ex_variant]
+            path = c.volume_path("%s.%s" % (name, fmt.lower()))
+            if ex_base_volume is None:
+                virtualbox.create_volume(path=path, size=size * 1024,
+                                         variant=ex_variant)
+                base = None
+            else:
+                base = c.find_volume(ex_base_volume.name)
+                if base.attached_to:
+                    raise LibcloudError("Base volume %s is attached to %s" %
+                                        (base.name, base.attached_to),
+                                        driver=self)
+                virtualbox.create_differencing_volume(path=path,
+                                                      base_path=base.path)
+                size = base.size
+                base = base.name
             volume = VagrantVolume(name=name,
                                    size=size,
                                    extra={
                                        "attached_to": None,
                                        "path": path,
+                                       "base": base,
+                                       "variant": ex_variant,
+                                       "nonrotational": ex_nonrotational,
+                                       "discard": ex_discard,
+                                       "hostiocache": ex_hostiocache,
                                    },
                                    driver=self)
             c.add_volume(volume)
             self.log.info("Volume '%s' created", name)
             return volume
 
+    @agent.forwarded
+    @stats.instrumented
     def delete_image(self, image):
         """Deletes a node image from a provider.
 
@@ -247,15 +419,18 @@ class VagrantDriver(base.NodeDriver):
         :rtype: ``bool``
 
         """
-        with self.catalogue:
+        with self._catalogue as c:
             try:
                 self._vagrant("box remove --force --provider virtualbox",
                               image.id)
+                c.remove_image(image.name)
                 return True
             except:
                 self.log.warn("Cannot remove image %s", image, exc_info=True)
                 return False
 
+    @stats.instrumented
+    @spans.traced
     def deploy_node(self, **kwargs):
         """Create a new node, and start deployment.
 
@@ -287,67 +462,63 @@ class VagrantDriver(base.NodeDriver):
                           giving up (default is 3).
         :type max_tries: ``int``
 
+        :param ex_reuse_image: Whether to boot the node from an image created
+                               by :meth:`ex_create_image` from a node of the
+                               same image deployed with the same deployment,
+                               if there's one, instead of running the
+                               deployment (default is ``False``).
+        :type ex_reuse_image: ``bool``
+
         :return: The node object for the new node.
         :rtype:  :class:`VagrantNode`
 
         """
-        task = kwargs["deploy"]
-        max_tries = kwargs.get("max_tries", 3)
-        ssh_timeout = kwargs.get("ssh_timeout", 10)
-        timeout = kwargs.get("timeout", SSH_CONNECT_TIMEOUT)
-
+        image = self._deployed_image(kwargs)
+        if image is not None:
+            node = self.create_node(**dict(kwargs, image=image))
+            return self._record_deployment(node, kwargs["deploy"])
         node = self.create_node(**kwargs)
-        ssh_config = self._vagrant_ssh_config(node.name)
+        return self._deploy(node, **kwargs)
 
-        try:
-            _, ip_addresses = self.wait_until_running(
-                nodes=[node],
-                wait_period=3,
-                timeout=kwargs.get("timeout", NODE_ONLINE_WAIT_TIMEOUT),
-                ssh_interface=ssh_config["host"])[0]
-
-            self.log.info("Running deployment script on '%s' ..", node.name)
-            self._connect_and_run_deployment_script(
-                task=task,
-                node=node,
-                ssh_hostname=ip_addresses[0],
-                ssh_port=ssh_config["port"],
-                ssh_username=ssh_config["user"],
-                ssh_password=None,
-                ssh_key_file=ssh_config["key"],
-                ssh_timeout=ssh_timeout,
-                timeout=timeout,
-                max_tries=max_tries)
-            self.log.info(".. Finished deployment script on '%s' ..",
-                          node.name)
-        except Exception as exc:
-            raise DeploymentError(node=node, original_exception=exc,
-                                  driver=self)
-        return node
-
-    def detach_volume(self, volume):
+    @agent.forwarded
+    @stats.instrumented
+    def detach_volume(self, volume, ex_node=None):
         """Detaches a volume from a node.
 
         :param volume: Volume to be detached
         :type volume: :class:`VagrantVolume`
 
+        :param ex_node: Node to detach a shared volume from (see
+                        :meth:`ex_set_volume_type`). Shared volumes are
+                        detached from all their nodes if not given.
+        :type ex_node: :class:`VagrantNode`
+
         :rtype: ``bool`
 
         """
-        node = volume.attached_to
-        if not node:
+        if not volume.attached_to:
             self.log.debug("Volume '%s' not attached, returning", volume.name)
             return True
         try:
             with self._catalogue as c:
-                for n in c.get_nodes():
-                    if n.name == node:
-                        virtualbox.detach_volume(n.id, volume.path)
-                        break
+                if volume.shared:
+                    volume.attached_to = c.find_volume(
+                        volume.name).attached_to
+                names = volume.attached_nodes
+                if ex_node is not None:
+                    names &= set([ex_node.name])
+                nodes = dict((n.name, n) for n in c.get_nodes())
+                for node in sorted(names):
+                    if node in nodes:
+                        virtualbox.detach_volume(nodes[node].id, volume.path)
+                    else:
+                        self.log.warn("Volume '%s' attached to node '%s', "
+                                      "which does not exist",
+                                      volume.name, node)
+                if volume.shared:
+                    volume.attached_to -= names
                 else:
-                    self.log.warn("Volume '%s' attached to node '%s', "
-                                  "which does not exist", volume.name, node)
-                volume.attached_to = None
+                    volume.attached_to = None
                 c.update_volume(volume)
                 self.log.debug("Volume '%s' detached", volume.name)
                 return True
@@ -356,6 +527,9 @@ class VagrantDriver(base.NodeDriver):
                           exc_info=True)
             return False
 
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
     def destroy_node(self, node):
         """Destroy a node.
 
@@ -371,24 +545,24 @@ class VagrantDriver(base.NodeDriver):
         """
         self.log.info("Destroying node '%s' ..", node.name)
         try:
-            for v in self.list_volumes():
-                if v.attached_to == node.name:
-                    self.detach_volume(v)
+            with spans.span("detach_volumes"):
+                self.ex_detach_volumes([v for v in self.list_volumes()
+                                        if node.name in v.attached_nodes],
+                                       node=node)
             with self._catalogue as c:
                 self._vagrant("destroy --force", node.name)
-                for ip in node._public_ips + node._private_ips:
-                    self.log.debug("destroy_node(): Deallocating address %s",
-                                   ip)
-                    n = c.find_network(ip.network_name)
-                    n.deallocate_address(ip.address)
-                    c.update_network(n)
+                states.invalidate(node.id)
+                self._deallocate_addresses(c, node)
                 c.remove_node(node)
+            admission.release()
             self.log.info(".. Node '%s' destroyed", node.name)
             return True
         except:
             self.log.warn("Cannot destroy %s", node.name, exc_info=True)
             return False
 
+    @agent.forwarded
+    @stats.instrumented
     def destroy_volume(self, volume):
         """Destroys a storage volume.
 
@@ -406,12 +580,19 @@ class VagrantDriver(base.NodeDriver):
             return False
 
         with self._catalogue as c:
+            children = self._child_volumes(c, volume)
+            if children:
+                self.log.warn("Cannot destroy volume %s: It is the base of "
+                              "%s", volume.name, ", ".join(children))
+                return False
             virtualbox.destroy_volume(volume.extra["path"])
             c.remove_volume(volume)
 
         self.log.info("... Volume '%s' destroyed", volume.name)
         return True
 
+    @agent.forwarded
+    @stats.instrumented
     def get_image(self, image_id):
         """Returns a Vagrant image object.
 
@@ -437,6 +618,8 @@ class VagrantDriver(base.NodeDriver):
 
         return find_image()
 
+    @agent.forwarded
+    @stats.instrumented
     def list_images(self, location=None):
         """Lists registered images
 
@@ -446,25 +629,24 @@ class VagrantDriver(base.NodeDriver):
         """
         images = []
         cur = None
-        for line in self._vagrant("box list").strip().split("\n"):
-            self.log.debug("Scanning [%s]", line)
-            if not line:
+        for event in self._vagrant_events("box list"):
+            self.log.debug("Scanning %s", event)
+            if not event.data:
                 continue
-            bits = line.split(",")
-            key = bits[2]
-            data = bits[3]
-            if key == "box-name":
+            if event.type == "box-name":
                 if cur is not None:
                     images.append(cur)
-                cur = {"box-name": data}
-            elif key == "box-provider":
-                cur["box-provider"] = data
+                cur = {"box-name": event.data[0]}
+            elif event.type == "box-provider":
+                cur["box-provider"] = event.data[0]
         if cur:
             images.append(cur)
 
         return [VagrantImage(name=i["box-name"], driver=self)
                 for i in images if i["box-provider"] == "virtualbox"]
 
+    @agent.forwarded
+    @stats.instrumented
     def list_nodes(self):
         """Lists all registered nodes.
 
@@ -477,24 +659,35 @@ class VagrantDriver(base.NodeDriver):
             self.log.debug("Catalogue nodes: %s", nodes)
             return nodes
 
+    @agent.forwarded
+    @stats.instrumented
     def list_sizes(self, location=None):
-        """Returns the single size object defined.
+        """Returns the sizes defined.
+
+        The first one, ``default``, instructs ``libcloud`` to create a node
+        with the same amount of memory and number of CPUs as those of the
+        Vagrant image it is created from.
 
-        The default size object instructs ``libcloud`` to create a node with
-        the same amount of memory and number of CPUs as those of the Vagrant
-        image it is created from.
+        The others (``small``, ``medium``, ``large`` and ``xlarge``) have
+        from 1 to 8 CPUs and from 1 to 8 GB of memory, and virtual hardware
+        tuned for Linux guests: KVM paravirtualization, nested paging and
+        VPID, virtio network adapters and, for the larger ones, large pages
+        (see :class:`VagrantNodeSize`).
 
         The ``location`` argument is ignored.
 
-        :return: A list of one single size object
+        :return: A list of size objects
         :rtype: ``list`` of :class:`VagrantSize`
 
         """
         return [VagrantNodeSize(name="default",
                                 ram=0,
                                 driver=self,
-                                extra={"cpu": 0})]
+                                extra={"cpu": 0})] + \
+            [VagrantNodeSize.from_dict(driver=self, **s) for s in SIZES]
 
+    @agent.forwarded
+    @stats.instrumented
     def list_volumes(self):
         """Lists all registered storage volumes.
 
@@ -506,12 +699,20 @@ class VagrantDriver(base.NodeDriver):
             self.log.debug("list_volumes(): Returning %s", ret)
             return ret
 
-    def reboot_node(self, node):
+    @agent.forwarded
+    @stats.instrumented
+    def reboot_node(self, node, ex_progress=None):
         """Reboot a node.
 
         :param node: The node to be rebooted
         :type node: :class:`VagrantNode`
 
+        :param ex_progress: Optional callable, called as ``ex_progress(phase,
+                            event)`` when the node enters each phase of the
+                            reboot (``halt``, ``boot``, ``ssh-wait`` and
+                            ``ssh-ready``). See :meth:`create_node`.
+        :type ex_progress: ``callable``
+
         :return: ``True`` if the reboot was successful, otherwise ``False``
         :rtype: ``bool``
 
@@ -519,12 +720,15 @@ class VagrantDriver(base.NodeDriver):
         self.log.info("Rebooting node '%s' ..", node.name)
         with self._catalogue:
             try:
-                self._vagrant("reload --no-provision", node.name)
+                self._vagrant("reload --no-provision", node.name,
+                              on_event=self._vagrant_progress(ex_progress))
+                states.invalidate(node.id)
                 self.log.info(".. Node '%s' rebooted", node.name)
                 return True
             except:
                 self.log.debug("Cannot reload %s", node.name, exc_info=True)
 
+    @stats.instrumented
     def wait_until_running(self, nodes, wait_period=3, timeout=600,
                            ssh_interface="public_ips", force_ipv4=True):
         """Block until the provided nodes are considered running.
@@ -580,9 +784,276 @@ class VagrantDriver(base.NodeDriver):
         raise LibcloudError(value='Timed out after %s seconds' % (timeout,),
                             driver=self)
 
-    def ex_create_network(self, name, cidr, public=False):
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
+    def ex_apply_topology(self, spec, max_parallel=4, prune=True):
+        """Brings the environment in line with a topology (see
+        :mod:`libcloudvagrant.common.topology`), changing only what differs
+        from it.
+
+        Networks and volumes which don't exist are created, in parallel,
+        and existing networks get the network adapter settings of the
+        topology. Node groups are then applied in dependency order, up to
+        ``max_parallel`` nodes at the same time: missing nodes are created,
+        nodes whose image, size (or the memory, CPUs, limits or settings of
+        their size) or networks differ from those of their group are
+        destroyed and created again, volumes are attached to (and
+        detached from) them, and their deployments are run on them unless
+        they have already run them. The nodes of groups depending on groups
+        with failures are not applied.
+
+        The names of the networks, volumes and nodes of each applied
+        topology are kept, and if ``prune`` is set, those of previous
+        topologies which aren't in this one are destroyed.
+
+        When the agent is running, topologies are applied by it, so the
+        paths in their deployment steps should be absolute ones (as those
+        of topologies returned by
+        :func:`libcloudvagrant.common.topology.load`).
+
+        This is an extension method.
+
+        :param spec: The topology to apply.
+        :type spec:  ``dict``
+
+        :param max_parallel: Maximum number of nodes (or of networks and
+                             volumes) to apply at the same time (default is
+                             4).
+        :type max_parallel:  ``int``
+
+        :param prune: Whether to destroy the objects of previous topologies
+                      which aren't in this one (default is ``True``).
+        :type prune:  ``bool``
+
+        :return: The names of the objects ``created``, ``replaced``
+                 (destroyed and created again), ``deployed`` (existing
+                 nodes whose deployment was run), ``destroyed`` and
+                 ``failed``, as a dict of lists.
+        :rtype: ``dict``
+
+        """
+        spec = topology.normalize(spec)
+        sizes = dict((s.name, s) for s in self.list_sizes())
+        for name, group in spec["nodes"].items():
+            if group["size"] not in sizes:
+                raise LibcloudError("Unknown size '%s' in node group '%s'" %
+                                    (group["size"], name), driver=self)
+        report = dict((k, []) for k in ("created", "replaced", "deployed",
+                                        "destroyed", "failed"))
+        wanted = {
+            "networks": list(spec["networks"]),
+            "volumes": list(spec["volumes"]),
+            "nodes": [n for (name, group) in spec["nodes"].items()
+                      for n in topology.node_names(name, group)],
+        }
+        previous = self._load_topology()
+
+        self.log.info("Applying topology ..")
+        if prune:
+            # Before creating nodes, so that they may use the resources
+            # released
+            self._prune_topology("nodes", previous, wanted, report)
+
+        networks = [n.name for n in self.ex_list_networks()]
+        volumes = dict((v.name, v) for v in self.list_volumes())
+
+        def apply_resource(item):
+            kind, name = item
+            params = spec[kind][name]
+            if kind == "networks":
+                self.ex_create_network(name, params["cidr"],
+                                       public=params["public"],
+                                       nic_type=params["nic_type"],
+                                       promiscuous=params["promiscuous"])
+                if name not in networks:
+                    report["created"].append(name)
+            elif name in volumes:
+                if volumes[name].size != params["size"]:
+                    self.log.warn("Volume '%s' exists, and has %d GB",
+                                  name, volumes[name].size)
+            else:
+                volume = self.create_volume(params["size"], name,
+                                            ex_variant=params["variant"])
+                report["created"].append(name)
+                if (params["type"] is not None and
+                        not self.ex_set_volume_type(volume, params["type"])):
+                    raise LibcloudError("Cannot set type of volume '%s'" %
+                                        (name,), driver=self)
+
+        items = ([("networks", n) for n in sorted(spec["networks"])] +
+                 [("volumes", v) for v in sorted(spec["volumes"])])
+        errors = self._map_parallel("ex_apply_topology", apply_resource,
+                                    items, max_parallel)
+        report["failed"].extend(name for ((_, name), e) in zip(items, errors)
+                                if e is not None)
+
+        networks = dict((n.name, n) for n in self.ex_list_networks())
+        nodes = dict((n.name, n) for n in self.list_nodes())
+        failed_groups = set()
+
+        def apply_node(item):
+            group_name, name = item
+            group = spec["nodes"][group_name]
+            self._apply_topology_node(
+                name, group, nodes.get(name), sizes[group["size"]],
+                [networks[n] for n in group["networks"]],
+                list(spec["volumes"]), report)
+
+        for wave in topology.waves(spec["nodes"]):
+            items = []
+            for group_name in wave:
+                group = spec["nodes"][group_name]
+                names = topology.node_names(group_name, group)
+                if failed_groups.intersection(group["depends_on"]):
+                    self.log.warn("Not applying node group '%s', which "
+                                  "depends on failed groups", group_name)
+                    failed_groups.add(group_name)
+                    report["failed"].extend(names)
+                else:
+                    items.extend((group_name, n) for n in names)
+            errors = self._map_parallel("ex_apply_topology", apply_node,
+                                        items, max_parallel)
+            for ((group_name, name), e) in zip(items, errors):
+                if e is not None:
+                    failed_groups.add(group_name)
+                    report["failed"].append(name)
+
+        if prune:
+            self._prune_topology("volumes", previous, wanted, report)
+            self._prune_topology("networks", previous, wanted, report)
+
+        existing = {
+            "networks": [n.name for n in self.ex_list_networks()],
+            "volumes": [v.name for v in self.list_volumes()],
+            "nodes": [n.name for n in self.list_nodes()],
+        }
+        self._save_topology(dict(
+            (k, sorted(set(wanted[k]) |
+                       set(previous[k]).intersection(existing[k])))
+            for k in wanted))
+        self.log.info(".. Topology applied (%d failures)",
+                      len(report["failed"]))
+        return dict((k, sorted(v)) for (k, v) in report.items())
+
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
+    def ex_attach_volumes(self, node, volumes):
+        """Attaches several volumes to the first free SATA devices of a node,
+        with the options they were created or last attached with (see
+        :meth:`attach_volume`).
+
+        The storage controllers of the node are inspected once for all
+        volumes, and the catalogue is updated once, which is faster than
+        calling :meth:`attach_volume` for each volume.
+
+        This is an extension method.
+
+        :param node: Node to attach volumes to.
+        :type node: :class:`VagrantNode`
+
+        :param volumes: Volumes to attach.
+        :type volumes: ``list`` of :class:`VagrantVolume`
+
+        :return: Whether each volume was attached.
+        :rtype: ``list`` of ``bool``
+
+        """
+        ret = [False] * len(volumes)
+        try:
+            with self._catalogue as c:
+                todo = [i for (i, v) in enumerate(volumes)
+                        if self._attachable(c, node, v)]
+                if not todo:
+                    return ret
+                caches = [volumes[i].hostiocache for i in todo
+                          if volumes[i].hostiocache is not None]
+                if caches:
+                    self._set_host_io_cache(node, any(caches))
+                errors = virtualbox.attach_volumes(
+                    node.id, [(volumes[i].path, volumes[i].nonrotational,
+                               volumes[i].discard) for i in todo],
+                    bandwidth_group=self._disk_bandwidth_group(node))
+                for i, ex in zip(todo, errors):
+                    volume = volumes[i]
+                    if ex is not None:
+                        self.log.warn("Error attaching %s to %s: %s",
+                                      volume.name, node.name, ex)
+                        continue
+                    self._mark_attached(volume, node)
+                    c.update_volume(volume)
+                    ret[i] = True
+        except:
+            self.log.warn("Error attaching volumes to %s", node.name,
+                          exc_info=True)
+            return [False] * len(volumes)
+        self.log.info("%d volumes attached to node '%s'", sum(ret),
+                      node.name)
+        return ret
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_create_image(self, node, name):
+        """Packages a node into a new Vagrant box, and registers it as an
+        image called ``name``.
+
+        If the node was deployed with :meth:`deploy_node`, the image remembers
+        a hash of its deployment, and later calls to :meth:`deploy_node` with
+        the same image and deployment, and ``ex_reuse_image`` set, boot their
+        nodes from this image instead of running the deployment again.
+
+        The node is left powered off.
+
+        This is an extension method.
+
+        :param node: The node to package.
+        :type node:  :class:`VagrantNode`
+
+        :param name: Name of the new image.
+        :type name:  ``str``
+
+        :return: The new image.
+        :rtype:  :class:`VagrantImage`
+
+        """
+        self.log.info("Creating image '%s' from node '%s' ..",
+                      name, node.name)
+        fname = os.path.join(self._dot_libcloudvagrant,
+                             "%s.box" % (uuid.uuid4().hex,))
+        try:
+            with spans.span("package"):
+                self._vagrant("package", node.name, "--output", fname)
+            states.invalidate(node.id)
+            with spans.span("box_add"):
+                self._vagrant("box add --force --name", name, fname)
+        finally:
+            if os.access(fname, os.F_OK):
+                os.unlink(fname)
+
+        with self._catalogue as c:
+            images = c.get_images()
+            base_image = images.get(node.image.name, {}).get("base",
+                                                             node.image.name)
+            c.update_image(name, {
+                "name": name,
+                "base": base_image,
+                "deployment_hash": node.deployment_hash,
+            })
+        self.log.info(".. Image '%s' created", name)
+        return VagrantImage(name=name, driver=self)
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_create_network(self, name, cidr, public=False, nic_type=None,
+                          promiscuous=None):
         """Creates a Vagrant network.
 
+        The network adapters of nodes in this network are of type
+        ``nic_type``, if given, instead of that of the size of each node.
+        Creating an existing network changes these settings, which apply to
+        its nodes the next time they are started.
+
         This is an extension method.
 
         :param name: Name of the network
@@ -595,19 +1066,213 @@ class VagrantDriver(base.NodeDriver):
                        private network)
         :type public"  ``Bool``
 
+        :param nic_type: Type of the network adapters in this network, such
+                         as ``virtio`` or ``82540EM`` (default: that of the
+                         size of each node)
+        :type nic_type:  ``str``
+
+        :param promiscuous: Promiscuous mode of the network adapters in this
+                            network: ``deny``, ``allow-vms`` or
+                            ``allow-all`` (default: ``deny``)
+        :type promiscuous:  ``str``
+
         :return: A Vagrant network object
         :rtype:  :class:`VagrantNetwork`
 
         """
         self.log.debug("ex_create_network(%s, %s, %s): Entering",
                        name, cidr, public)
+        if nic_type is not None and nic_type not in virtualbox.NIC_TYPES:
+            raise LibcloudError("Unknown network adapter type '%s'" %
+                                (nic_type,), driver=self)
+        if (promiscuous is not None and
+                promiscuous not in virtualbox.PROMISCUOUS_MODES):
+            raise LibcloudError("Unknown promiscuous mode '%s'" %
+                                (promiscuous,), driver=self)
         with self._catalogue as c:
             network = VagrantNetwork(name, cidr, public,
                                      allocated=[], host_interface=None,
-                                     driver=self)
+                                     driver=self, nic_type=nic_type,
+                                     promiscuous=promiscuous)
             c.add_network(network)
             return network
 
+    @agent.forwarded
+    @stats.instrumented
+    def ex_create_pool(self, image, size, count, saved=False):
+        """Creates (or resizes) a pool of ``count`` booted nodes of the given
+        image and size, and waits until it's full.
+
+        While a pool has nodes ready, :meth:`create_node` claims them
+        instead of booting new nodes: a claimed node is renamed, connected
+        to the requested networks (for which it has to be rebooted), and
+        replaced in the pool by a new node booted in the background. The
+        host name of claimed nodes which aren't connected to any network is
+        not changed.
+
+        This is an extension method.
+
+        :param image: Image of the nodes in the pool.
+        :type image:  :class:`VagrantImage`
+
+        :param size: Size of the nodes in the pool.
+        :type size:  :class:`VagrantNodeSize`
+
+        :param count: Number of nodes to keep in the pool.
+        :type count:  ``int``
+
+        :param saved: Whether to keep the nodes in the pool in saved state,
+                      instead of running (default: ``False``).
+        :type saved:  ``bool``
+
+        :return: The pool, as returned by :meth:`ex_list_pools`.
+        :rtype:  ``dict``
+
+        """
+        key = pool_key(image, size)
+        with self._catalogue as c:
+            pool = c.get_pools().get(key, {"nodes": []})
+            pool.update({
+                "image": image.to_dict(),
+                "size": size.to_dict(),
+                "count": int(count),
+                "saved": bool(saved),
+            })
+            c.update_pool(key, pool)
+            extra = pool["nodes"][pool["count"]:]
+
+        for name in extra:
+            node = self._pool_node(name)
+            if node is not None:
+                self.destroy_node(node)
+        self.ex_refill_pools()
+        return [p for p in self.ex_list_pools() if p["key"] == key][0]
+
+    @stats.instrumented
+    def ex_deploy_nodes(self, nodes, max_parallel=4):
+        """Create several nodes, and run their deployments in parallel.
+
+        Each node goes through the same steps as in :meth:`deploy_node`
+        (creation, waiting until it is running, and running its deployment),
+        but up to ``max_parallel`` nodes go through them at the same time.
+
+        Failures do not abort the whole batch. Instead, the failed entries of
+        the returned list are :class:`DeploymentError` instances, whose
+        ``node`` attribute refers to the node that failed (which you may want
+        to destroy). If the node could not be created at all, its ``id`` will
+        be ``None``.
+
+        Deployment objects record the standard output, standard error and
+        exit status of their scripts. If the same deployment object is passed
+        for several nodes, each node gets its own copy of it. The deployment
+        object actually used for a node is stored under the key
+        ``deployment`` of that node's ``extra`` dictionary.
+
+        This is an extension method.
+
+        :param nodes: Keyword arguments to :meth:`deploy_node`, one dictionary
+                      per node to create.
+        :type nodes:  ``list`` of ``dict``
+
+        :param max_parallel: Maximum number of nodes to deploy at the same
+                             time (default is 4).
+        :type max_parallel:  ``int``
+
+        :return: One entry per element of ``nodes``, in the same order: either
+                 the new node, or the error raised while deploying it.
+        :rtype:  ``list`` of :class:`VagrantNode` or :class:`DeploymentError`
+
+        """
+        tasks = []
+        seen = set()
+        for kwargs in nodes:
+            kwargs = dict(kwargs)
+            task = kwargs["deploy"]
+            if id(task) in seen:
+                kwargs["deploy"] = copy.deepcopy(task)
+            seen.add(id(task))
+            tasks.append(kwargs)
+
+        parent = spans.current()
+
+        def deploy(kwargs):
+            with stats.operation("ex_deploy_nodes", record_call=False), \
+                    spans.within(parent):
+                return deploy_one(kwargs)
+
+        def deploy_one(kwargs):
+            image = self._deployed_image(kwargs)
+            try:
+                node = self.create_node(**dict(kwargs, image=image or
+                                               kwargs["image"]))
+            except Exception as exc:
+                self.log.warn("Cannot create node '%s'", kwargs["name"],
+                              exc_info=True)
+                node = VagrantNode(id=None,
+                                   name=kwargs["name"],
+                                   public_ips=[],
+                                   private_ips=[],
+                                   driver=self,
+                                   size=kwargs["size"].to_dict(),
+                                   image=kwargs["image"].to_dict(),
+                                   allocate_sata_ports=kwargs.get(
+                                       "ex_allocate_sata_ports", 30))
+                node.extra["deployment"] = kwargs["deploy"]
+                return DeploymentError(node=node, original_exception=exc,
+                                       driver=self)
+
+            node.extra["deployment"] = kwargs["deploy"]
+            if image is not None:
+                return self._record_deployment(node, kwargs["deploy"])
+            try:
+                return self._deploy(node, **kwargs)
+            except DeploymentError as exc:
+                self.log.warn("Deployment on '%s' failed: %s",
+                              node.name, exc.value)
+                return exc
+
+        self.log.info("Deploying %d nodes (at most %d at a time) ..",
+                      len(tasks), max_parallel)
+        pool = ThreadPool(max(1, min(max_parallel, len(tasks))))
+        try:
+            ret = pool.map(deploy, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        self.log.info(".. Deployed %d nodes (%d failed)", len(ret),
+                      len([r for r in ret if isinstance(r, DeploymentError)]))
+        return ret
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_delete_environment_snapshot(self, tag):
+        """Deletes an environment snapshot taken by
+        :meth:`ex_snapshot_environment`, together with the VirtualBox
+        snapshots of its nodes.
+
+        This is an extension method.
+
+        :param tag: Name of the snapshot.
+        :type tag:  ``str``
+
+        :return: ``True`` if all node snapshots were deleted.
+        :rtype:  ``bool``
+
+        """
+        snapshot = self._load_environment_snapshot(tag)
+        self.log.info("Deleting environment snapshot '%s' ..", tag)
+        nodes = self._snapshot_nodes(snapshot)
+        errors = self._map_parallel(
+            "ex_delete_environment_snapshot",
+            lambda n: virtualbox.delete_snapshot(n["id"],
+                                                 snapshot["snapshot"]),
+            nodes)
+        os.unlink(self._environment_snapshot_fname(tag))
+        self.log.info(".. Environment snapshot '%s' deleted", tag)
+        return not any(errors)
+
+    @agent.forwarded
+    @stats.instrumented
     def ex_destroy_network(self, network):
         """Destroys a Vagrant network object.
 
@@ -637,6 +1302,96 @@ class VagrantDriver(base.NodeDriver):
             self.log.warn("Cannot destroy network %s", network, exc_info=True)
             return False
 
+    @agent.forwarded
+    @stats.instrumented
+    def ex_destroy_pool(self, key):
+        """Destroys a node pool, and the nodes in it.
+
+        This is an extension method.
+
+        :param key: Key of the pool, as returned by :meth:`ex_list_pools`.
+        :type key:  ``str``
+
+        :return: ``True`` if all nodes in the pool were destroyed.
+        :rtype:  ``bool``
+
+        """
+        with self._catalogue as c:
+            pool = c.get_pools().get(key)
+            if pool is None:
+                return True
+            c.remove_pool(key)
+            nodes = filter(None, [c.get_node(name) for name in pool["nodes"]])
+        self.log.info("Destroying pool %s ..", key)
+        return all([self.destroy_node(node) for node in nodes])
+
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
+    def ex_detach_volumes(self, volumes, node=None):
+        """Detaches several volumes from their nodes.
+
+        The storage controllers of each node are inspected once for all
+        volumes, and the catalogue is updated once, which is faster than
+        calling :meth:`detach_volume` for each volume.
+
+        This is an extension method.
+
+        :param volumes: Volumes to detach.
+        :type volumes: ``list`` of :class:`VagrantVolume`
+
+        :param node: Node to detach the volumes from. Volumes attached to
+                     other nodes are left alone. Volumes are detached from
+                     all their nodes if not given.
+        :type node: :class:`VagrantNode`
+
+        :return: Whether each volume was detached.
+        :rtype: ``list`` of ``bool``
+
+        """
+        try:
+            with self._catalogue as c:
+                nodes = dict((n.name, n) for n in c.get_nodes())
+                current = [c.find_volume(v.name) for v in volumes]
+                detached = [set() for _ in volumes]
+                failed = [False] * len(volumes)
+                by_node = {}
+                for i, volume in enumerate(current):
+                    names = volume.attached_nodes
+                    if node is not None:
+                        names &= set([node.name])
+                    for name in names:
+                        if name in nodes:
+                            by_node.setdefault(name, []).append(i)
+                        else:
+                            self.log.warn("Volume '%s' attached to node "
+                                          "'%s', which does not exist",
+                                          volume.name, name)
+                            detached[i].add(name)
+                for name, indices in sorted(by_node.items()):
+                    errors = virtualbox.detach_volumes(
+                        nodes[name].id, [current[i].path for i in indices])
+                    for i, ex in zip(indices, errors):
+                        if ex is None:
+                            detached[i].add(name)
+                        else:
+                            self.log.warn("Cannot detach volume %s from %s: "
+                                          "%s", current[i].name, name, ex)
+                            failed[i] = True
+                for i, volume in enumerate(current):
+                    if volume.shared:
+                        volume.attached_to -= detached[i]
+                    elif detached[i]:
+                        volume.attached_to = None
+                    c.update_volume(volume)
+                    volumes[i].attached_to = volume.attached_to
+        except:
+            self.log.warn("Cannot detach volumes", exc_info=True)
+            return [False] * len(volumes)
+        return [not f for f in failed]
+
+    @agent.forwarded
+    @stats.instrumented
     def ex_get_node_state(self, node):
         """Returns the state of the given node.
 
@@ -647,19 +1402,69 @@ class VagrantDriver(base.NodeDriver):
 
         :rtype: :class:`NodeState`
 
+        States may be up to a few seconds old (see
+        :mod:`libcloudvagrant.common.states`).
+
         """
         try:
-            with self._catalogue as c:
-                if node.id is None:
+            node_uuid = node.id
+            if node_uuid is None:
+                with self._catalogue as c:
                     node_uuid = c.virtualbox_uuid(node)
-                else:
-                    node_uuid = node.id
-                return virtualbox.get_node_state(node_uuid)
+            return virtualbox.get_node_state(node_uuid)
         except:
             self.log.warn("Cannot get node state for '%s'", node.name,
                           exc_info=True)
             return NodeState.UNKNOWN
 
+    @agent.forwarded
+    @stats.instrumented
+    def ex_host_resources(self):
+        """Returns the memory and CPUs of the host, and those committed to
+        the nodes (see :mod:`libcloudvagrant.common.admission`).
+
+        This is an extension method.
+
+        :return: A dict with keys ``ram`` (in MB) and ``cpus``, whose values
+                 are dicts with keys ``capacity`` (0 if unlimited) and
+                 ``committed``.
+        :rtype: ``dict``
+
+        """
+        with self._catalogue as c:
+            return admission.usage(c.get_nodes(pooled=True))
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_list_environment_snapshots(self):
+        """Lists the environment snapshots taken by
+        :meth:`ex_snapshot_environment`.
+
+        This is an extension method.
+
+        :return: A list of dicts, with keys ``tag``, ``created`` (the time
+                 the snapshot was taken, in seconds since the epoch) and
+                 ``nodes`` (the names of the nodes in the snapshot).
+        :rtype: ``list`` of ``dict``
+
+        """
+        dname = os.path.join(self._dot_libcloudvagrant, "snapshots")
+        if not os.access(dname, os.F_OK):
+            return []
+        ret = []
+        for fname in sorted(os.listdir(dname)):
+            if not fname.endswith(".json"):
+                continue
+            snapshot = self._load_environment_snapshot(fname[:-5])
+            ret.append({
+                "tag": snapshot["tag"],
+                "created": snapshot["created"],
+                "nodes": sorted(snapshot["catalogue"]["nodes"]),
+            })
+        return ret
+
+    @agent.forwarded
+    @stats.instrumented
     def ex_list_networks(self):
         """Returns a list of all defined Vagrant networks.
 
@@ -671,6 +1476,360 @@ class VagrantDriver(base.NodeDriver):
         with self._catalogue as c:
             return c.get_networks()
 
+    @agent.forwarded
+    @stats.instrumented
+    def ex_list_pools(self):
+        """Lists the node pools.
+
+        This is an extension method.
+
+        :return: A list of dicts, with keys ``key`` (which identifies the
+                 pool), ``image`` and ``size`` (the names of the image and
+                 size of its nodes), ``count`` (the number of nodes to keep
+                 in the pool), ``saved`` (whether they are kept in saved
+                 state), ``nodes`` (the names of the nodes in the pool) and
+                 ``ready`` (the number of nodes already booted).
+        :rtype: ``list`` of ``dict``
+
+        """
+        ret = []
+        with self._catalogue as c:
+            for key, pool in sorted(c.get_pools().items()):
+                nodes = [c.get_node(name) for name in pool["nodes"]]
+                ret.append({
+                    "key": key,
+                    "image": pool["image"]["name"],
+                    "size": pool["size"]["name"],
+                    "count": pool["count"],
+                    "saved": pool["saved"],
+                    "nodes": pool["nodes"],
+                    "ready": len([n for n in nodes
+                                  if n is not None and n.id is not None]),
+                })
+        return ret
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_refill_pools(self):
+        """Boots nodes until all node pools are full.
+
+        Only one process refills pools at a time; this method returns
+        immediately if another one is already doing it.
+
+        This is an extension method.
+
+        :return: The number of nodes booted.
+        :rtype:  ``int``
+
+        """
+        lock = lockfile.FileLock(os.path.join(self._dot_libcloudvagrant,
+                                              "pools"))
+        try:
+            lock.acquire(timeout=0)
+        except (lockfile.AlreadyLocked, lockfile.LockTimeout):
+            self.log.debug("ex_refill_pools(): Pools already being refilled")
+            return 0
+
+        created = 0
+        try:
+            while True:
+                with self._catalogue as c:
+                    for key, pool in sorted(c.get_pools().items()):
+                        if len(pool["nodes"]) < pool["count"]:
+                            name = "pool-%s" % (uuid.uuid4().hex[:8],)
+                            pool["nodes"].append(name)
+                            c.update_pool(key, pool)
+                            break
+                    else:
+                        return created
+
+                self.log.info("Refilling pool %s with node '%s'", key, name)
+                size = VagrantNodeSize.from_dict(driver=self, **pool["size"])
+                image = VagrantImage.from_dict(driver=self, **pool["image"])
+                try:
+                    node = self.create_node(name=name, size=size,
+                                            image=image, ex_use_pool=False)
+                    if pool["saved"]:
+                        self._vagrant("suspend", name)
+                        states.invalidate(node.id)
+                    created += 1
+                except:
+                    self.log.warn("Cannot refill pool %s", key, exc_info=True)
+                    with self._catalogue as c:
+                        pool = c.get_pools().get(key)
+                        if pool is not None and name in pool["nodes"]:
+                            pool["nodes"].remove(name)
+                            c.update_pool(key, pool)
+                    return created
+        finally:
+            lock.release()
+
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
+    def ex_restore_environment(self, tag, max_parallel=8):
+        """Restores the environment snapshot ``tag``, taken by
+        :meth:`ex_snapshot_environment`.
+
+        Nodes, volumes and networks created since the snapshot was taken are
+        destroyed. The snapshot of each node is then restored (up to
+        ``max_parallel`` nodes at the same time), and nodes which were running
+        are started again. Finally, the catalogue (including address
+        allocations and volume attachments) is restored.
+
+        Nodes destroyed since the snapshot was taken cannot be restored, and
+        make this method fail before changing anything.
+
+        This is an extension method.
+
+        :param tag: Name of the snapshot.
+        :type tag:  ``str``
+
+        :param max_parallel: Maximum number of nodes to restore at the same
+                             time (default is 8).
+        :type max_parallel:  ``int``
+
+        :return: ``True``
+        :rtype:  ``bool``
+
+        """
+        snapshot = self._load_environment_snapshot(tag)
+        saved = snapshot["catalogue"]
+        self.log.info("Restoring environment snapshot '%s' ..", tag)
+        with self._catalogue as c:
+            missing = []
+            for name, p in sorted(saved["nodes"].items()):
+                try:
+                    if c.virtualbox_uuid(name) == p["id"]:
+                        continue
+                except (IOError, OSError):
+                    pass
+                if p["id"] is not None:
+                    missing.append(name)
+            if missing:
+                raise LibcloudError("Cannot restore environment snapshot "
+                                    "'%s': Nodes %s no longer exist" %
+                                    (tag, ", ".join(missing)), driver=self)
+            nodes = [n for n in c.get_nodes(pooled=True)
+                     if n.name not in saved["nodes"]]
+            volumes = [v for v in c.get_volumes()
+                       if v.name not in saved["volumes"]]
+            # Differencing children go before their base volumes
+            volumes.sort(key=lambda v: self._volume_depth(c, v),
+                         reverse=True)
+            networks = [n for n in c.get_networks()
+                        if n.name not in saved["networks"]]
+
+        with spans.span("destroy_new_objects"):
+            for n in nodes:
+                self.destroy_node(n)
+            for v in volumes:
+                self.detach_volume(v)
+                self.destroy_volume(v)
+            for n in networks:
+                self.ex_destroy_network(n)
+
+        nodes = self._snapshot_nodes(snapshot)
+        with spans.span("restore_snapshots"):
+            errors = self._map_parallel(
+                "ex_restore_environment",
+                lambda n: virtualbox.restore_snapshot(n["id"],
+                                                      snapshot["snapshot"]),
+                nodes,
+                max_parallel)
+        for n in nodes:
+            states.invalidate(n["id"])
+        failed = [n["name"] for (n, e) in zip(nodes, errors) if e]
+        if failed:
+            raise LibcloudError("Cannot restore nodes %s" %
+                                (", ".join(failed),), driver=self)
+
+        with self._catalogue as c:
+            c.restore_objects(saved)
+        self.log.info(".. Environment snapshot '%s' restored", tag)
+        return True
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_set_node_limits(self, node, cpu_execution_cap=None,
+                           disk_bandwidth=None, network_bandwidth=None):
+        """Changes the resource limits of a node, running or not, which are
+        initially those of its size (see :class:`VagrantNodeSize`).
+
+        Bandwidth limits may only be changed for nodes created with a size
+        which limits them: VirtualBox only allows assigning network
+        adapters to bandwidth groups while nodes are powered off. The disk
+        bandwidth limit applies to volumes attached by the driver, not to
+        the disk of the node image.
+
+        This is an extension method.
+
+        :param node: The node.
+        :type node:  :class:`VagrantNode`
+
+        :param cpu_execution_cap: Percentage of host CPU time each virtual
+                                  CPU may use, from 1 to 100.
+        :type cpu_execution_cap:  ``int``
+
+        :param disk_bandwidth: Bandwidth (in MB/s) of the volumes attached
+                               to the node.
+        :type disk_bandwidth:  ``int``
+
+        :param network_bandwidth: Bandwidth (in MB/s) of each network
+                                  adapter of the node.
+        :type network_bandwidth:  ``int``
+
+        :return: ``True`` if the limits were changed.
+        :rtype:  ``bool``
+
+        """
+        limits = {
+            "cpu_execution_cap": cpu_execution_cap,
+            "disk_bandwidth": disk_bandwidth,
+            "network_bandwidth": network_bandwidth,
+        }
+        with self._catalogue as c:
+            current = c.find_node(node.name)
+            for k in ("disk_bandwidth", "network_bandwidth"):
+                if limits[k] is not None and not current.size.extra.get(k):
+                    raise LibcloudError("Node %s was created without a %s "
+                                        "limit" % (node.name, k),
+                                        driver=self)
+            try:
+                virtualbox.set_node_limits(node.id, **limits)
+            except:
+                self.log.warn("Cannot change limits of %s", node.name,
+                              exc_info=True)
+                return False
+            for k, v in limits.items():
+                if v is not None:
+                    current.size.extra[k] = v
+                    node.size.extra[k] = v
+            # The ``Vagrantfile`` keeps the new CPU execution cap for the
+            # next boot of the node.
+            c.update_node(current)
+        self.log.info("Limits of node '%s' changed", node.name)
+        return True
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_set_volume_type(self, volume, mtype):
+        """Sets the VirtualBox type of a detached volume.
+
+        Volumes of types ``immutable`` and ``multiattach`` are shared: they
+        may be attached to several nodes at once, and their contents are
+        read from a single file on the host (and therefore cached once in
+        its memory). Each node writes to its own differencing image, which
+        is discarded when the node is powered off (``immutable``) or when
+        the volume is detached (``multiattach``). Seed the volume with data
+        while it's of type ``normal`` (the default), and share it then.
+
+        This is an extension method.
+
+        :param volume: The volume.
+        :type volume:  :class:`VagrantVolume`
+
+        :param mtype: ``normal``, ``immutable`` or ``multiattach``.
+        :type mtype:  ``str``
+
+        :return: ``True`` if the volume type was changed.
+        :rtype:  ``bool``
+
+        """
+        if mtype not in VagrantVolume.MTYPES:
+            raise LibcloudError("Unknown volume type '%s'" % (mtype,),
+                                driver=self)
+        with self._catalogue as c:
+            current = c.find_volume(volume.name)
+            if current.attached_to:
+                self.log.warn("Cannot change type of volume %s: It is "
+                              "attached to %s", volume.name,
+                              ", ".join(sorted(current.attached_nodes)))
+                return False
+            try:
+                virtualbox.set_volume_type(current.path, mtype)
+            except:
+                self.log.warn("Cannot change type of volume %s",
+                              volume.name, exc_info=True)
+                return False
+            current.mtype = mtype
+            if current.shared:
+                current.attached_to = set()
+            else:
+                current.attached_to = None
+            c.update_volume(current)
+            volume.mtype, volume.attached_to = mtype, current.attached_to
+        self.log.info("Volume '%s' is now %s", volume.name, mtype)
+        return True
+
+    @agent.forwarded
+    @stats.instrumented
+    @spans.traced
+    def ex_snapshot_environment(self, tag, max_parallel=8):
+        """Takes a VirtualBox snapshot of every node, and saves it as
+        environment snapshot ``tag``, together with a copy of the catalogue,
+        to be restored with :meth:`ex_restore_environment`.
+
+        Running nodes are not paused. Snapshots include the volumes attached
+        to nodes, but not volumes which are not attached. An existing
+        snapshot with the same tag is replaced.
+
+        This is an extension method.
+
+        :param tag: Name of the snapshot (letters, digits, ``.``, ``_`` and
+                    ``-`` only).
+        :type tag:  ``str``
+
+        :param max_parallel: Maximum number of nodes to snapshot at the same
+                             time (default is 8).
+        :type max_parallel:  ``int``
+
+        :return: The snapshot, as returned by
+                 :meth:`ex_list_environment_snapshots`.
+        :rtype:  ``dict``
+
+        """
+        if not _TAG_RE.match(tag):
+            raise LibcloudError("Invalid environment snapshot name '%s'" %
+                                (tag,), driver=self)
+        fname = self._environment_snapshot_fname(tag)
+        if os.access(fname, os.F_OK):
+            self.ex_delete_environment_snapshot(tag)
+
+        self.log.info("Taking environment snapshot '%s' ..", tag)
+        snapshot = {
+            "tag": tag,
+            "created": time.time(),
+            "snapshot": "libcloud-vagrant-%s" % (tag,),
+        }
+        with self._catalogue as c:
+            snapshot["catalogue"] = c.copy_objects()
+            nodes = self._snapshot_nodes(snapshot)
+            errors = self._map_parallel(
+                "ex_snapshot_environment",
+                lambda n: virtualbox.take_snapshot(n["id"],
+                                                   snapshot["snapshot"]),
+                nodes,
+                max_parallel)
+            if any(errors):
+                for n, e in zip(nodes, errors):
+                    if e is None:
+                        virtualbox.delete_snapshot(n["id"],
+                                                   snapshot["snapshot"])
+                failed = [n["name"] for (n, e) in zip(nodes, errors) if e]
+                raise LibcloudError("Cannot take snapshot of nodes %s" %
+                                    (", ".join(failed),), driver=self)
+
+        if not os.access(os.path.dirname(fname), os.F_OK):
+            os.mkdir(os.path.dirname(fname))
+        with open(fname + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.rename(fname + ".tmp", fname)
+        self.log.info(".. Environment snapshot '%s' taken", tag)
+        return [s for s in self.ex_list_environment_snapshots()
+                if s["tag"] == tag][0]
+
+    @stats.instrumented
     def ex_ssh_client(self, node):
         """Returns a context manager implementing an SSH client to the given
         node.
@@ -684,6 +1843,132 @@ class VagrantDriver(base.NodeDriver):
                           username=config["user"],
                           key_files=[config["key"]])
 
+    @agent.forwarded
+    @stats.instrumented
+    def ex_start_node(self, node):
+        """Starts a node stopped with :meth:`ex_stop_node`. Nodes whose state
+        was saved resume where they left.
+
+        The node is started directly in VirtualBox, without Vagrant, so
+        provisioners are not run again.
+
+        This is an extension method.
+
+        :param node: The node to start.
+        :type node:  :class:`VagrantNode`
+
+        :return: ``True`` if the node was started.
+        :rtype:  ``bool``
+
+        """
+        self.log.info("Starting node '%s' ..", node.name)
+        try:
+            self._start(node)
+        except:
+            self.log.warn("Cannot start %s", node.name, exc_info=True)
+            return False
+        self.log.info(".. Node '%s' started", node.name)
+        return True
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_start_nodes(self, nodes, max_parallel=8):
+        """Starts several nodes (see :meth:`ex_start_node`), up to
+        ``max_parallel`` at the same time.
+
+        This is an extension method.
+
+        :return: Whether each node was started.
+        :rtype:  ``list`` of ``bool``
+
+        """
+        errors = self._map_parallel("ex_start_nodes", self._start, nodes,
+                                    max_parallel)
+        return [e is None for e in errors]
+
+    @agent.forwarded
+    def ex_stats(self, reset=False):
+        """Returns statistics about the ``vagrant`` and ``VBoxManage``
+        commands run so far, both overall and for each driver operation.
+
+        Statistics are kept for the whole process, not for each driver
+        instance. See :func:`libcloudvagrant.common.stats.snapshot` for the
+        format of the returned value.
+
+        Set environment variable ``LIBCLOUD_VAGRANT_TRACE`` to the name of a
+        file in order to get a trace of each command run, one JSON object per
+        line.
+
+        This is an extension method.
+
+        :param reset: Whether to discard the statistics recorded so far,
+                      after returning them (default: ``False``).
+        :type reset:  ``bool``
+
+        :rtype: ``dict``
+
+        """
+        ret = stats.snapshot()
+        if reset:
+            stats.reset()
+        return ret
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_stop_node(self, node, mode="savestate", timeout=60):
+        """Stops a node, releasing its memory on the host.
+
+        This is an extension method.
+
+        :param node: The node to stop.
+        :type node:  :class:`VagrantNode`
+
+        :param mode: How to stop it: ``savestate`` (the default) saves its
+                     state to disk, so that :meth:`ex_start_node` resumes it
+                     in seconds; ``acpi`` presses its ACPI power button, and
+                     waits until its operating system powers it off; and
+                     ``poweroff`` pulls the plug.
+        :type mode:  ``str``
+
+        :param timeout: How many seconds to wait for nodes stopped with
+                        ``acpi`` to power off (default is 60).
+        :type timeout:  ``int``
+
+        :return: ``True`` if the node was stopped.
+        :rtype:  ``bool``
+
+        """
+        self._check_stop_mode(mode)
+        self.log.info("Stopping node '%s' (%s) ..", node.name, mode)
+        try:
+            virtualbox.stop_node(node.id, mode, timeout)
+        except:
+            self.log.warn("Cannot stop %s", node.name, exc_info=True)
+            return False
+        self.log.info(".. Node '%s' stopped", node.name)
+        return True
+
+    @agent.forwarded
+    @stats.instrumented
+    def ex_stop_nodes(self, nodes, mode="savestate", timeout=60,
+                      max_parallel=8):
+        """Stops several nodes (see :meth:`ex_stop_node`), up to
+        ``max_parallel`` at the same time.
+
+        This is an extension method.
+
+        :return: Whether each node was stopped.
+        :rtype:  ``list`` of ``bool``
+
+        """
+        self._check_stop_mode(mode)
+        errors = self._map_parallel(
+            "ex_stop_nodes",
+            lambda n: virtualbox.stop_node(n.id, mode, timeout),
+            nodes,
+            max_parallel)
+        return [e is None for e in errors]
+
     def _allocated_addresses(self, network):
         with self._catalogue as c:
             try:
@@ -691,39 +1976,557 @@ class VagrantDriver(base.NodeDriver):
             except:
                 return []
 
-    def _vagrant(self, *args):
+    def _allocate_addresses(self, catalogue, networks):
+        """Allocates an address in each of the given networks, returning the
+        lists of public and private addresses (as dicts).
+
+        """
+        for n in networks:
+            # Other nodes may have been created since this network object
+            # was obtained, so refresh its allocated addresses first.
+            n._allocated = set(self._allocated_addresses(n))
+        public_ips = [n.allocate_address().to_dict()
+                      for n in networks if n.public]
+        private_ips = [n.allocate_address().to_dict()
+                       for n in networks if not n.public]
+        for n in networks:
+            catalogue.update_network(n)
+        return public_ips, private_ips
+
+    def _deallocate_addresses(self, catalogue, node):
+        with spans.span("deallocate_addresses"):
+            for ip in node._public_ips + node._private_ips:
+                self.log.debug("_deallocate_addresses(): Deallocating "
+                               "address %s", ip)
+                n = catalogue.find_network(ip.network_name)
+                n.deallocate_address(ip.address)
+                catalogue.update_network(n)
+
+    def _discard_node(self, node):
+        """Removes a node which could not be booted from the catalogue,
+        releasing its addresses, and destroys its machine if Vagrant
+        created one.
+
+        """
+        self.log.warn("Discarding node '%s', which could not be booted",
+                      node.name)
+        try:
+            with self._catalogue as c:
+                try:
+                    node_uuid = c.virtualbox_uuid(node)
+                except (IOError, OSError):
+                    self.log.debug("_discard_node(): No machine for '%s'",
+                                   node.name)
+                else:
+                    self._vagrant("destroy --force", node.name)
+                    states.invalidate(node_uuid)
+                self._deallocate_addresses(c, node)
+                c.remove_node(node)
+            admission.release()
+        except:
+            self.log.warn("Cannot discard node '%s'", node.name,
+                          exc_info=True)
+
+    def _update_host_interfaces(self, catalogue, node, networks):
+        """Records the host interfaces of the public networks of a node which
+        has just been booted.
+
+        """
+        public_networks = filter(lambda n: n.public, networks)
+        self.log.debug("create_node(%s): Public networks: %s",
+                       node.name, public_networks)
+        if public_networks:
+            with spans.span("get_host_interfaces"):
+                ifaces = virtualbox.get_host_interfaces(node.id)
+            self.log.debug("create_node(%s): Ifaces: %s", node.name, ifaces)
+            for n, iface in zip(public_networks, ifaces):
+                self.log.debug("create_node(%s): Iface for '%s': '%s'",
+                               node.name, n.name, iface)
+                n.host_interface = iface
+                n._allocated = set(self._allocated_addresses(n))
+                catalogue.update_network(n)
+
+    def _claim_pool_node(self, name, size, image, networks, progress):
+        """Claims a node from the pool for ``image`` and ``size``, if there's
+        one, renaming it to ``name`` and connecting it to ``networks``.
+
+        Returns the node, or ``None`` if there are no pooled nodes ready.
+
+        """
+        key = pool_key(image, size)
+        with self._catalogue as c:
+            pool = c.get_pools().get(key)
+            if pool is None:
+                return None
+            for member in pool["nodes"]:
+                node = c.get_node(member)
+                if (node is not None and node.id is not None and
+                        node.size.to_dict() == size.to_dict()):
+                    break
+            else:
+                self.log.debug("create_node(%s): No nodes ready in pool %s",
+                               name, key)
+                return None
+
+            self.log.info("Claiming node '%s' from pool %s for '%s'",
+                          member, key, name)
+            pool["nodes"].remove(member)
+            c.update_pool(key, pool)
+            c.rename_node(node, name)
+            public_ips, private_ips = self._allocate_addresses(c, networks)
+            node = VagrantNode.from_dict(driver=self,
+                                         **dict(node.to_dict(),
+                                                public_ips=public_ips,
+                                                private_ips=private_ips))
+            c.add_node(node)
+
+        self._spawn_pool_refill()
+
+        try:
+            # Network interfaces can only be added by rebooting the node
+            if networks:
+                self._vagrant("reload --no-provision", node.name,
+                              on_event=self._vagrant_progress(progress))
+            elif pool["saved"]:
+                self._vagrant("resume", node.name,
+                              on_event=self._vagrant_progress(progress))
+            states.invalidate(node.id)
+
+            with self._catalogue as c:
+                self._update_host_interfaces(c, node, networks)
+            self.log.info(".. Node '%s' created", name)
+            return node
+        except:
+            exc_info = sys.exc_info()
+            self._discard_node(node)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _environment_snapshot_fname(self, tag):
+        return os.path.join(self._dot_libcloudvagrant, "snapshots",
+                            "%s.json" % (tag,))
+
+    def _load_environment_snapshot(self, tag):
+        try:
+            with open(self._environment_snapshot_fname(tag)) as f:
+                return json.load(f)
+        except IOError:
+            raise LibcloudError("Unknown environment snapshot '%s'" % (tag,),
+                                driver=self)
+
+    def _snapshot_nodes(self, snapshot):
+        """Returns the catalogued nodes in an environment snapshot which had
+        been booted, as dicts.
+
+        """
+        nodes = snapshot["catalogue"]["nodes"]
+        return [p for (_, p) in sorted(nodes.items()) if p["id"] is not None]
+
+    def _map_parallel(self, operation, func, items, max_parallel=8):
+        """Calls ``func`` on each item, up to ``max_parallel`` at the same
+        time, attributing the commands run to driver operation
+        ``operation``.
+
+        Returns the exception raised for each item, or ``None`` for those
+        which succeeded.
+
+        """
+        parent = spans.current()
+
+        def call(item):
+            with stats.operation(operation, record_call=False), \
+                    spans.within(parent):
+                try:
+                    func(item)
+                except Exception as exc:
+                    self.log.warn("%s(): Failed for %s", operation, item,
+                                  exc_info=True)
+                    return exc
+
+        if not items:
+            return []
+        pool = ThreadPool(max(1, min(max_parallel, len(items))))
+        try:
+            return pool.map(call, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    @contextmanager
+    def _admitted(self, name, size, image):
+        """Context manager which enters the catalogue once the host has
+        enough resources for node ``name`` of the given size and image, so
+        that it may be added before other nodes take them.
+
+        Raises an error if that doesn't happen within
+        ``admission.TIMEOUT`` seconds.
+
+        """
+        deadline = time.time() + admission.TIMEOUT
+        while True:
+            with self._catalogue as c:
+                reason = admission.shortfall([n for n in
+                                              c.get_nodes(pooled=True)
+                                              if n.name != name],
+                                             size, image)
+                if reason is None:
+                    yield c
+                    return
+            if time.time() >= deadline:
+                raise LibcloudError("Not enough host resources for node "
+                                    "'%s': %s" % (name, reason), driver=self)
+            self.log.info("Waiting for host resources for node '%s': %s",
+                          name, reason)
+            admission.wait(deadline - time.time())
+
+    def _start(self, node):
+        with admission.booting():
+            virtualbox.start_node(node.id)
+
+    def _apply_topology_node(self, name, group, node, size, networks,
+                             volume_names, report):
+        """Applies node group ``group`` to its node ``name`` (which is
+        ``None`` if it doesn't exist), attaching to it the volumes of the
+        group, and detaching from it the other ones in ``volume_names``.
+
+        What is done to the node is added to ``report`` (see
+        :meth:`ex_apply_topology`) as soon as it's done.
+
+        """
+        action = None
+        if node is not None:
+            current = set(ip.network_name
+                          for ip in node._public_ips + node._private_ips)
+            if (node.image.name != group["image"] or
+                    node.size.to_dict() != size.to_dict() or
+                    current != set(group["networks"])):
+                self.log.info("Node '%s' changed, replacing it", name)
+                if not self.destroy_node(node):
+                    raise LibcloudError("Cannot destroy node '%s'" % (name,),
+                                        driver=self)
+                node = None
+                action = "replaced"
+        if node is None:
+            node = self.create_node(name=name,
+                                    size=size,
+                                    image=self.get_image(group["image"]),
+                                    ex_networks=networks)
+            action = action or "created"
+            report[action].append(name)
+
+        volumes = dict((v.name, v) for v in self.list_volumes()
+                       if v.name in volume_names)
+        attach = [volumes[v] for v in group["volumes"]
+                  if name not in volumes[v].attached_nodes]
+        detach = [v for v in volumes.values()
+                  if v.name not in group["volumes"] and
+                  name in v.attached_nodes]
+        if ((attach and not all(self.ex_attach_volumes(node, attach))) or
+                (detach and not all(self.ex_detach_volumes(detach, node)))):
+            raise LibcloudError("Cannot attach or detach the volumes of "
+                                "node '%s'" % (name,), driver=self)
+
+        task = topology.deployment(group)
+        if (task is not None and
+                node.deployment_hash != hash_deployment(task)):
+            self._deploy(node, deploy=task)
+            if action is None:
+                report["deployed"].append(name)
+
+    def _prune_topology(self, kind, previous, wanted, report):
+        """Destroys the objects of kind ``kind`` (``networks``, ``volumes``
+        or ``nodes``) in topology ``previous`` which aren't in ``wanted``.
+
+        """
+        objects, destroy = {
+            "networks": (self.ex_list_networks, self.ex_destroy_network),
+            "volumes": (self.list_volumes, self.destroy_volume),
+            "nodes": (self.list_nodes, self.destroy_node),
+        }[kind]
+        for obj in objects():
+            if obj.name in previous[kind] and obj.name not in wanted[kind]:
+                if destroy(obj):
+                    report["destroyed"].append(obj.name)
+                else:
+                    report["failed"].append(obj.name)
+
+    def _load_topology(self):
+        """Returns the names of the objects of the topology last applied.
+
+        """
+        try:
+            with open(self._topology_fname) as f:
+                return json.load(f)
+        except IOError:
+            return {"networks": [], "volumes": [], "nodes": []}
+
+    def _save_topology(self, names):
+        """Saves the names of the objects of the topology just applied,
+        replacing the file with a new one under the catalogue lock, so that
+        concurrent or interrupted calls never leave it half-written.
+
+        """
+        fname = self._topology_fname
+        with self._catalogue:
+            fd, tmp = tempfile.mkstemp(prefix="topology.json.",
+                                       dir=self._dot_libcloudvagrant)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(names, f, indent=2)
+                os.rename(tmp, fname)
+            except:
+                os.unlink(tmp)
+                raise
+
+    @property
+    def _topology_fname(self):
+        return os.path.join(self._dot_libcloudvagrant, "topology.json")
+
+    def _pool_node(self, name):
+        """Returns the catalogued node named ``name``, or ``None``.
+
+        """
+        with self._catalogue as c:
+            return c.get_node(name)
+
+    def _spawn_pool_refill(self):
+        """Refills node pools in a separate process, which outlives this
+        one.
+
+        """
+        code = ("from libcloudvagrant.compute.driver import VagrantDriver; "
+                "d = VagrantDriver(); d._home = %r; d.ex_refill_pools()" %
+                (self._home,))
+        with open(os.devnull, "r+") as devnull:
+            subprocess.Popen([sys.executable, "-c", code],
+                             stdin=devnull,
+                             stdout=devnull,
+                             stderr=devnull,
+                             close_fds=True)
+
+    def _attachable(self, catalogue, node, volume):
+        """Returns whether a volume may be attached to a node, refreshing the
+        nodes a shared volume is attached to from the catalogue.
+
+        """
+        if volume.attached_to and not volume.shared:
+            self.log.warn("Volume %s already attached to %s",
+                          volume.name, volume.attached_to)
+            return False
+        children = self._child_volumes(catalogue, volume)
+        if children:
+            self.log.warn("Cannot attach volume %s: It is the base of %s",
+                          volume.name, ", ".join(children))
+            return False
+        if volume.shared:
+            # Other nodes may have attached it since this volume object was
+            # obtained
+            volume.attached_to = catalogue.find_volume(
+                volume.name).attached_to
+            if node.name in volume.attached_to:
+                self.log.warn("Volume %s already attached to %s",
+                              volume.name, node.name)
+                return False
+        return True
+
+    def _mark_attached(self, volume, node):
+        if volume.shared:
+            volume.attached_to.add(node.name)
+        else:
+            volume.attached_to = node.name
+
+    def _disk_bandwidth_group(self, node):
+        if node.size.extra.get("disk_bandwidth"):
+            return virtualbox.DISK_BANDWIDTH_GROUP
+
+    def _set_host_io_cache(self, node, enabled):
+        try:
+            virtualbox.set_host_io_cache(node.id, enabled)
+        except LibcloudError as ex:
+            self.log.warn("Cannot change host I/O cache of node %s: %s",
+                          node.name, ex)
+
+    def _child_volumes(self, catalogue, volume):
+        """Returns the names of the differencing children of a volume.
+
+        """
+        return sorted(v.name for v in catalogue.get_volumes()
+                      if v.base == volume.name)
+
+    def _volume_depth(self, catalogue, volume):
+        """Returns the number of base volumes under a volume.
+
+        """
+        ret = 0
+        while volume.base is not None:
+            volume = catalogue.find_volume(volume.base)
+            ret += 1
+        return ret
+
+    def _check_stop_mode(self, mode):
+        if mode not in virtualbox.STOP_MODES:
+            raise LibcloudError("Unknown stop mode '%s'" % (mode,),
+                                driver=self)
+
+    def _deploy(self, node, **kwargs):
+        """Waits until the given node is running, and then runs the
+        deployment given in ``kwargs`` (see :meth:`deploy_node`).
+
+        """
+        task = kwargs["deploy"]
+        max_tries = kwargs.get("max_tries", 3)
+        ssh_timeout = kwargs.get("ssh_timeout", 10)
+        timeout = kwargs.get("timeout", SSH_CONNECT_TIMEOUT)
+
+        try:
+            ssh_config = self._vagrant_ssh_config(node.name)
+            with spans.span("wait_until_running"):
+                _, ip_addresses = self.wait_until_running(
+                    nodes=[node],
+                    wait_period=3,
+                    timeout=kwargs.get("timeout", NODE_ONLINE_WAIT_TIMEOUT),
+                    ssh_interface=ssh_config["host"])[0]
+
+            self.log.info("Running deployment script on '%s' ..", node.name)
+            with spans.span("deployment"):
+                self._connect_and_run_deployment_script(
+                    task=task,
+                    node=node,
+                    ssh_hostname=ip_addresses[0],
+                    ssh_port=ssh_config["port"],
+                    ssh_username=ssh_config["user"],
+                    ssh_password=None,
+                    ssh_key_file=ssh_config["key"],
+                    ssh_timeout=ssh_timeout,
+                    timeout=timeout,
+                    max_tries=max_tries)
+            self.log.info(".. Finished deployment script on '%s' ..",
+                          node.name)
+        except Exception as exc:
+            raise DeploymentError(node=node, original_exception=exc,
+                                  driver=self)
+        return self._record_deployment(node, task)
+
+    def _deployed_image(self, kwargs):
+        """Returns the image created by :meth:`ex_create_image` from a node
+        of image ``kwargs["image"]`` deployed with ``kwargs["deploy"]``, if
+        ``kwargs["ex_reuse_image"]`` is set and there's one.
+
+        """
+        if not kwargs.get("ex_reuse_image"):
+            return None
+        digest = hash_deployment(kwargs["deploy"])
+        with self._catalogue as c:
+            images = c.get_images()
+        base_image = images.get(kwargs["image"].name, {}).get(
+            "base", kwargs["image"].name)
+        for name, image in sorted(images.items()):
+            if (image["base"] == base_image and
+                    image["deployment_hash"] == digest):
+                self.log.info("Reusing image '%s' for node '%s'",
+                              name, kwargs["name"])
+                return VagrantImage(name=name, driver=self)
+        self.log.debug("No image for deployment %s of '%s'",
+                       digest, base_image)
+
+    def _record_deployment(self, node, task):
+        """Records in the catalogue a hash of the deployment run on a node,
+        for :meth:`ex_create_image`.
+
+        """
+        node.deployment_hash = hash_deployment(task)
+        with self._catalogue as c:
+            c.add_node(node)
+        return node
+
+    def _vagrant(self, *args, **kwargs):
         """Executes the ``vagrant`` command in machine-readable output format.
 
         Raises and error if the exit status is non-zero.
 
+        The output of the command is read line by line, and only logged if
+        debug logging is enabled. Vagrant's own log level (environment
+        variable ``VAGRANT_LOG``) follows the effective level of our logger,
+        unless it is already set.
+
         :param args:  Parameters to ``vagrant``
         :type args:   ``list``
 
-        :return: The combined standard output and standard error of the
-                 command.
+        :param on_event: Optional callable, called with each
+                         :class:`VagrantEvent` in the output of the command
+                         as soon as it is read.
+        :type on_event:  ``callable``
+
+        :param capture: Whether to keep the standard output of the command,
+                        for parsing it. Defaults to ``False``.
+        :type capture:  ``bool``
+
+        :return: The standard output of the command, if ``capture`` is set,
+                 or ``None`` otherwise.
 
         :rtype:  ``str``.
 
         """
+        on_event = kwargs.get("on_event")
+        p = self._vagrant_command(*args, capture=kwargs.get("capture", False))
+        if on_event is not None:
+            for event in events.parse(p):
+                on_event(event)
+        self._vagrant_wait(p)
+        return p.stdout
+
+    def _vagrant_events(self, *args):
+        """Executes the ``vagrant`` command in machine-readable output format,
+        and yields the events in its output as soon as they are read.
+
+        Raises an error after the last event if the exit status is non-zero.
+
+        :param args:  Parameters to ``vagrant``
+        :type args:   ``list``
+
+        :rtype: ``generator`` of :class:`VagrantEvent`
+
+        """
+        p = self._vagrant_command(*args)
+        for event in events.parse(p):
+            yield event
+        self._vagrant_wait(p)
+
+    def _vagrant_command(self, *args, **kwargs):
         env = dict(os.environ)
-        env["VAGRANT_LOG"] = "debug"
+        env.setdefault("VAGRANT_LOG", process.vagrant_log_level(self.log))
         cmdline = ["vagrant --machine-readable"]
         cmdline.extend(args)
         cmdline = " ".join(str(arg) for arg in cmdline)
         self.log.debug("Executing %s (cwd: %s)",
                        cmdline, self._dot_libcloudvagrant)
-        p = subprocess.Popen(cmdline, shell=True,
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,
-                             env=env,
-                             cwd=self._dot_libcloudvagrant)
-        stdout, stderr = p.communicate()
-        self.log.debug(stdout)
-        if p.returncode:
+        return process.Command(cmdline, self.log,
+                               env=env,
+                               cwd=self._dot_libcloudvagrant,
+                               name=process.command_name("vagrant", args),
+                               capture=kwargs.get("capture", False))
+
+    def _vagrant_wait(self, p):
+        if p.wait():
             self.log.warn("%s (cwd: %s) failed: %s",
-                          cmdline, self._dot_libcloudvagrant, stderr)
-            raise LibcloudError(stdout, driver=self)
-        return stdout
+                          p.cmdline, self._dot_libcloudvagrant,
+                          "\n".join(p.tail))
+            raise LibcloudError("\n".join(p.tail), driver=self)
+
+    def _vagrant_progress(self, callback):
+        """Returns an ``on_event`` callable for :meth:`_vagrant`, which calls
+        ``callback(phase, event)`` for each event starting a new phase.
+
+        """
+        if callback is None:
+            return None
+
+        def on_event(event):
+            name = events.phase(event)
+            if name is not None:
+                self.log.debug("Node '%s': Phase '%s'", event.target, name)
+                callback(name, event)
+
+        return on_event
 
     @property
     def _dot_libcloudvagrant(self):
@@ -744,7 +2547,7 @@ class VagrantDriver(base.NodeDriver):
 
     def _vagrant_ssh_config(self, node_name):
         ret = {}
-        ssh_config = self._vagrant("ssh-config", node_name)
+        ssh_config = self._vagrant("ssh-config", node_name, capture=True)
         m = re.search("HostName (.+)$", ssh_config, re.MULTILINE)
         if m:
             ret["host"] = m.group(1)
@@ -760,6 +2563,62 @@ class VagrantDriver(base.NodeDriver):
         return ret
 
 
+def hash_deployment(task):
+    """Returns a hash of what a deployment does: its scripts and their
+    arguments, the contents of the files and keys it installs, and the
+    order of its steps.
+
+    """
+    digest = hashlib.sha1()
+
+    def update(obj):
+        if isinstance(obj, (list, tuple)):
+            digest.update("[")
+            for o in obj:
+                update(o)
+            digest.update("]")
+        elif isinstance(obj, dict):
+            digest.update("{")
+            for k, v in sorted(obj.items()):
+                update(k)
+                update(v)
+            digest.update("}")
+        elif hasattr(obj, "__dict__"):
+            params = dict(vars(obj))
+            for k in ("stdout", "stderr", "exit_status"):
+                params.pop(k, None)
+            if isinstance(obj, ScriptDeployment):
+                # Random by default, and only used for the remote file name
+                params.pop("name", None)
+            if isinstance(obj, FileDeployment):
+                with open(obj.source, "rb") as f:
+                    params["content"] = f.read()
+            digest.update(type(obj).__name__)
+            update(params)
+        elif isinstance(obj, unicode):
+            update(obj.encode("utf-8"))
+        elif isinstance(obj, str):
+            digest.update("%d:" % (len(obj),))
+            digest.update(obj)
+        else:
+            digest.update(repr(obj))
+
+    update(task)
+    return digest.hexdigest()
+
+
+def pool_key(image, size):
+    """Returns the key of the node pool for ``image`` and ``size``.
+
+    Keys include a hash of all the attributes of ``size``, so that sizes
+    with the same name but different memory, CPUs or settings have
+    different pools.
+
+    """
+    digest = hashlib.sha1(json.dumps(size.to_dict(), sort_keys=True))
+    return "%s:%s:%s" % (image.name, size.name, digest.hexdigest()[:8])
+
+
 @contextmanager
 def ssh_client(**kwargs):
     """Context manager that returns an SSH client. The SSH connection is
@@ -28,6 +28,7 @@ from libcloud.common.types import LibcloudError
 from libcloud.compute import base
 from libcloud.compute.types import NodeState
 
+from libcloudvagrant.common import states
 from libcloudvagrant.common.types import Serializable
 
 
@@ -86,11 +87,18 @@ class VagrantImage(base.NodeImage, Serializable):
 
 class VagrantNetwork(Serializable):
 
-    """A Vagrant network."""
+    """A Vagrant network.
+
+    The network adapters of nodes in this network are of type ``nic_type``
+    (or of that of the size of each node, if ``None``), and in promiscuous
+    mode ``promiscuous`` (or in the VirtualBox default one, if ``None``).
+
+    """
 
     log = logging.getLogger("libcloudvagrant")
 
-    def __init__(self, name, cidr, public, allocated, host_interface, driver):
+    def __init__(self, name, cidr, public, allocated, host_interface, driver,
+                 nic_type=None, promiscuous=None):
         self.name = name
         self.cidr = ipaddr.IPNetwork(cidr)
         self.public = public
@@ -99,6 +107,8 @@ class VagrantNetwork(Serializable):
             self._allocate(VagrantAddress(ip, name))
         self.host_interface = host_interface
         self.driver = driver
+        self.nic_type = nic_type
+        self.promiscuous = promiscuous
 
     @property
     def addresses(self):
@@ -175,13 +185,17 @@ class VagrantNetwork(Serializable):
         self.log.debug("deallocate_address(): Allocated: %s", self._allocated)
 
     def to_dict(self):
-        return {
+        ret = {
             "name": self.name,
             "cidr": str(self.cidr),
             "public": self.public,
             "allocated": sorted([str(ip.address) for ip in self._allocated]),
             "host_interface": self.host_interface,
         }
+        for k in ("nic_type", "promiscuous"):
+            if getattr(self, k) is not None:
+                ret[k] = getattr(self, k)
+        return ret
 
     def __contains__(self, other):
         return other in self.cidr
@@ -190,12 +204,15 @@ class VagrantNetwork(Serializable):
 class VagrantNode(base.Node, Serializable):
 
     def __init__(self, id, name, public_ips, private_ips, size, image,
-                 allocate_sata_ports, driver):
+                 allocate_sata_ports, driver, linked_clone=False,
+                 deployment_hash=None):
         self._public_ips = [VagrantAddress(**p) for p in public_ips]
         self._private_ips = [VagrantAddress(**p) for p in private_ips]
         size = VagrantNodeSize.from_dict(driver=driver, **size)
         image = VagrantImage.from_dict(driver=driver, **image)
         self.allocate_sata_ports = allocate_sata_ports
+        self.linked_clone = linked_clone
+        self.deployment_hash = deployment_hash
         super(VagrantNode, self).__init__(id=id,
                                           name=name,
                                           state=NodeState.UNKNOWN,
@@ -206,7 +223,16 @@ class VagrantNode(base.Node, Serializable):
                                           image=image)
 
     def state():
+        doc = """The state of this node, which may be up to a few seconds old
+        (see :mod:`libcloudvagrant.common.states`).
+
+        """
+
         def fget(self):
+            if self.id is not None:
+                state = states.cached(self.id)
+                if state is not None:
+                    return state
             try:
                 return self.driver.ex_get_node_state(self)
             except:
@@ -242,7 +268,7 @@ class VagrantNode(base.Node, Serializable):
     private_ips = property(**private_ips())
 
     def to_dict(self):
-        return {
+        ret = {
             "id": self.id,
             "name": self.name,
             "public_ips": [
@@ -256,7 +282,11 @@ class VagrantNode(base.Node, Serializable):
             "size": self.size.to_dict(),
             "image": self.image.to_dict(),
             "allocate_sata_ports": self.allocate_sata_ports,
+            "linked_clone": self.linked_clone,
         }
+        if self.deployment_hash is not None:
+            ret["deployment_hash"] = self.deployment_hash
+        return ret
 
     @classmethod
     def from_dict(cls, **params):
@@ -301,8 +331,29 @@ class VagrantNodeSize(base.NodeSize, Serializable):
         * An ``extra`` parameter called ``cpus`` is accepted, representing the
           number of CPUs in a node.
 
+        * An ``extra`` parameter called ``linked_clone`` is accepted, which
+          makes nodes of this size linked clones of their image by default
+          (see ``VagrantDriver.create_node()``).
+
+        * ``extra`` parameters called ``cpu_execution_cap``,
+          ``disk_bandwidth`` and ``network_bandwidth`` are accepted, limiting
+          the resources nodes of this size may take from the host.
+
+        * ``extra`` parameters called ``paravirt_provider``,
+          ``nested_paging``, ``vtx_vpid``, ``ioapic``, ``chipset``,
+          ``nic_type`` and ``large_pages`` are accepted, tuning the virtual
+          hardware of nodes of this size.
+
     """
 
+    # Resource limits, in the ``extra`` attribute (see
+    # ``VagrantDriver.ex_set_node_limits()``).
+    LIMITS = ("cpu_execution_cap", "disk_bandwidth", "network_bandwidth")
+
+    # Virtual hardware settings, in the ``extra`` attribute.
+    TUNING = ("paravirt_provider", "nested_paging", "vtx_vpid", "ioapic",
+              "chipset", "nic_type", "large_pages")
+
     def __init__(self, name, ram, driver, id=None, extra=None, **kwargs):
         """
         :param id: Size ID (optional, defaults to ``name``).
@@ -325,6 +376,49 @@ class VagrantNodeSize(base.NodeSize, Serializable):
                           ``cpus``
                              Number of CPUs. Defaults to 1.
 
+                          ``linked_clone``
+                             Whether nodes of this size are linked clones.
+                             Defaults to ``False``.
+
+                          ``cpu_execution_cap``
+                             Percentage of host CPU time each virtual CPU
+                             may use, from 1 to 100. Defaults to no limit.
+
+                          ``disk_bandwidth``
+                             Bandwidth (in MB/s) of the volumes attached to
+                             nodes of this size. Defaults to no limit.
+
+                          ``network_bandwidth``
+                             Bandwidth (in MB/s) of each network adapter of
+                             nodes of this size. Defaults to no limit.
+
+                          ``paravirt_provider``
+                             Paravirtualization interface presented to the
+                             guest, such as ``kvm`` (for Linux guests) or
+                             ``hyperv`` (for Windows guests).
+
+                          ``nested_paging``, ``vtx_vpid``
+                             Whether to use the nested paging and VPID
+                             features of hardware virtualization.
+
+                          ``ioapic``
+                             Whether to enable the I/O APIC, which nodes
+                             with more than one CPU need.
+
+                          ``chipset``
+                             Emulated chipset: ``piix3`` or ``ich9``.
+
+                          ``nic_type``
+                             Type of the network adapters, such as
+                             ``virtio`` or ``82540EM``.
+
+                          ``large_pages``
+                             Whether to back the memory of nodes with large
+                             pages of the host.
+
+                      Settings which aren't given are those of the image
+                      of each node, or the VirtualBox defaults.
+
         :type  extra: ``dict``
 
         """
@@ -340,17 +434,29 @@ class VagrantNodeSize(base.NodeSize, Serializable):
 
     @classmethod
     def from_dict(cls, **params):
+        extra = {"cpus": params["cpus"]}
+        if params.get("linked_clone"):
+            extra["linked_clone"] = True
+        for k in cls.LIMITS + cls.TUNING:
+            if params.get(k) is not None:
+                extra[k] = params[k]
         return cls(name=params["name"],
                    ram=params["ram"],
                    driver=params["driver"],
-                   extra={"cpus": params["cpus"]})
+                   extra=extra)
 
     def to_dict(self):
-        return {
+        ret = {
             "name": self.name,
             "ram": self.ram,
             "cpus": self.extra["cpus"],
         }
+        if self.extra.get("linked_clone"):
+            ret["linked_clone"] = True
+        for k in self.LIMITS + self.TUNING:
+            if self.extra.get(k) is not None:
+                ret[k] = self.extra[k]
+        return ret
 
     def __repr__(self):
         fields = ("%s=%s" % (k, v) for (k, v) in self.to_dict().items())
@@ -372,8 +478,28 @@ class VagrantVolume(base.StorageVolume, Serializable):
         * An ``extra`` parameter called ``path`` is accepted, pointing to the
           file system location of this volume in the host system.
 
+        * An ``extra`` parameter called ``base`` is accepted, naming the
+          volume this volume is a differencing child of.
+
+        * An ``extra`` parameter called ``mtype`` is accepted, with the
+          VirtualBox type of this volume. Volumes of types ``immutable``
+          and ``multiattach`` may be attached to several nodes at once, and
+          their ``attached_to`` attribute is a set of node names.
+
+        * ``extra`` parameters called ``variant``, ``nonrotational``,
+          ``discard`` and ``hostiocache`` are accepted, with the storage
+          variant of this volume and the way it's attached to nodes.
+
     """
 
+    # VirtualBox medium types, and whether volumes of each type may be
+    # attached to several nodes at once.
+    MTYPES = {
+        "normal": False,
+        "immutable": True,
+        "multiattach": True,
+    }
+
     def __init__(self, name, size, driver, id=None, extra=None):
         """
         :param id: Storage volume ID (optional, defaults to the value of ``name``).
@@ -400,6 +526,33 @@ class VagrantVolume(base.StorageVolume, Serializable):
                           Path to the file system location of this volume in
                           the host system.
 
+                        ``base``
+                          Name of the volume this volume is a differencing
+                          child of, or ``None`` for volumes created from
+                          scratch. Defaults to ``None``.
+
+                        ``mtype``
+                          VirtualBox medium type of this volume: ``normal``
+                          (the default), ``immutable`` or ``multiattach``.
+
+                        ``variant``
+                          Storage variant of this volume: ``Standard`` (the
+                          default), ``Fixed`` or ``Split2G``.
+
+                        ``nonrotational``
+                          Whether nodes see this volume as a solid-state
+                          drive. Defaults to ``False``.
+
+                        ``discard``
+                          Whether nodes may release unused blocks of this
+                          volume with TRIM commands. Defaults to ``False``.
+
+                        ``hostiocache``
+                          Whether the host I/O cache is enabled for the
+                          controllers of the nodes this volume is attached
+                          to, or ``None`` to leave them alone. Defaults to
+                          ``None``.
+
         :type extra: ``dict``
 
         """
@@ -410,8 +563,37 @@ class VagrantVolume(base.StorageVolume, Serializable):
                                             driver=driver)
         if extra is None:
             extra = {}
+        self.mtype = extra.get("mtype") or "normal"
+        if self.mtype not in self.MTYPES:
+            raise LibcloudError("Unknown volume type '%s'" % (self.mtype,),
+                                driver=driver)
         self.attached_to = extra.get("attached_to")
+        if self.shared:
+            self.attached_to = set(self.attached_to or ())
         self.path = extra.get("path")
+        self.base = extra.get("base")
+        self.variant = extra.get("variant") or "Standard"
+        self.nonrotational = bool(extra.get("nonrotational"))
+        self.discard = bool(extra.get("discard"))
+        self.hostiocache = extra.get("hostiocache")
+
+    @property
+    def shared(self):
+        """Whether this volume may be attached to several nodes at once.
+
+        """
+        return self.MTYPES[self.mtype]
+
+    @property
+    def attached_nodes(self):
+        """Names of the nodes this volume is attached to.
+
+        :rtype: ``set`` of ``str``
+
+        """
+        if self.shared:
+            return set(self.attached_to)
+        return set(filter(None, [self.attached_to]))
 
     @classmethod
     def from_dict(cls, **params):
@@ -420,16 +602,37 @@ class VagrantVolume(base.StorageVolume, Serializable):
                    extra={
                        "attached_to": params["attached_to"],
                        "path": params["path"],
+                       "base": params.get("base"),
+                       "mtype": params.get("mtype"),
+                       "variant": params.get("variant"),
+                       "nonrotational": params.get("nonrotational"),
+                       "discard": params.get("discard"),
+                       "hostiocache": params.get("hostiocache"),
                    },
                    driver=params["driver"],)
 
     def to_dict(self):
-        return {
+        ret = {
             "name": self.name,
             "size": self.size,
             "attached_to": self.attached_to,
             "path": self.path,
         }
+        if self.shared:
+            ret["attached_to"] = sorted(self.attached_to)
+        if self.base is not None:
+            ret["base"] = self.base
+        if self.mtype != "normal":
+            ret["mtype"] = self.mtype
+        if self.variant != "Standard":
+            ret["variant"] = self.variant
+        if self.nonrotational:
+            ret["nonrotational"] = True
+        if self.discard:
+            ret["discard"] = True
+        if self.hostiocache is not None:
+            ret["hostiocache"] = self.hostiocache
+        return ret
 
     def __repr__(self):
         fields = ("%s=%s" % (k, v) for (k, v) in self.to_dict().items())
@@ -33,10 +33,13 @@ from libcloud.compute import providers
 
 from libcloudvagrant import VAGRANT
 
+from libcloudvagrant.common import virtualbox
+
 from libcloudvagrant.tests import sample_network, sample_node, sample_volume
 
 
 __all__ = [
+    "backend",
     "driver",
     "network",
     "node",
@@ -50,6 +53,21 @@ logging.basicConfig(level=logging.DEBUG,
                     format="%(asctime)s %(name)s %(message)s")
 
 
+@pytest.yield_fixture(scope="function")
+def backend():
+    """Return an in-memory VirtualBox backend, used by the module-level
+    functions of :mod:`libcloudvagrant.common.virtualbox` during the test.
+
+    """
+    b = virtualbox.MemoryBackend()
+    previous = virtualbox.get_backend()
+    virtualbox.set_backend(b)
+    try:
+        yield b
+    finally:
+        virtualbox.set_backend(previous)
+
+
 @pytest.yield_fixture(scope="session")
 def driver(request):
     """Return a new driver instance, backed by a temporary directory. This
@@ -0,0 +1,126 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the admission control of nodes."""
+
+import os
+
+from pytest import raises
+
+from libcloud.common.types import LibcloudError
+
+from libcloudvagrant.common import admission
+from libcloudvagrant.compute.types import VagrantImage, VagrantNodeSize
+
+
+__all__ = [
+    "test_box_resources",
+    "test_create_node",
+    "test_shortfall",
+]
+
+
+OVF = """<VirtualSystem>
+  <Hardware>
+    <CPU count="%d"/>
+    <Memory RAMSize="%d"/>
+  </Hardware>
+</VirtualSystem>
+"""
+
+
+class Node(object):
+
+    def __init__(self, size, image):
+        self.size = size
+        self.image = image
+
+
+def add_box(home, name, version, cpus, ram):
+    dname = os.path.join(home, "boxes", name.replace("/", "-VAGRANTSLASH-"),
+                         version, "virtualbox")
+    os.makedirs(dname)
+    with open(os.path.join(dname, "box.ovf"), "w") as f:
+        f.write(OVF % (cpus, ram))
+
+
+def test_box_resources(tmpdir, monkeypatch):
+    """Nodes whose sizes leave memory or CPUs unset take those of the latest
+    version of their boxes.
+
+    """
+    home = tmpdir.strpath
+    monkeypatch.setenv("VAGRANT_HOME", home)
+    monkeypatch.setattr(admission, "_boxes", {})
+    add_box(home, "test/box", "1.9.0", 1, 1024)
+    add_box(home, "test/box", "1.10.0", 2, 768)
+
+    image = VagrantImage(name="test/box", driver=None)
+    default = VagrantNodeSize.from_dict(name="default", ram=0, cpus=1,
+                                        driver=None)
+    large = VagrantNodeSize.from_dict(name="large", ram=4096, cpus=4,
+                                      driver=None)
+    assert admission.box_resources("test/box") == (768, 2)
+    assert admission.requirements(default, image) == (768, 1)
+    assert admission.requirements(large, image) == (4096, 4)
+    assert (admission.box_resources("missing/box") ==
+            (admission.DEFAULT_RAM, admission.DEFAULT_CPUS))
+
+
+def test_shortfall(monkeypatch):
+    """Nodes fit in the host as long as they don't take more memory or CPUs
+    than it has left.
+
+    """
+    monkeypatch.setattr(admission, "HOST_RAM", 4096)
+    monkeypatch.setattr(admission, "HOST_CPUS", 0)
+    image = VagrantImage(name="test/box", driver=None)
+    size = VagrantNodeSize.from_dict(name="medium", ram=2048, cpus=2,
+                                     driver=None)
+    nodes = [Node(size, image)]
+    assert admission.shortfall(nodes, size, image) is None
+    assert admission.usage(nodes + nodes) == {
+        "ram": {"capacity": 4096, "committed": 4096},
+        "cpus": {"capacity": 0, "committed": 4},
+    }
+    assert (admission.shortfall(nodes + nodes, size, image) ==
+            "2048 MB of memory needed, 0 of 4096 available")
+
+    monkeypatch.setattr(admission, "HOST_CPUS", 3)
+    assert (admission.shortfall(nodes, size, image) ==
+            "2 CPUs needed, 1 of 3 available")
+
+
+def test_create_node(driver, monkeypatch):
+    """Nodes which don't fit in the host are not created.
+
+    """
+    monkeypatch.setattr(admission, "HOST_RAM", 1)
+    resources = driver.ex_host_resources()
+    assert resources["ram"]["capacity"] == 1
+
+    n_nodes = len(driver.list_nodes())
+    with raises(LibcloudError) as exc:
+        driver.create_node(name="too-large",
+                           size=driver.list_sizes()[1],
+                           image=driver.get_image("hashicorp/precise64"))
+    assert exc.value.value.startswith("Not enough host resources for node "
+                                      "'too-large': 1024 MB of memory needed")
+    assert len(driver.list_nodes()) == n_nodes
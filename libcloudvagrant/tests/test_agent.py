@@ -0,0 +1,194 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the agent."""
+
+import threading
+
+import pytest
+
+from libcloud.common.types import InvalidCredsError, LibcloudError
+from libcloud.compute import providers
+from libcloud.compute.types import DeploymentError
+
+from libcloudvagrant import VAGRANT
+from libcloudvagrant.common import agent
+from libcloudvagrant.compute.types import VagrantNode, VagrantNodeSize
+from libcloudvagrant.compute.types import VagrantVolume
+from libcloudvagrant.tests import sample_node
+
+
+__all__ = [
+    "test_driver_arguments",
+    "test_errors",
+    "test_forwarding",
+    "test_marshal",
+]
+
+
+class CustomError(Exception):
+    pass
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.calls = []
+
+    @agent.forwarded
+    def create_volume(self, size, name):
+        self.calls.append(("create_volume", size, name))
+        if size < 0:
+            raise LibcloudError("Invalid size")
+        return VagrantVolume(name=name, size=size, driver=self,
+                             extra={"path": "/tmp/%s.vdi" % (name,)})
+
+    @agent.forwarded
+    def attach(self, volume, callback):
+        self.calls.append(("attach", volume.name))
+        callback()
+
+    @agent.forwarded
+    def fail(self, kind):
+        if kind == "value":
+            raise ValueError("Bad value", 42)
+        elif kind == "creds":
+            raise InvalidCredsError("Bad credentials", driver=self)
+        elif kind == "deployment":
+            node = VagrantNode.from_dict(
+                id="1234", name="n0", public_ips=[], private_ips=[],
+                size={"name": "small", "ram": 512, "cpus": 1},
+                image={"name": "box"}, driver=self)
+            raise DeploymentError(node, ValueError("Script failed"),
+                                  driver=self)
+        raise CustomError("Unknown kind")
+
+
+def test_marshal():
+    """Driver objects are sent as their dict representations.
+
+    """
+    driver = FakeDriver()
+    size = VagrantNodeSize(name="small", ram=512, driver=driver)
+    obj = {"sizes": [size], "n": 1, "name": "x", "flag": None}
+    copy = agent.unmarshal(agent.marshal(obj), driver)
+    assert copy == obj
+    assert copy["sizes"][0].driver is driver
+    with pytest.raises(TypeError):
+        agent.marshal(lambda: None)
+
+
+def test_forwarding(tmpdir, monkeypatch):
+    """Calls are forwarded to the agent when it's running, unless they can't
+    be sent over the socket.
+
+    """
+    path = tmpdir.join("agent.sock").strpath
+    monkeypatch.setenv("LIBCLOUD_VAGRANT_AGENT", path)
+    local, remote = FakeDriver(), FakeDriver()
+
+    v = local.create_volume(1, "v0")
+    assert local.calls == [("create_volume", 1, "v0")]
+
+    server = agent.Agent(remote, path)
+    t = threading.Thread(target=server.serve)
+    t.daemon = True
+    t.start()
+    try:
+        v = local.create_volume(2, name="v1")
+        assert v.name == "v1" and v.path == "/tmp/v1.vdi"
+        assert v.driver is local
+        assert remote.calls == [("create_volume", 2, "v1")]
+        with pytest.raises(LibcloudError):
+            local.create_volume(-1, "v2")
+
+        local.attach(v, lambda: None)
+        assert local.calls[-1] == ("attach", "v1")
+    finally:
+        server.shutdown()
+        t.join()
+
+
+def test_errors(tmpdir, monkeypatch):
+    """Errors raised by the agent keep their types.
+
+    """
+    path = tmpdir.join("agent.sock").strpath
+    monkeypatch.setenv("LIBCLOUD_VAGRANT_AGENT", path)
+    local, remote = FakeDriver(), FakeDriver()
+
+    server = agent.Agent(remote, path)
+    t = threading.Thread(target=server.serve)
+    t.daemon = True
+    t.start()
+    try:
+        with pytest.raises(ValueError) as exc_info:
+            local.fail("value")
+        assert exc_info.value.args == ("Bad value", 42)
+
+        with pytest.raises(InvalidCredsError) as exc_info:
+            local.fail("creds")
+        assert exc_info.value.value == "Bad credentials"
+        assert exc_info.value.http_code == 401
+        assert exc_info.value.driver is local
+
+        with pytest.raises(DeploymentError) as exc_info:
+            local.fail("deployment")
+        assert exc_info.value.node.id == "1234"
+        assert exc_info.value.node.driver is local
+        assert exc_info.value.value == "Script failed"
+
+        with pytest.raises(LibcloudError) as exc_info:
+            local.fail("custom")
+        assert exc_info.type is LibcloudError
+        assert exc_info.value.value == "Unknown kind"
+    finally:
+        server.shutdown()
+        t.join()
+
+
+def test_driver_arguments(driver, volume, tmpdir, monkeypatch):
+    """Changes which the agent makes to the arguments of driver methods are
+    seen by callers.
+
+    """
+    path = tmpdir.join("agent.sock").strpath
+    monkeypatch.setenv("LIBCLOUD_VAGRANT_AGENT", path)
+    remote = providers.get_driver(VAGRANT)()
+    remote._home = driver._home
+
+    server = agent.Agent(remote, path)
+    t = threading.Thread(target=server.serve)
+    t.daemon = True
+    t.start()
+    try:
+        with sample_node(driver) as node:
+            assert driver.attach_volume(node, volume)
+            assert volume.attached_to == node.name
+            assert driver.detach_volume(volume)
+            assert volume.attached_to is None
+            assert [v.attached_to for v in driver.list_volumes()
+                    if v.name == volume.name] == [None]
+
+            assert driver.ex_set_node_limits(node, cpu_execution_cap=50)
+            assert node.size.extra["cpu_execution_cap"] == 50
+    finally:
+        server.shutdown()
+        t.join()
@@ -0,0 +1,55 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Regression runs of the benchmarks."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+__all__ = [
+    "test_driver_benchmark",
+]
+
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "..",
+                          "benchmarks")
+
+
+@pytest.mark.skipif(not os.access(BENCHMARKS, os.F_OK),
+                    reason="benchmarks not available")
+def test_driver_benchmark(tmpdir):
+    """The driver benchmark runs to completion, however small the host
+    capacity set in the environment is.
+
+    """
+    env = dict(os.environ,
+               LIBCLOUD_VAGRANT_HOST_RAM="1",
+               LIBCLOUD_VAGRANT_HOST_CPUS="1")
+    fname = tmpdir.join("results.json").strpath
+    subprocess.check_call([sys.executable,
+                           os.path.join(BENCHMARKS, "driver.py"),
+                           "--sizes", "1,10",
+                           "--json", fname],
+                          env=env)
+    assert os.access(fname, os.F_OK)
@@ -22,13 +22,21 @@
 
 import os
 import json
+import subprocess
+import sys
 
 from libcloudvagrant.common.catalogue import VagrantCatalogue
 
 
 __all__ = [
+    "test_cached_objects",
     "test_catalogue_files",
+    "test_changed_by_other_processes",
+    "test_linked_clones",
+    "test_node_pools",
     "test_objects",
+    "test_same_status",
+    "test_tuned_sizes",
 ]
 
 
@@ -70,6 +78,7 @@ SAMPLE_CATALOGUE = {
                 "name": "ubuntu/trusty64",
             },
             "allocate_sata_ports": 30,
+            "linked_clone": False,
         },
     },
     "networks": {
@@ -120,3 +129,212 @@ def test_objects(tmpdir, driver):
                 [n.to_dict() for n in c.get_nodes()])
         assert (SAMPLE_CATALOGUE["volumes"].values() ==
                 [v.to_dict() for v in c.get_volumes()])
+
+
+def test_cached_objects(tmpdir, driver):
+    """Catalogues changed by other processes are read again.
+
+    """
+    dname = tmpdir.strpath
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(SAMPLE_CATALOGUE, f)
+
+    with VagrantCatalogue(dname, driver) as c:
+        assert len(c.get_volumes()) == 2
+        c.remove_volume(c.get_volumes()[0])
+
+    with VagrantCatalogue(dname, driver) as c:
+        assert len(c.get_volumes()) == 1
+
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(dict(SAMPLE_CATALOGUE, volumes={}), f)
+
+    with VagrantCatalogue(dname, driver) as c:
+        assert c.get_volumes() == []
+
+
+def test_same_status(tmpdir, driver):
+    """Catalogues changed by other processes are read again, even if their
+    inode, size and modification time stay the same.
+
+    """
+    dname = tmpdir.strpath
+    fname = os.path.join(dname, "catalogue.json")
+    with open(fname, "w") as f:
+        json.dump(SAMPLE_CATALOGUE, f)
+
+    os.utime(fname, (1000000000, 1000000000))
+    with VagrantCatalogue(dname, driver) as c:
+        assert c.find_network("pub").to_dict()["allocated"] == ["10.0.0.1"]
+
+    st = os.stat(fname)
+    with open(fname, "r+") as f:
+        data = f.read().replace('"10.0.0.1"]', '"10.0.0.9"]')
+        f.seek(0)
+        f.write(data)
+    os.utime(fname, (1000000000, 1000000000))
+    new_st = os.stat(fname)
+    assert ((new_st.st_ino, new_st.st_size, new_st.st_mtime) ==
+            (st.st_ino, st.st_size, st.st_mtime))
+
+    with VagrantCatalogue(dname, driver) as c:
+        assert c.find_network("pub").to_dict()["allocated"] == ["10.0.0.9"]
+
+
+def test_changed_by_other_processes(tmpdir, driver):
+    """Catalogues are replaced when saved, so that readers never see them
+    half-written, and changes by other processes which keep their size are
+    not missed.
+
+    """
+    dname = tmpdir.strpath
+    fname = os.path.join(dname, "catalogue.json")
+    with open(fname, "w") as f:
+        json.dump(SAMPLE_CATALOGUE, f)
+
+    with VagrantCatalogue(dname, driver) as c:
+        c._save_needed = True
+    ino = os.stat(fname).st_ino
+    with VagrantCatalogue(dname, driver) as c:
+        assert c.find_network("pub").to_dict()["allocated"] == ["10.0.0.1"]
+
+    code = """if True:
+        from libcloudvagrant.common.catalogue import VagrantCatalogue
+        from libcloudvagrant.compute.driver import VagrantDriver
+        with VagrantCatalogue(%r, VagrantDriver()) as c:
+            c._networks["pub"]["allocated"] = ["10.0.0.2"]
+            c._save_needed = True
+    """ % (dname,)
+    subprocess.check_call([sys.executable, "-c", code])
+    assert os.stat(fname).st_ino != ino
+    assert sorted(os.listdir(dname)) == ["Vagrantfile", "catalogue.json"]
+
+    with VagrantCatalogue(dname, driver) as c:
+        assert c.find_network("pub").to_dict()["allocated"] == ["10.0.0.2"]
+
+
+def test_linked_clones(tmpdir, driver):
+    """Linked clones are requested in the ``Vagrantfile`` only for the nodes
+    which are linked clones.
+
+    """
+    dname = tmpdir.strpath
+    catalogue = dict(SAMPLE_CATALOGUE)
+    catalogue["nodes"] = dict(catalogue["nodes"])
+    catalogue["nodes"]["clone"] = dict(catalogue["nodes"]["nginx"],
+                                       name="clone",
+                                       linked_clone=True,
+                                       public_ips=[],
+                                       private_ips=[])
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(catalogue, f)
+
+    with VagrantCatalogue(dname, driver) as c:
+        c._save_needed = True
+
+    with open(os.path.join(dname, "Vagrantfile")) as f:
+        vagrantfile = f.read()
+    assert vagrantfile.count("vb.linked_clone = true") == 1
+    clone = vagrantfile.index('config.vm.define "clone"')
+    assert vagrantfile.index("vb.linked_clone = true") > clone
+
+
+def test_tuned_sizes(tmpdir, driver):
+    """The virtual hardware settings of sizes are requested in the
+    ``Vagrantfile`` only for the nodes having them.
+
+    """
+    sizes = driver.list_sizes()
+    assert sizes[0].name == "default"
+    assert len(set(s.name for s in sizes)) == len(sizes)
+
+    dname = tmpdir.strpath
+    catalogue = dict(SAMPLE_CATALOGUE)
+    catalogue["nodes"] = dict(catalogue["nodes"])
+    catalogue["nodes"]["tuned"] = dict(catalogue["nodes"]["nginx"],
+                                       name="tuned",
+                                       size=dict(catalogue["nodes"]["nginx"]
+                                                 ["size"],
+                                                 name="tuned",
+                                                 chipset="ich9",
+                                                 nested_paging=True,
+                                                 vtx_vpid=False,
+                                                 nic_type="virtio"))
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(catalogue, f)
+
+    with VagrantCatalogue(dname, driver) as c:
+        c._save_needed = True
+
+    with open(os.path.join(dname, "Vagrantfile")) as f:
+        vagrantfile = f.read()
+    tuned = vagrantfile.index('config.vm.define "tuned"')
+    for option in ('"--chipset", "ich9"',
+                   '"--nestedpaging", "on"',
+                   '"--vtxvpid", "off"',
+                   '"--nictype3", "virtio"'):
+        assert vagrantfile.count(option) == 1
+        assert vagrantfile.index(option) > tuned
+    for option in ("--paravirtprovider", "--ioapic", "--largepages",
+                   "--nictype4", "--nicpromisc"):
+        assert option not in vagrantfile
+
+    catalogue["networks"] = dict(catalogue["networks"])
+    catalogue["networks"]["priv"] = dict(catalogue["networks"]["priv"],
+                                         nic_type="82545EM",
+                                         promiscuous="allow-vms")
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(catalogue, f)
+
+    with VagrantCatalogue(dname, driver) as c:
+        c._save_needed = True
+
+    with open(os.path.join(dname, "Vagrantfile")) as f:
+        vagrantfile = f.read()
+    tuned = vagrantfile.index('config.vm.define "tuned"')
+    for option in ('"--nictype2", "virtio"',
+                   '"--nictype3", "82545EM"',
+                   '"--nicpromisc3", "allow-vms"'):
+        assert vagrantfile.index(option, tuned)
+    assert vagrantfile.count('"--nicpromisc3", "allow-vms"') == 2
+
+
+def test_node_pools(tmpdir, driver):
+    """Nodes in node pools are not listed, and keep their Vagrant machine
+    when renamed out of the pool.
+
+    """
+    dname = tmpdir.strpath
+    catalogue = dict(SAMPLE_CATALOGUE)
+    catalogue["nodes"] = dict(catalogue["nodes"])
+    catalogue["nodes"]["pool-1"] = dict(catalogue["nodes"]["nginx"],
+                                        name="pool-1",
+                                        public_ips=[],
+                                        private_ips=[])
+    catalogue["pools"] = {
+        "ubuntu/trusty64:default": {
+            "image": {"name": "ubuntu/trusty64"},
+            "size": catalogue["nodes"]["nginx"]["size"],
+            "count": 1,
+            "saved": False,
+            "nodes": ["pool-1"],
+        },
+    }
+    with open(os.path.join(dname, "catalogue.json"), "w") as f:
+        json.dump(catalogue, f)
+    machine = os.path.join(dname, ".vagrant", "machines", "pool-1")
+    os.makedirs(machine)
+
+    with VagrantCatalogue(dname, driver) as c:
+        assert [n.name for n in c.get_nodes()] == ["nginx"]
+        assert (sorted(n.name for n in c.get_nodes(pooled=True)) ==
+                ["nginx", "pool-1"])
+        node = c.get_node("pool-1")
+        c.remove_pool("ubuntu/trusty64:default")
+        c.rename_node(node, "web")
+        assert sorted(n.name for n in c.get_nodes()) == ["nginx", "web"]
+        assert c.get_pools() == {}
+
+    assert not os.access(machine, os.F_OK)
+    assert os.access(os.path.join(dname, ".vagrant", "machines", "web"),
+                     os.F_OK)
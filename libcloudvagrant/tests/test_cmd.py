@@ -0,0 +1,46 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the command-line tool."""
+
+import sys
+
+import pytest
+
+from libcloudvagrant.common import cmd
+
+
+__all__ = [
+    "test_wrong_arguments",
+]
+
+
+def test_wrong_arguments(monkeypatch, capsys):
+    """Commands given a wrong number of arguments fail with a usage error.
+
+    """
+    for argv in (["apply"], ["apply", "a.yaml", "4", "extra"],
+                 ["destroy", "extra"]):
+        monkeypatch.setattr(sys, "argv", ["libcloud-vagrant"] + argv)
+        with pytest.raises(SystemExit) as exc_info:
+            cmd.main()
+        assert exc_info.value.code == 2
+        assert ("wrong number of arguments for %s" % (argv[0],) in
+                capsys.readouterr()[1])
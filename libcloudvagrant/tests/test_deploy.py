@@ -24,17 +24,88 @@ import uuid
 
 from contextlib import contextmanager
 
-from libcloud.compute.deployment import ScriptDeployment
+from libcloud.compute.deployment import (
+    Deployment,
+    MultiStepDeployment,
+    ScriptDeployment,
+)
+from libcloud.compute.types import DeploymentError
+
+from libcloudvagrant.compute.driver import hash_deployment
 
 
 __all__ = [
+    "test_deploy_nodes",
+    "test_deployment_hash",
     "test_deploy_without_network",
     "test_http_proxy",
+    "test_reuse_image",
     "test_with_private_network",
     "test_with_public_network",
 ]
 
 
+def test_deploy_nodes(driver, private_network):
+    """Several nodes may be deployed in parallel, and failures are reported
+    separately for each node.
+
+    """
+    script = ScriptDeployment("""#!/bin/sh
+
+    echo "Hello from $(hostname)"
+    """)
+    names = [uuid.uuid4().hex for _ in range(3)]
+    deployments = [script, script, FailingDeployment()]
+    image = driver.get_image("hashicorp/precise64")
+    size = driver.list_sizes()[0]
+    results = driver.ex_deploy_nodes([{"name": name,
+                                       "image": image,
+                                       "size": size,
+                                       "ex_networks": [private_network],
+                                       "deploy": deploy,
+                                       "max_tries": 1}
+                                      for (name, deploy) in zip(names,
+                                                                deployments)],
+                                     max_parallel=3)
+    try:
+        assert len(results) == 3
+        for name, node in zip(names[:2], results[:2]):
+            assert node.name == name
+            deployment = node.extra["deployment"]
+            assert deployment.exit_status == 0, deployment.stderr
+            assert ("Hello from %s" % (name,)) in deployment.stdout
+        assert results[0].extra["deployment"] is script
+        assert results[1].extra["deployment"] is not script
+
+        assert isinstance(results[2], DeploymentError)
+        assert results[2].node.name == names[2]
+
+        addresses = set(ip for node in results[:2] for ip in node.private_ips)
+        assert len(addresses) == 2
+    finally:
+        for r in results:
+            node = isinstance(r, DeploymentError) and r.node or r
+            driver.destroy_node(node)
+
+
+def test_deployment_hash():
+    """Deployments which do the same have the same hash, whatever their
+    results.
+
+    """
+    script = ScriptDeployment("apt-get update")
+    assert (hash_deployment(script) ==
+            hash_deployment(ScriptDeployment("apt-get update",
+                                             name="update.sh")))
+    script.stdout, script.exit_status = "Done", 0
+    assert (hash_deployment(script) ==
+            hash_deployment(ScriptDeployment("apt-get update")))
+    assert (hash_deployment(script) !=
+            hash_deployment(ScriptDeployment("apt-get update", ["-q"])))
+    assert (hash_deployment(script) !=
+            hash_deployment(MultiStepDeployment([script])))
+
+
 def test_deploy_without_network(driver):
     """Deployment works for nodes without networks.
 
@@ -55,6 +126,40 @@ def test_http_proxy(driver):
         assert ("you could prototype a small cluster" in result)
 
 
+def test_reuse_image(driver):
+    """Nodes deployed with ``ex_reuse_image`` boot from an image baked from
+    a node with the same deployment.
+
+    """
+    script = """#!/bin/sh
+
+    touch /home/vagrant/baked
+    """
+    image = driver.get_image("hashicorp/precise64")
+    size = driver.list_sizes()[0]
+    node = driver.deploy_node(name=uuid.uuid4().hex, image=image, size=size,
+                              deploy=ScriptDeployment(script))
+    try:
+        baked = driver.ex_create_image(node, uuid.uuid4().hex)
+    finally:
+        driver.destroy_node(node)
+
+    try:
+        assert baked.name in [i.name for i in driver.list_images()]
+        node = driver.deploy_node(name=uuid.uuid4().hex, image=image,
+                                  size=size, deploy=ScriptDeployment(script),
+                                  ex_reuse_image=True)
+        try:
+            assert node.image.name == baked.name
+            with node.ex_ssh_client as client:
+                _, _, status = client.run("test -f /home/vagrant/baked")
+                assert status == 0
+        finally:
+            driver.destroy_node(node)
+    finally:
+        driver.delete_image(baked)
+
+
 def test_with_private_network(driver, private_network):
     """Deployment works for nodes with private networks.
 
@@ -71,6 +176,12 @@ def test_with_public_network(driver, public_network):
         pass
 
 
+class FailingDeployment(Deployment):
+
+    def run(self, node, client):
+        raise Exception("Deployment failed on purpose")
+
+
 @contextmanager
 def deploy_node(driver, networks=None, script=None):
     script = script or """#!/bin/sh
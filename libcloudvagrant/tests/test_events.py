@@ -0,0 +1,71 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the parser of Vagrant's machine-readable output."""
+
+from libcloudvagrant.common import events
+
+
+__all__ = [
+    "test_parse",
+    "test_phase",
+]
+
+
+SAMPLE_OUTPUT = """1410000000,,box-name,hashicorp/precise64
+1410000000,,box-provider,virtualbox
+Some unstructured text
+1410000001,node1,ui,info,==> node1: Importing base box 'hashicorp/precise64'...
+1410000002,node1,ui,output,Hello%!(VAGRANT_COMMA) world\\nBye
+"""
+
+
+def test_parse():
+    """Machine-readable lines are converted to events, and all other lines
+    are skipped.
+
+    """
+    parsed = list(events.parse(SAMPLE_OUTPUT.splitlines()))
+    assert len(parsed) == 4
+    assert parsed[0] == events.VagrantEvent(timestamp=1410000000,
+                                            target=None,
+                                            type="box-name",
+                                            data=("hashicorp/precise64",))
+    assert parsed[2].target == "node1"
+    assert parsed[2].type == "ui"
+    assert parsed[3].data == ("output", "Hello, world\nBye")
+
+
+def test_phase():
+    """Boot phases are recognised from ``ui`` events.
+
+    """
+    def ui(message):
+        return events.VagrantEvent(1410000000, "node1", "ui",
+                                   ("info", message))
+
+    assert events.phase(ui("==> node1: Importing base box 'x'...")) == \
+        "import"
+    assert events.phase(ui("==> node1: Booting VM...")) == "boot"
+    assert events.phase(ui("==> node1: Machine booted and ready!")) == \
+        "ssh-ready"
+    assert events.phase(ui("==> node1: Forwarding ports...")) is None
+    assert events.phase(events.VagrantEvent(1410000000, None, "box-name",
+                                            ("Booting VM",))) is None
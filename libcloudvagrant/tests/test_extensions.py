@@ -20,14 +20,80 @@
 
 """Unit tests for Vagrant-specific extensions."""
 
-from libcloudvagrant.tests import sample_node
+import uuid
+
+import pytest
+
+from libcloud.common.types import LibcloudError
+
+from libcloudvagrant.compute.driver import pool_key
+from libcloudvagrant.compute.types import VagrantNodeSize
+from libcloudvagrant.tests import sample_network, sample_node, sample_volume
 
 
 __all__ = [
+    "test_failed_pool_claim",
+    "test_node_limits",
     "test_num_cpus",
+    "test_pool_sizes",
 ]
 
 
+def test_failed_pool_claim(driver, monkeypatch):
+    """Pooled nodes which cannot be rebooted when claimed are discarded,
+    releasing their addresses.
+
+    """
+    image = driver.get_image("hashicorp/precise64")
+    size = driver.list_sizes()[0]
+    vagrant = driver._vagrant
+
+    def failing_vagrant(*args, **kwargs):
+        if args[0].startswith("reload"):
+            raise LibcloudError("Reload failed", driver=driver)
+        return vagrant(*args, **kwargs)
+
+    pool = driver.ex_create_pool(image, size, 1)
+    try:
+        with sample_network(driver, public=True) as network:
+            monkeypatch.setattr(driver, "_vagrant", failing_vagrant)
+            monkeypatch.setattr(driver, "_spawn_pool_refill", lambda: None)
+            n_nodes = len(driver.list_nodes())
+            with pytest.raises(LibcloudError) as exc:
+                driver.create_node(name=uuid.uuid4().hex, size=size,
+                                   image=image, ex_networks=[network])
+            assert exc.value.value == "Reload failed"
+            monkeypatch.undo()
+
+            assert len(driver.list_nodes()) == n_nodes
+            assert [p["nodes"] for p in driver.ex_list_pools()
+                    if p["key"] == pool["key"]] == [[]]
+            network, = [n for n in driver.ex_list_networks()
+                        if n.name == network.name]
+            assert network.allocated == []
+    finally:
+        assert driver.ex_destroy_pool(pool["key"])
+
+
+def test_node_limits(driver):
+    """Nodes are created with the resource limits of their sizes, which may
+    be changed while they run.
+
+    """
+    size = driver.list_sizes()[0]
+    size.extra.update(cpu_execution_cap=50, disk_bandwidth=20)
+    with sample_node(driver, size=size) as node, \
+            sample_volume(driver) as volume:
+        assert driver.ex_set_node_limits(node, cpu_execution_cap=80,
+                                         disk_bandwidth=40)
+        assert node.size.extra["cpu_execution_cap"] == 80
+        assert [n.size.extra["disk_bandwidth"] for n in driver.list_nodes()
+                if n.name == node.name] == [40]
+        assert driver.attach_volume(node, volume)
+        with pytest.raises(LibcloudError):
+            driver.ex_set_node_limits(node, network_bandwidth=10)
+
+
 def test_num_cpus(driver):
     """The Vagrant driver honours the number of CPUs expressed in the nodes'
     size objects.
@@ -50,3 +116,27 @@ def num_cpus(node):
         if rc:
             raise Exception(stderr)
         return int(stdout.strip())
+
+
+def test_pool_sizes(driver):
+    """Pooled nodes are only claimed for nodes of the same size, not just of
+    a size of the same name.
+
+    """
+    image = driver.get_image("hashicorp/precise64")
+    size = driver.list_sizes()[0]
+    bigger = VagrantNodeSize.from_dict(driver=driver,
+                                       **dict(size.to_dict(), ram=256))
+    assert pool_key(image, size) == pool_key(image, driver.list_sizes()[0])
+    assert pool_key(image, size) != pool_key(image, bigger)
+
+    pool = driver.ex_create_pool(image, size, 1)
+    try:
+        pooled = set(pool["nodes"])
+        with sample_node(driver, size=bigger) as node:
+            assert node.name not in pooled
+            assert node.size.ram == 256
+            assert [p["nodes"] for p in driver.ex_list_pools()
+                    if p["key"] == pool["key"]] == [list(pooled)]
+    finally:
+        assert driver.ex_destroy_pool(pool["key"])
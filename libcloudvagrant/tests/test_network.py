@@ -39,6 +39,7 @@ __all__ = [
     "test_exhausted_networks",
     "test_host_interface_cleanup",
     "test_list_networks",
+    "test_nic_settings",
     "test_overlapping_networks",
     "test_public_and_private_networks",
 ]
@@ -135,6 +136,32 @@ def test_list_networks(driver):
     assert len(driver.ex_list_networks()) == n_networks
 
 
+def test_nic_settings(driver):
+    """Networks may have network adapter settings, which may be changed by
+    creating them again.
+
+    """
+    cidr = available_network()
+    with raises(LibcloudError) as exc:
+        driver.ex_create_network(name="net1", cidr=cidr, nic_type="e1000")
+    assert exc.value.value == "Unknown network adapter type 'e1000'"
+    with raises(LibcloudError) as exc:
+        driver.ex_create_network(name="net1", cidr=cidr, promiscuous="on")
+    assert exc.value.value == "Unknown promiscuous mode 'on'"
+
+    network = driver.ex_create_network(name="net1", cidr=cidr,
+                                       nic_type="virtio")
+    try:
+        driver.ex_create_network(name="net1", cidr=cidr,
+                                 promiscuous="allow-all")
+        network, = [n for n in driver.ex_list_networks()
+                    if n.name == "net1"]
+        assert network.nic_type is None
+        assert network.promiscuous == "allow-all"
+    finally:
+        assert driver.ex_destroy_network(network)
+
+
 def test_overlapping_networks(driver):
     """Overlapping networks are not supported.
 
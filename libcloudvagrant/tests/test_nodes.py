@@ -22,13 +22,18 @@
 
 import uuid
 
+from pytest import raises
+
+from libcloud.common.types import LibcloudError
 from libcloud.compute.types import NodeState
 
-from libcloudvagrant.tests import sample_node
+from libcloudvagrant.tests import sample_network, sample_node
 
 
 __all__ = [
     "test_create_node",
+    "test_create_node_progress",
+    "test_failed_boot",
     "test_node_state",
 ]
 
@@ -47,6 +52,63 @@ def test_create_node(driver):
             assert node.id == c.virtualbox_uuid(node)
 
 
+def test_create_node_progress(driver):
+    """Boot phases are reported while nodes are created and rebooted.
+
+    """
+    phases = []
+
+    def progress(phase, event):
+        assert event.target == node_name
+        phases.append(phase)
+
+    node_name = uuid.uuid4().hex
+    node = driver.create_node(name=node_name,
+                              size=driver.list_sizes()[0],
+                              image=driver.get_image("hashicorp/precise64"),
+                              ex_progress=progress)
+    try:
+        assert phases.index("import") < phases.index("boot")
+        assert phases[-1] == "ssh-ready"
+
+        del phases[:]
+        assert driver.reboot_node(node, ex_progress=progress)
+        assert phases[0] == "halt"
+        assert phases[-1] == "ssh-ready"
+    finally:
+        node.destroy()
+
+
+def test_failed_boot(driver, monkeypatch):
+    """Nodes which cannot be booted are not catalogued, and release their
+    addresses and machines.
+
+    """
+    vagrant = driver._vagrant
+
+    def failing_vagrant(*args, **kwargs):
+        ret = vagrant(*args, **kwargs)
+        if args[0].startswith("up"):
+            raise LibcloudError("Boot failed", driver=driver)
+        return ret
+
+    with sample_network(driver, public=True) as network:
+        monkeypatch.setattr(driver, "_vagrant", failing_vagrant)
+        n_nodes = len(driver.list_nodes())
+        with raises(LibcloudError) as exc:
+            driver.create_node(name=uuid.uuid4().hex,
+                               size=driver.list_sizes()[0],
+                               image=driver.get_image("hashicorp/precise64"),
+                               ex_networks=[network])
+        assert exc.value.value == "Boot failed"
+        monkeypatch.undo()
+
+        assert len(driver.list_nodes()) == n_nodes
+        network, = [n for n in driver.ex_list_networks()
+                    if n.name == network.name]
+        assert network.allocated == []
+
+
 def test_node_state(driver):
     """Node state reflects actual VirtualBox status.
 
@@ -0,0 +1,84 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the execution of external commands."""
+
+import logging
+
+from libcloudvagrant.common.process import Command, vagrant_log_level
+
+
+__all__ = [
+    "test_output_bytes",
+    "test_output_lines",
+    "test_tail",
+    "test_vagrant_log_level",
+]
+
+
+LOG = logging.getLogger("libcloudvagrant")
+
+
+def test_output_bytes():
+    """The size of the output of both streams is counted.
+
+    """
+    p = Command("seq 1 1000; seq 1 1000 >&2", LOG)
+    assert p.wait() == 0
+    assert p.output_bytes == 2 * len("".join("%d\n" % i
+                                             for i in range(1, 1001)))
+
+
+def test_output_lines():
+    """Output lines are returned as they are read, and the standard output
+    is only kept in full if captured.
+
+    """
+    p = Command("echo one; echo two >&2; echo three", LOG)
+    assert list(p) == ["one", "three"]
+    assert p.wait() == 0
+    assert p.stdout is None
+    assert "two" in p.tail
+
+    p = Command("echo one; echo two >&2; echo three", LOG, capture=True)
+    assert p.wait() == 0
+    assert p.stdout == "one\nthree\n"
+
+
+def test_tail():
+    """Only the last output lines are kept for error reports.
+
+    """
+    p = Command("seq 1 1000 >&2; exit 3", LOG, tail_size=10)
+    assert p.wait() == 3
+    assert list(p.tail) == [str(i) for i in range(991, 1001)]
+
+
+def test_vagrant_log_level():
+    """Vagrant's log level follows the level of our logger.
+
+    """
+    log = logging.getLogger("libcloudvagrant.tests.test_process")
+    for level, expected in ((logging.DEBUG, "debug"),
+                            (logging.INFO, "info"),
+                            (logging.WARNING, "warn"),
+                            (logging.ERROR, "error")):
+        log.setLevel(level)
+        assert vagrant_log_level(log) == expected
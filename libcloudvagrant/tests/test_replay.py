@@ -0,0 +1,90 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the recording and replay of commands."""
+
+import logging
+import os
+import time
+
+from libcloudvagrant.common import replay
+from libcloudvagrant.common.process import Command
+
+
+__all__ = [
+    "test_record_replay",
+    "test_replay_speed",
+]
+
+
+LOG = logging.getLogger("libcloudvagrant")
+
+
+def test_record_replay(tmpdir):
+    """Replayed commands produce their recorded output, exit status and side
+    effects, without being executed.
+
+    """
+    trace = tmpdir.join("trace.jsonl").strpath
+    cwd = tmpdir.mkdir("home").strpath
+    cmdline = ("mkdir -p .vagrant/machines/n1 && "
+               "echo uuid > .vagrant/machines/n1/id && "
+               "echo one; echo two >&2; echo three; exit 3")
+    try:
+        replay.record(trace)
+        assert Command(cmdline, LOG, cwd=cwd).wait() == 3
+        replay.reset()
+
+        os.unlink(os.path.join(cwd, ".vagrant/machines/n1/id"))
+        replay.replay(trace, speed=0)
+        p = Command(cmdline, LOG, cwd=cwd)
+        assert list(p) == ["one", "three"]
+        assert p.wait() == 3
+        assert "two" in p.tail
+        with open(os.path.join(cwd, ".vagrant/machines/n1/id")) as f:
+            assert f.read() == "uuid\n"
+
+        p = Command("echo not recorded", LOG, merge_stderr=True)
+        assert p.wait() == replay.NOT_FOUND
+        assert "not found" in "\n".join(p.tail)
+    finally:
+        replay.reset()
+
+
+def test_replay_speed(tmpdir):
+    """Replays follow the recorded timing, divided by the replay speed.
+
+    """
+    trace = tmpdir.join("trace.jsonl").strpath
+    cmdline = "sleep 0.4; echo done"
+    try:
+        replay.record(trace)
+        Command(cmdline, LOG).wait()
+        replay.reset()
+
+        for speed, min_time, max_time in ((1, 0.4, 1), (4, 0.1, 0.3)):
+            replay.replay(trace, speed=speed)
+            start = time.time()
+            p = Command(cmdline, LOG)
+            assert list(p) == ["done"]
+            p.wait()
+            assert min_time <= time.time() - start < max_time
+    finally:
+        replay.reset()
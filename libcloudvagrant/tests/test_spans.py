@@ -0,0 +1,134 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for timing spans."""
+
+import subprocess
+import sys
+import threading
+
+from libcloudvagrant.common import spans
+
+
+__all__ = [
+    "test_concurrent_export",
+    "test_export",
+    "test_nested_spans",
+    "test_other_threads",
+]
+
+
+def test_nested_spans():
+    """Spans opened within other spans are recorded as their children.
+
+    """
+    spans.enable()
+    try:
+        spans.reset()
+
+        @spans.traced
+        def create_node():
+            with spans.span("catalogue.enter"):
+                spans.add("vagrant up", 0, 1.5, status=0)
+
+        create_node()
+        recorded = dict((s["path"], s) for s in spans.spans())
+        assert sorted(recorded) == [
+            "create_node",
+            "create_node/catalogue.enter",
+            "create_node/catalogue.enter/vagrant up",
+        ]
+        assert recorded["create_node/catalogue.enter/vagrant up"]["args"] == \
+            {"status": 0}
+    finally:
+        spans.enable(False)
+
+
+def test_export(tmpdir):
+    """Spans are exported in Chrome trace format, and added to any spans
+    already in the file.
+
+    """
+    fname = tmpdir.join("profile.json").strpath
+    spans.enable()
+    try:
+        spans.reset()
+        for _ in range(2):
+            with spans.span("destroy_node"):
+                pass
+            spans.export(fname)
+    finally:
+        spans.enable(False)
+
+    events = spans.load(fname)
+    assert len(events) == 2
+    for e in events:
+        assert e["name"] == "destroy_node"
+        assert e["ph"] == "X"
+        assert e["args"]["path"] == "destroy_node"
+    assert spans.spans() == []
+
+
+def test_concurrent_export(tmpdir):
+    """Spans exported by several processes to the same file are all kept.
+
+    """
+    fname = tmpdir.join("profile.json").strpath
+    code = """if True:
+        from libcloudvagrant.common import spans
+        spans.enable()
+        for _ in range(20):
+            spans.add("create_node", 0, 1)
+            spans.export(%r)
+    """ % (fname,)
+    procs = [subprocess.Popen([sys.executable, "-c", code])
+             for _ in range(4)]
+    assert [p.wait() for p in procs] == [0] * 4
+    assert len(spans.load(fname)) == 80
+    assert tmpdir.listdir() == [tmpdir.join("profile.json")]
+
+
+def test_other_threads():
+    """Spans started by other threads within the path of a span are recorded
+    as its children.
+
+    """
+    spans.enable()
+    try:
+        spans.reset()
+
+        def worker(parent):
+            with spans.within(parent):
+                with spans.span("create_node"):
+                    pass
+            with spans.span("orphan"):
+                pass
+
+        with spans.span("ex_apply_topology"):
+            t = threading.Thread(target=worker, args=(spans.current(),))
+            t.start()
+            t.join()
+        assert sorted(s["path"] for s in spans.spans()) == [
+            "ex_apply_topology",
+            "ex_apply_topology/create_node",
+            "orphan",
+        ]
+    finally:
+        spans.enable(False)
@@ -0,0 +1,127 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the cache of node states."""
+
+import time
+
+from libcloud.compute.types import NodeState
+
+from libcloudvagrant.common import states, virtualbox
+
+
+__all__ = [
+    "test_event_driven_states",
+    "test_polled_states",
+    "test_stopped_reports",
+]
+
+
+class PolledBackend(virtualbox.MemoryBackend):
+
+    """A memory backend which doesn't report state changes."""
+
+    def __init__(self):
+        super(PolledBackend, self).__init__()
+        self.reads = 0
+
+    def get_node_state(self, node_uuid):
+        self.reads += 1
+        return super(PolledBackend, self).get_node_state(node_uuid)
+
+    def watch_node_states(self, callback, on_stop=None):
+        return False
+
+
+def with_backend(backend, fn):
+    previous = virtualbox.get_backend()
+    virtualbox.set_backend(backend)
+    try:
+        fn()
+    finally:
+        virtualbox.set_backend(previous)
+        states.invalidate()
+
+
+def test_event_driven_states():
+    """Reported state changes update the cache.
+
+    """
+    backend = virtualbox.MemoryBackend()
+    backend.add_machine("n1")
+
+    def check():
+        assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+        assert states.cached("n1") == NodeState.RUNNING
+        backend.set_node_state("n1", "poweroff")
+        assert states.cached("n1") == NodeState.STOPPED
+        assert virtualbox.get_node_state("n1") == NodeState.STOPPED
+
+    with_backend(backend, check)
+
+
+def test_polled_states(monkeypatch):
+    """Without state change reports, states are read again when their
+    time-to-live expires, or when they are invalidated.
+
+    """
+    monkeypatch.setattr(states, "TTL", 0.2)
+    backend = PolledBackend()
+    backend.add_machine("n1")
+
+    def check():
+        for _ in range(10):
+            assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+        assert backend.reads == 1
+
+        backend.set_node_state("n1", "poweroff")
+        assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+        time.sleep(0.2)
+        assert virtualbox.get_node_state("n1") == NodeState.STOPPED
+        assert backend.reads == 2
+
+        states.invalidate("n1")
+        assert states.cached("n1") is None
+        virtualbox.get_node_state("n1")
+        assert backend.reads == 3
+
+    with_backend(backend, check)
+
+
+def test_stopped_reports(monkeypatch):
+    """States are read again when their time-to-live expires once the
+    backend stops reporting state changes.
+
+    """
+    monkeypatch.setattr(states, "TTL", 0.2)
+    backend = virtualbox.MemoryBackend()
+    backend.add_machine("n1")
+
+    def check():
+        assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+        time.sleep(0.2)
+        assert states.cached("n1") == NodeState.RUNNING
+
+        backend.stop_watching()
+        assert states.cached("n1") is None
+        backend.set_node_state("n1", "poweroff")
+        assert virtualbox.get_node_state("n1") == NodeState.STOPPED
+
+    with_backend(backend, check)
@@ -0,0 +1,81 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the instrumentation of external commands."""
+
+import json
+
+from libcloudvagrant.common import stats
+
+
+__all__ = [
+    "test_operations",
+    "test_trace_file",
+]
+
+
+def test_operations():
+    """Commands are attributed to the outermost driver operation running
+    them.
+
+    """
+    stats.reset()
+
+    @stats.instrumented
+    def outer():
+        inner()
+
+    @stats.instrumented
+    def inner():
+        stats.record_command("vagrant up", "vagrant up n1", 0, 0.2, 0, 100)
+        stats.record_command("vagrant up", "vagrant up n2", 0, 20, 1, 50)
+
+    outer()
+    snapshot = stats.snapshot()
+    assert "inner" not in snapshot["operations"]
+    assert snapshot["operations"]["outer"]["calls"]["count"] == 1
+
+    up = snapshot["operations"]["outer"]["commands"]["vagrant up"]
+    assert up == snapshot["commands"]["vagrant up"]
+    assert up["count"] == 2
+    assert up["failures"] == 1
+    assert up["output_bytes"] == 150
+    assert up["max_time"] == 20
+    assert dict(up["histogram"])[0.5] == 1
+    assert dict(up["histogram"])[30] == 1
+
+    stats.reset()
+    assert stats.snapshot() == {"commands": {}, "operations": {}}
+
+
+def test_trace_file(tmpdir, monkeypatch):
+    """Commands are written to the trace file, if any.
+
+    """
+    trace = tmpdir.join("trace.jsonl").strpath
+    monkeypatch.setenv("LIBCLOUD_VAGRANT_TRACE", trace)
+    with stats.operation("create_node"):
+        stats.record_command("vagrant up", "vagrant up n1", 0, 1.5, 0, 10)
+    with open(trace) as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 1
+    assert entries[0]["operation"] == "create_node"
+    assert entries[0]["command"] == "vagrant up"
+    assert entries[0]["wall_time"] == 1.5
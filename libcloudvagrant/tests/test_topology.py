@@ -0,0 +1,210 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for topologies."""
+
+import json
+import os
+
+from pytest import raises
+
+from libcloud.common.types import LibcloudError
+
+from libcloudvagrant.common import topology
+from libcloudvagrant.compute.driver import hash_deployment
+from libcloudvagrant.tests import available_network
+
+
+__all__ = [
+    "test_apply_topology",
+    "test_load",
+    "test_normalize",
+    "test_waves",
+]
+
+
+def test_normalize():
+    """Topologies get their optional keys set, and invalid ones are
+    rejected.
+
+    """
+    spec = topology.normalize({
+        "networks": {"priv": {"cidr": "172.17.0.0/16"}},
+        "nodes": {"web": {"image": "hashicorp/precise64", "count": 2,
+                          "networks": ["priv"]}},
+    })
+    assert spec == {
+        "networks": {
+            "priv": {"cidr": "172.17.0.0/16", "public": False,
+                     "nic_type": None, "promiscuous": None},
+        },
+        "volumes": {},
+        "nodes": {
+            "web": {"image": "hashicorp/precise64", "size": "default",
+                    "count": 2, "networks": ["priv"], "volumes": [],
+                    "deploy": [], "depends_on": []},
+        },
+    }
+    assert topology.normalize(spec) == spec
+    assert topology.node_names("web", spec["nodes"]["web"]) == ["web-1",
+                                                                "web-2"]
+    assert topology.node_names("db", dict(spec["nodes"]["web"],
+                                          count=None)) == ["db"]
+    topology.normalize({
+        "volumes": {"data": {"size": 1, "type": "multiattach"}},
+        "nodes": {"n": {"image": "i", "count": 2, "volumes": ["data"]}},
+    })
+
+    for invalid, msg in (
+            ({"hosts": {}}, "Unknown topology keys: hosts"),
+            ({"volumes": {"v": {}}}, "No size given for volume 'v'"),
+            ({"nodes": {"n": {"image": "i", "ram": 1}}},
+             "Unknown keys in node 'n': ram"),
+            ({"nodes": {"n": {"image": "i", "networks": ["priv"]}}},
+             "Unknown network 'priv' in node group 'n'"),
+            ({"nodes": {"n": {"image": "i", "deploy": [{"target": "/"}]}}},
+             "Invalid deployment step in node group 'n': {'target': '/'}"),
+            ({"volumes": {"data": {"size": 1}},
+              "nodes": {"n": {"image": "i", "count": 2,
+                              "volumes": ["data"]}}},
+             "Volume 'data' of type normal cannot be attached to several "
+             "nodes: n-1, n-2"),
+            ({"volumes": {"data": {"size": 1, "type": "normal"}},
+              "nodes": {"m": {"image": "i", "volumes": ["data"]},
+                        "n": {"image": "i", "volumes": ["data"]}}},
+             "Volume 'data' of type normal cannot be attached to several "
+             "nodes: m, n")):
+        with raises(LibcloudError) as exc:
+            topology.normalize(invalid)
+        assert exc.value.value == msg
+
+
+def test_waves():
+    """Node groups are applied after the groups they depend on.
+
+    """
+    def groups(**deps):
+        return topology.normalize({
+            "nodes": dict((name, {"image": "i", "depends_on": d})
+                          for (name, d) in deps.items()),
+        })["nodes"]
+
+    assert topology.waves(groups(db=[], cache=[], web=["db", "cache"],
+                                 lb=["web"])) == [["cache", "db"], ["web"],
+                                                  ["lb"]]
+    with raises(LibcloudError) as exc:
+        topology.waves(groups(db=["web"], web=["db"], lb=[]))
+    assert (exc.value.value ==
+            "Circular dependencies between node groups db, web")
+    with raises(LibcloudError) as exc:
+        topology.waves(groups(web=["db"]))
+    assert exc.value.value == "Unknown node group 'db' in 'web'"
+
+
+def test_load(tmpdir):
+    """Topology files are read as JSON, and their deployment steps refer to
+    paths relative to them.
+
+    """
+    tmpdir.join("setup.sh").write("#!/bin/sh\necho setup\n")
+    fname = tmpdir.join("topology.json").strpath
+    with open(fname, "w") as f:
+        json.dump({
+            "nodes": {
+                "web": {
+                    "image": "hashicorp/precise64",
+                    "deploy": [
+                        {"script_file": "setup.sh", "args": ["-v"]},
+                        {"file": "setup.sh", "target": "/tmp/setup.sh"},
+                    ],
+                },
+            },
+        }, f)
+    spec = topology.load(fname)
+    steps = spec["nodes"]["web"]["deploy"]
+    assert steps[0]["script_file"] == os.path.join(tmpdir.strpath,
+                                                   "setup.sh")
+    assert steps[1]["file"] == steps[0]["script_file"]
+
+    task = topology.deployment(spec["nodes"]["web"])
+    assert task.steps[0].script == "#!/bin/sh\necho setup\n"
+    assert task.steps[0].args == ["-v"]
+    assert (hash_deployment(task) ==
+            hash_deployment(topology.deployment(spec["nodes"]["web"])))
+    assert topology.deployment(dict(spec["nodes"]["web"], deploy=[])) is None
+
+
+def test_apply_topology(driver, monkeypatch):
+    """Topologies are applied incrementally, and objects of previous
+    topologies are destroyed.
+
+    """
+    spec = {
+        "networks": {"topo": {"cidr": available_network()}},
+        "volumes": {"topo-data": {"size": 1}},
+        "nodes": {
+            "topo-db": {"image": "hashicorp/precise64",
+                        "networks": ["topo"], "volumes": ["topo-data"]},
+            "topo-web": {"image": "hashicorp/precise64", "count": 2,
+                         "networks": ["topo"], "depends_on": ["topo-db"]},
+        },
+    }
+    with raises(LibcloudError):
+        driver.ex_apply_topology(dict(spec, nodes={
+            "topo-db": {"image": "hashicorp/precise64", "size": "huge"},
+        }))
+
+    try:
+        report = driver.ex_apply_topology(spec)
+        assert report["created"] == ["topo", "topo-data", "topo-db",
+                                     "topo-web-1", "topo-web-2"]
+        assert report["failed"] == []
+        volume, = [v for v in driver.list_volumes()
+                   if v.name == "topo-data"]
+        assert volume.attached_nodes == set(["topo-db"])
+
+        report = driver.ex_apply_topology(spec)
+        assert not any(report.values())
+        assert [f for f in os.listdir(driver._dot_libcloudvagrant)
+                if f.startswith("topology.json")] == ["topology.json"]
+
+        spec["nodes"]["topo-web"]["count"] = 1
+        spec["nodes"]["topo-db"]["size"] = "small"
+        report = driver.ex_apply_topology(spec)
+        assert report["destroyed"] == ["topo-web-2"]
+        assert report["replaced"] == ["topo-db"]
+        assert sorted((n.name, n.size.name) for n in driver.list_nodes()
+                      if n.name.startswith("topo-")) == [
+                          ("topo-db", "small"), ("topo-web-1", "default")]
+
+        sizes = driver.list_sizes()
+        small, = [s for s in sizes if s.name == "small"]
+        small.extra["cpus"] += 1
+        monkeypatch.setattr(driver, "list_sizes", lambda location=None: sizes)
+        report = driver.ex_apply_topology(spec)
+        assert report["replaced"] == ["topo-db"]
+        assert [n.size.extra["cpus"] for n in driver.list_nodes()
+                if n.name == "topo-db"] == [small.extra["cpus"]]
+        monkeypatch.undo()
+    finally:
+        report = driver.ex_apply_topology({})
+    assert report["destroyed"] == ["topo", "topo-data", "topo-db",
+                                   "topo-web-1"]
+    assert report["failed"] == []
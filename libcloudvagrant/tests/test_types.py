@@ -73,6 +73,15 @@ def test_serializable_with_driver(driver):
                                             "10.0.0.2",
                                         ],
                                         "host_interface": None,
+                                    },
+                                    {
+                                        "name": "net2",
+                                        "cidr": "172.16.0.0/16",
+                                        "public": False,
+                                        "allocated": [],
+                                        "host_interface": None,
+                                        "nic_type": "virtio",
+                                        "promiscuous": "allow-vms",
                                     })
     assert_serializable_with_driver(driver,
                                     VagrantNode,
@@ -88,6 +97,7 @@ def test_serializable_with_driver(driver):
                                         },
                                         "image": {"name": "ubuntu/trusty64"},
                                         "allocate_sata_ports": 30,
+                                        "linked_clone": False,
                                     },
                                     {
                                         "id": "361f2550-bc23-4eca-ad22-49914dd8b530",
@@ -111,6 +121,7 @@ def test_serializable_with_driver(driver):
                                         },
                                         "image": {"name": "ubuntu/trusty64"},
                                         "allocate_sata_ports": 30,
+                                        "linked_clone": False,
                                     })
     assert_serializable_with_driver(driver,
                                     VagrantNodeSize,
@@ -118,6 +129,26 @@ def test_serializable_with_driver(driver):
                                         "name": "default",
                                         "ram": 2048,
                                         "cpus": 2,
+                                    },
+                                    {
+                                        "name": "limited",
+                                        "ram": 2048,
+                                        "cpus": 2,
+                                        "cpu_execution_cap": 50,
+                                        "disk_bandwidth": 20,
+                                        "network_bandwidth": 10,
+                                    },
+                                    {
+                                        "name": "tuned",
+                                        "ram": 4096,
+                                        "cpus": 4,
+                                        "paravirt_provider": "kvm",
+                                        "nested_paging": True,
+                                        "vtx_vpid": False,
+                                        "ioapic": True,
+                                        "chipset": "ich9",
+                                        "nic_type": "virtio",
+                                        "large_pages": True,
                                     })
     assert_serializable_with_driver(driver,
                                     VagrantVolume,
@@ -132,6 +163,23 @@ def test_serializable_with_driver(driver):
                                         "size": 42,
                                         "attached_to": "node1",
                                         "path": "/data/test-volume.vdi",
+                                    },
+                                    {
+                                        "name": "test-volume",
+                                        "size": 42,
+                                        "attached_to": ["node1", "node2"],
+                                        "path": "/data/test-volume.vdi",
+                                        "mtype": "multiattach",
+                                    },
+                                    {
+                                        "name": "test-volume",
+                                        "size": 42,
+                                        "attached_to": None,
+                                        "path": "/data/test-volume.vdi",
+                                        "variant": "Fixed",
+                                        "nonrotational": True,
+                                        "discard": True,
+                                        "hostiocache": False,
                                     })
 
 
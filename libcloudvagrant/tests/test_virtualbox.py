@@ -0,0 +1,252 @@
+# Copyright (c) 2014 Carlos Valiente
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Unit tests for the VirtualBox backends."""
+
+import pytest
+
+from libcloud.common.types import LibcloudError
+from libcloud.compute.types import NodeState
+
+from libcloudvagrant.common import virtualbox
+
+
+__all__ = [
+    "test_attach_volumes",
+    "test_busy_sata_ports",
+    "test_choose_sata_slot",
+    "test_differencing_volumes",
+    "test_memory_backend",
+    "test_multiattach_volumes",
+    "test_node_limits",
+    "test_snapshots",
+    "test_stop_start",
+    "test_volume_options",
+]
+
+
+def test_attach_volumes(backend):
+    """Several volumes may be attached to, and detached from, a machine at
+    once, with an error reported for each one which fails.
+
+    """
+    backend.add_machine("n1")
+    for path in ("/tmp/d1.vdi", "/tmp/d2.vdi"):
+        virtualbox.create_volume(path, 1024)
+    errors = virtualbox.attach_volumes("n1", [
+        ("/tmp/d1.vdi", False, False),
+        ("/tmp/missing.vdi", False, False),
+        ("/tmp/d2.vdi", True, False),
+    ])
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], LibcloudError)
+    assert backend.machines["n1"]["ports"] == {
+        0: "/tmp/d1.vdi",
+        1: "/tmp/d2.vdi",
+    }
+    assert virtualbox.detach_volumes(
+        "n1", ["/tmp/d1.vdi", "/tmp/d2.vdi"]) == [None, None]
+    assert backend.machines["n1"]["ports"] == {}
+
+
+def test_busy_sata_ports():
+    """The ports in use are read from the output of ``showvminfo``.
+
+    """
+    frag = "\n".join([
+        '"SATA-0-0"="/data/disk.vmdk"',
+        '"SATA-1-0"="none"',
+        '"SATA-3-0"="/data/v1.vdi"',
+        '"SATA-ImageUUID-3-0"="e4b9d1c0-7f4c-4b44-8f3e-5a8d7c6b5a40"',
+        '"IDE-0-0"="/data/cdrom.iso"',
+    ])
+    assert virtualbox.busy_sata_ports(frag, ["SATA"]) == {"SATA": 0b1001}
+
+
+def test_choose_sata_slot():
+    """Volumes are attached to the requested SATA port, or to the first free
+    one, which is then marked as busy.
+
+    """
+    busy = {"SATA": 0b11}
+    assert virtualbox.choose_sata_slot(["SATA"], busy, None) == ("SATA", 0, 2)
+    assert virtualbox.choose_sata_slot(["SATA"], busy, None) == ("SATA", 0, 3)
+    assert (virtualbox.choose_sata_slot(["SATA"], busy, "/dev/sdf") ==
+            ("SATA", 0, 5))
+    assert busy == {"SATA": 0b101111}
+    with pytest.raises(LibcloudError):
+        virtualbox.choose_sata_slot(["SATA"], busy, "/dev/sdb")
+    with pytest.raises(LibcloudError):
+        virtualbox.choose_sata_slot(["SATA"], {"SATA": (1 << 30) - 1}, None)
+    with pytest.raises(LibcloudError):
+        virtualbox.choose_sata_slot(["SATA"], busy, "/dev/hda")
+    with pytest.raises(LibcloudError):
+        virtualbox.choose_sata_slot([], busy, None)
+
+
+def test_differencing_volumes(backend):
+    """Differencing volumes have the size of their parents, which can't be
+    destroyed before them.
+
+    """
+    virtualbox.create_volume("/tmp/base.vdi", 1024)
+    virtualbox.create_differencing_volume("/tmp/child.vdi", "/tmp/base.vdi")
+    assert backend.volumes["/tmp/child.vdi"] == 1024
+    with pytest.raises(LibcloudError):
+        virtualbox.destroy_volume("/tmp/base.vdi")
+    virtualbox.destroy_volume("/tmp/child.vdi")
+    virtualbox.destroy_volume("/tmp/base.vdi")
+    assert backend.volumes == {}
+
+
+def test_memory_backend(backend):
+    """The in-memory backend is used through the module-level functions.
+
+    """
+    backend.add_machine("n1", host_interfaces=["vboxnet0"])
+    assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+    assert virtualbox.get_host_interfaces("n1") == ["vboxnet0"]
+
+    virtualbox.create_volume("/tmp/v1.vdi", 1024)
+    virtualbox.attach_volume("n1", "/tmp/v1.vdi", None)
+    assert backend.machines["n1"]["ports"] == {0: "/tmp/v1.vdi"}
+    with pytest.raises(LibcloudError):
+        virtualbox.destroy_volume("/tmp/v1.vdi")
+
+    virtualbox.detach_volume("n1", "/tmp/v1.vdi")
+    virtualbox.destroy_volume("/tmp/v1.vdi")
+    assert backend.volumes == {}
+
+    virtualbox.destroy_host_interface("vboxnet0")
+    assert backend.host_interfaces == set()
+
+    with pytest.raises(LibcloudError):
+        virtualbox.get_node_state("n2")
+
+
+def test_multiattach_volumes(backend):
+    """Multiattach volumes may be attached to several machines, and their
+    types can't be changed while attached.
+
+    """
+    backend.add_machine("n1")
+    backend.add_machine("n3")
+    virtualbox.create_volume("/tmp/shared.vdi", 1024)
+    virtualbox.set_volume_type("/tmp/shared.vdi", "multiattach")
+    virtualbox.attach_volume("n1", "/tmp/shared.vdi", None)
+    virtualbox.attach_volume("n3", "/tmp/shared.vdi", None)
+    with pytest.raises(LibcloudError):
+        virtualbox.set_volume_type("/tmp/shared.vdi", "normal")
+    virtualbox.detach_volume("n1", "/tmp/shared.vdi")
+    virtualbox.detach_volume("n3", "/tmp/shared.vdi")
+    virtualbox.destroy_volume("/tmp/shared.vdi")
+    assert backend.volumes == {}
+
+
+def test_node_limits(backend):
+    """The CPU execution cap and bandwidth limits of nodes may be changed,
+    the latter only for nodes with bandwidth groups.
+
+    """
+    backend.add_machine("n1")
+    backend.add_machine("n2", bandwidth_groups=[
+        virtualbox.DISK_BANDWIDTH_GROUP,
+    ])
+    virtualbox.set_node_limits("n1", cpu_execution_cap=50)
+    assert backend.machines["n1"]["cpu_execution_cap"] == 50
+    with pytest.raises(LibcloudError):
+        virtualbox.set_node_limits("n1", cpu_execution_cap=0)
+    with pytest.raises(LibcloudError):
+        virtualbox.set_node_limits("n1", disk_bandwidth=10)
+
+    virtualbox.set_node_limits("n2", disk_bandwidth=10)
+    assert backend.machines["n2"]["bandwidth_groups"] == {
+        virtualbox.DISK_BANDWIDTH_GROUP: 10,
+    }
+    virtualbox.create_volume("/tmp/v1.vdi", 1024)
+    with pytest.raises(LibcloudError):
+        virtualbox.attach_volume("n1", "/tmp/v1.vdi", None,
+                                 bandwidth_group="libcloud-disk")
+    virtualbox.attach_volume("n2", "/tmp/v1.vdi", None,
+                             bandwidth_group="libcloud-disk")
+    assert (backend.machines["n2"]["port_options"][0]["bandwidth_group"]
+            == "libcloud-disk")
+
+
+def test_snapshots(backend):
+    """Restoring a snapshot brings back the state and volumes of a machine.
+
+    """
+    backend.add_machine("n1")
+    virtualbox.create_volume("/tmp/v1.vdi", 1024)
+    virtualbox.take_snapshot("n1", "clean")
+
+    virtualbox.attach_volume("n1", "/tmp/v1.vdi", None)
+    backend.set_node_state("n1", "poweroff")
+    virtualbox.restore_snapshot("n1", "clean")
+    assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+    assert backend.machines["n1"]["ports"] == {}
+
+    virtualbox.delete_snapshot("n1", "clean")
+    with pytest.raises(LibcloudError):
+        virtualbox.restore_snapshot("n1", "clean")
+
+
+def test_stop_start(backend):
+    """Nodes may be stopped in several ways, and started again.
+
+    """
+    backend.add_machine("n1")
+    virtualbox.stop_node("n1", "savestate")
+    assert virtualbox.get_node_state("n1") == NodeState.SUSPENDED
+    virtualbox.start_node("n1")
+    assert virtualbox.get_node_state("n1") == NodeState.RUNNING
+    virtualbox.stop_node("n1", "acpi", timeout=0)
+    assert virtualbox.get_node_state("n1") == NodeState.STOPPED
+    with pytest.raises(LibcloudError):
+        virtualbox.stop_node("n1", "hibernate")
+
+
+def test_volume_options(backend):
+    """Volumes may be created with a storage variant and attached with
+    flags, and the host I/O cache may only be changed on stopped machines.
+
+    """
+    backend.add_machine("n1")
+    backend.add_machine("n3")
+    virtualbox.create_volume("/tmp/ssd.vdi", 1024, variant="Fixed")
+    assert backend.variants["/tmp/ssd.vdi"] == "Fixed"
+    virtualbox.attach_volume("n1", "/tmp/ssd.vdi", "/dev/sdc",
+                             nonrotational=True, discard=True)
+    assert backend.machines["n1"]["port_options"][2] == {
+        "nonrotational": True,
+        "discard": True,
+        "bandwidth_group": None,
+    }
+    with pytest.raises(LibcloudError):
+        virtualbox.set_host_io_cache("n1", True)
+    backend.set_node_state("n3", "poweroff")
+    virtualbox.set_host_io_cache("n3", True)
+    assert backend.machines["n3"]["hostiocache"]
+    virtualbox.detach_volume("n1", "/tmp/ssd.vdi")
+    assert backend.machines["n1"]["port_options"] == {}
+    virtualbox.destroy_volume("/tmp/ssd.vdi")
+    with pytest.raises(LibcloudError):
+        virtualbox.create_volume("/tmp/v2.vdi", 1024, variant="Huge")
@@ -29,12 +29,16 @@ from libcloudvagrant.tests import sample_node, sample_volume
 __all__ = [
     "test_attach_to_device",
     "test_attach_volume",
+    "test_attach_volumes",
     "test_create_volume",
     "test_destroy_volume",
     "test_destroy_node_detaches_volume",
     "test_detach_unattached",
+    "test_differencing_volume",
     "test_invalid_device",
     "test_move_volume",
+    "test_shared_volume",
+    "test_volume_options",
 ]
 
 
@@ -58,6 +62,23 @@ def test_attach_volume(driver, node, volume):
     assert volume.attached_to == node.name
 
 
+def test_attach_volumes(driver, node, volume):
+    """Several volumes may be attached and detached at once.
+
+    """
+    with sample_volume(driver) as v1, sample_volume(driver) as v2:
+        assert driver.ex_attach_volumes(node, [v1, volume, v2]) == [
+            True, True, True]
+        assert [get_volume(driver, v.name).attached_to
+                for v in (v1, volume, v2)] == [node.name] * 3
+        assert driver.ex_attach_volumes(node, [v1]) == [False]
+
+        assert driver.ex_detach_volumes([v1, v2]) == [True, True]
+        assert v1.attached_to is None
+        assert get_volume(driver, v2.name).attached_to is None
+        assert get_volume(driver, volume.name).attached_to == node.name
+
+
 def test_destroy_node_detaches_volume(driver, volume):
     """Destroying a node detaches all volumes attached to it.
 
@@ -123,6 +144,25 @@ def test_destroy_volume(driver):
     assert volume not in driver.list_volumes()
 
 
+def test_differencing_volume(driver, node, volume):
+    """Volumes may be created as differencing children of a detached
+    volume, which may not be attached nor destroyed while they exist.
+
+    """
+    child = driver.create_volume(name=uuid.uuid4().hex, size=1,
+                                 ex_base_volume=volume)
+    try:
+        assert child.size == volume.size
+        assert child.extra["base"] == volume.name
+        assert not driver.attach_volume(node, volume)
+        assert not driver.destroy_volume(volume)
+        assert driver.attach_volume(node, child)
+        assert driver.detach_volume(child)
+    finally:
+        driver.destroy_volume(child)
+    assert driver.attach_volume(node, volume)
+
+
 def test_invalid_device(driver, node, volume):
     """Volumes may only be attached to ``/dev/sd[a-z]``.
 
@@ -131,6 +171,52 @@ def test_invalid_device(driver, node, volume):
     assert driver.attach_volume(node, volume, "/dev/sdb")
 
 
+def test_shared_volume(driver, node, volume):
+    """Multi-attach volumes may be attached to several nodes at once, and
+    detached from one node at a time.
+
+    """
+    assert driver.ex_set_volume_type(volume, "multiattach")
+    assert volume.attached_to == set()
+    with sample_node(driver) as other_node:
+        assert driver.attach_volume(node, volume)
+        assert driver.attach_volume(other_node, volume)
+        assert volume.attached_to == set([node.name, other_node.name])
+        assert not driver.ex_set_volume_type(volume, "normal")
+
+        assert driver.detach_volume(volume, ex_node=other_node)
+        assert volume.attached_to == set([node.name])
+    assert get_volume(driver, volume.name).attached_to == set([node.name])
+    assert driver.detach_volume(volume)
+    assert volume.attached_to == set()
+    assert driver.ex_set_volume_type(volume, "normal")
+    assert volume.attached_to is None
+
+
+def test_volume_options(driver, node):
+    """The storage variant and attachment options of volumes are kept in
+    the catalogue, and used when they are attached again.
+
+    """
+    volume = driver.create_volume(name=uuid.uuid4().hex, size=1,
+                                  ex_variant="Fixed", ex_nonrotational=True)
+    try:
+        assert volume.path.endswith(".vdi")
+        assert driver.attach_volume(node, volume, ex_discard=True)
+        assert driver.detach_volume(volume)
+
+        volume = get_volume(driver, volume.name)
+        assert volume.variant == "Fixed"
+        assert volume.nonrotational
+        assert volume.discard
+        assert volume.hostiocache is None
+        assert driver.attach_volume(node, volume, ex_nonrotational=False)
+        assert not get_volume(driver, volume.name).nonrotational
+        assert driver.detach_volume(volume)
+    finally:
+        driver.destroy_volume(volume)
+
+
 def get_volume(driver, name):
     for v in driver.list_volumes():
         if v.name == name: